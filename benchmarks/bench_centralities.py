@@ -0,0 +1,50 @@
+import pytest
+
+from src.utils.utils_networks import (
+    bridging_centrality,
+    favor_centrality,
+    favor_statistics,
+    godfhater_index,
+)
+from src.utils.utils_features import NetworkFeatureComputation
+
+# Largest network each kernel is run on by default
+MAX_NODES = {
+    'bridging_centrality': 50,
+    'godfhater_index': 1000,
+    'favor_centrality': 3000,
+    'favor_statistics': 3000,
+    'compute_features': 50,
+}
+
+TOLERANCES = {'io': dict(tol_gfi=0.01, tol_favor=0.0001),
+              'migration': dict(tol_gfi=0.00001, tol_favor=1e-15)}
+
+CENTRALITIES = {
+    'bridging_centrality': lambda G, tols: bridging_centrality(G),
+    'godfhater_index': lambda G, tols: godfhater_index(G, tol=tols['tol_gfi']),
+    'favor_centrality': lambda G, tols: favor_centrality(G, tol=tols['tol_favor']),
+    'favor_statistics': lambda G, tols: favor_statistics(G, tol=tols['tol_favor']),
+}
+
+
+@pytest.mark.parametrize('centrality', sorted(CENTRALITIES))
+def test_centrality(benchmark, profile_memory, check_size, network, centrality, size, kind):
+    check_size(size, MAX_NODES[centrality])
+    fn = CENTRALITIES[centrality]
+
+    profile_memory(fn, network, TOLERANCES[kind])
+    benchmark.pedantic(fn, args=(network, TOLERANCES[kind]), rounds=3, warmup_rounds=0)
+
+
+def test_compute_features(benchmark, profile_memory, check_size, network, size, kind):
+    check_size(size, MAX_NODES['compute_features'])
+
+    def setup():
+        return (NetworkFeatureComputation(network.copy()),), {}
+
+    def compute(nfc):
+        nfc.compute_features(**TOLERANCES[kind])
+
+    profile_memory(compute, *setup()[0])
+    benchmark.pedantic(compute, setup=setup, rounds=3, warmup_rounds=0)
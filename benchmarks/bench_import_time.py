@@ -0,0 +1,74 @@
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Allowance for the interpreter itself in the end-to-end --help run
+INTERPRETER_STARTUP = 0.5
+
+# Entry point -> (module, modules it must not import at startup, budget option)
+ENTRY_POINTS = {
+    'cli': ('src.data.make_dataset',
+            ('pandas', 'networkx', 'scipy', 'boto3', 'sklearn', 'country_converter', 'yellowbrick', 's3fs'),
+            '--bench-import-budget-cli'),
+    'analysis_cli': ('src.analysis.make_analysis',
+                     ('papermill', 'pandas', 'yellowbrick'),
+                     '--bench-import-budget-cli'),
+    'feature_worker': ('src.utils.utils_matrix_features',
+                       ('pandas', 'boto3', 'sklearn', 'country_converter', 'yellowbrick'),
+                       '--bench-import-budget-worker'),
+}
+
+PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - start, 'modules': sorted(sys.modules)}}))
+'''
+
+
+def import_profile(module):
+    '''
+    Seconds to import `module` in a fresh interpreter, as a new worker
+    process would, and the modules it loaded
+    '''
+    out = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+@pytest.mark.parametrize('entry_point', sorted(ENTRY_POINTS))
+def test_import_time(benchmark, request, entry_point):
+    module, heavy, budget_option = ENTRY_POINTS[entry_point]
+    budget = request.config.getoption(budget_option)
+
+    profiles = []
+    benchmark.pedantic(lambda: profiles.append(import_profile(module)), rounds=5, warmup_rounds=1)
+
+    seconds = min(p['seconds'] for p in profiles)
+    benchmark.extra_info['import_seconds'] = seconds
+
+    loaded = sorted(set(heavy) & set(profiles[-1]['modules']))
+    assert not loaded, f'{module} imports {loaded} at startup'
+    assert seconds <= budget, f'{module} takes {seconds:.3f}s to import, over the {budget}s budget'
+
+
+def test_cli_help(benchmark, request):
+    budget = request.config.getoption('--bench-import-budget-cli') + INTERPRETER_STARTUP
+    command = [sys.executable, '-m', 'src.data.make_dataset', '--help']
+
+    def run():
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        timings.append(time.perf_counter() - start)
+        return result
+
+    timings = []
+    result = benchmark.pedantic(run, rounds=3, warmup_rounds=1)
+    assert result.returncode == 0, result.stderr
+    assert min(timings) <= budget, f'--help takes {min(timings):.3f}s, over the {budget:.1f}s budget'
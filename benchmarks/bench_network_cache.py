@@ -0,0 +1,59 @@
+import networkx as nx
+import pytest
+
+from src.utils import utils_networks
+from src.utils.utils_networks import clear_network_cache, network_years_generator
+
+YEARS = range(2000, 2019)
+
+
+@pytest.fixture
+def output_filepath(tmp_path):
+    for year in YEARS:
+        (tmp_path / str(year)).mkdir()
+        G = nx.DiGraph()
+        G.add_edge('ESP', 'FRA', weight=float(year))
+        nx.write_graphml(G, str(tmp_path / str(year) / 'A_country.graphml'))
+    clear_network_cache()
+    yield str(tmp_path)
+    clear_network_cache()
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    '''
+    Paths parsed from GraphML, the cache misses
+    '''
+    paths = []
+    read_graphml = nx.readwrite.graphml.read_graphml
+
+    def counting(path, *args, **kwargs):
+        paths.append(path)
+        return read_graphml(path, *args, **kwargs)
+
+    monkeypatch.setattr(utils_networks.nx.readwrite.graphml, 'read_graphml', counting)
+    return paths
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_second_pass_hits_cache(output_filepath, reads, prefetch):
+    first = list(network_years_generator(output_filepath, 'A_country', YEARS, prefetch=prefetch, cache=True))
+    second = list(network_years_generator(output_filepath, 'A_country', YEARS, prefetch=prefetch, cache=True))
+
+    assert len(reads) == len(YEARS)
+    assert all(g1 is g2 for g1, g2 in zip(first, second))
+
+
+def test_bounded_cache_evicts(output_filepath, reads):
+    list(network_years_generator(output_filepath, 'A_country', YEARS, prefetch=0, cache=4))
+    list(network_years_generator(output_filepath, 'A_country', YEARS[-4:], prefetch=0, cache=4))
+    assert len(reads) == len(YEARS)
+
+    list(network_years_generator(output_filepath, 'A_country', YEARS[:1], prefetch=0, cache=4))
+    assert len(reads) == len(YEARS) + 1
+
+
+def test_no_cache_reads_every_pass(output_filepath, reads):
+    for _ in range(2):
+        list(network_years_generator(output_filepath, 'A_country', YEARS, prefetch=0))
+    assert len(reads) == 2 * len(YEARS)
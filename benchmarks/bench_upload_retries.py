@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from botocore.client import BaseClient
+from botocore.exceptions import ClientError
+
+from offline_pipeline import s3_stand_in
+from src.utils.utils_graphml import GraphArrays
+from src.utils.utils_s3 import AsyncUploader, configure_s3_endpoint, read_npz, read_s3_graphml, s3_resource
+
+BUCKET = 'upload-retries'
+
+# S3 operations that start an upload, failed by inject_errors
+UPLOAD_OPERATIONS = {'PutObject', 'CreateMultipartUpload'}
+
+
+@pytest.fixture(scope='module')
+def bucket():
+    previous = os.environ.get('S3_ENDPOINT_URL')
+    with s3_stand_in() as url:
+        configure_s3_endpoint(url)
+        s3_resource().create_bucket(Bucket=BUCKET)
+        yield f's3://{BUCKET}'
+    if previous is None:
+        os.environ.pop('S3_ENDPOINT_URL', None)
+    else:
+        configure_s3_endpoint(previous)
+
+
+@pytest.fixture
+def inject_errors(monkeypatch):
+    '''
+    Make the first `times` upload calls fail with the S3 error `code`, as
+    raised by botocore to boto3 upload_file and s3fs; returns the calls made
+    '''
+    calls = []
+
+    def inject(code, times=1):
+        make_api_call = BaseClient._make_api_call
+
+        def failing(self, operation_name, params):
+            if operation_name in UPLOAD_OPERATIONS:
+                calls.append(operation_name)
+                if len(calls) <= times:
+                    raise ClientError({'Error': {'Code': code, 'Message': code}}, operation_name)
+            return make_api_call(self, operation_name, params)
+
+        monkeypatch.setattr(BaseClient, '_make_api_call', failing)
+        return calls
+
+    return inject
+
+
+def _write(uploader, writer, path):
+    if writer == 'graphml':
+        uploader.write_graphml(GraphArrays(['a', 'b'], [0], [1], [2.5]), f'{path}.graphml')
+    elif writer == 'parquet':
+        uploader.to_parquet(pd.DataFrame({'value': [1., 2.]}), f'{path}.parquet')
+    else:
+        uploader.write_npz({'value': np.arange(3.)}, f'{path}.npz')
+
+
+def _read(writer, path):
+    if writer == 'graphml':
+        return read_s3_graphml(f'{path}.graphml', arrays=True).weights.tolist()
+    if writer == 'parquet':
+        return pd.read_parquet(f'{path}.parquet')['value'].tolist()
+    return read_npz(f'{path}.npz')['value'].tolist()
+
+
+EXPECTED = {'graphml': [2.5], 'parquet': [1., 2.], 'npz': [0., 1., 2.]}
+
+
+@pytest.mark.parametrize('writer', ['graphml', 'parquet', 'npz'])
+def test_transient_error_retried(bucket, inject_errors, writer):
+    calls = inject_errors('SlowDown', times=1)
+    path = f'{bucket}/retried/{writer}'
+
+    with AsyncUploader(workers=1, retries=2, backoff=0.) as uploader:
+        _write(uploader, writer, path)
+
+    assert len(calls) >= 2
+    assert _read(writer, path) == EXPECTED[writer]
+
+
+@pytest.mark.parametrize('writer', ['graphml', 'parquet', 'npz'])
+def test_permanent_error_not_retried(bucket, inject_errors, writer):
+    calls = inject_errors('AccessDenied', times=10)
+
+    uploader = AsyncUploader(workers=1, retries=2, backoff=0.)
+    _write(uploader, writer, f'{bucket}/failed/{writer}')
+    with pytest.raises(RuntimeError):
+        uploader.close()
+
+    assert len(calls) == 1
@@ -0,0 +1,100 @@
+import json
+import tracemalloc
+
+import pytest
+
+from synthetic import synthetic_network
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('social capital benchmarks')
+    group.addoption('--bench-sizes', default='50,200,1000,3000',
+                    help='Comma separated number of nodes of the synthetic networks.')
+    group.addoption('--bench-densities', default='0.05,0.3,1.0',
+                    help='Comma separated edge densities of the synthetic networks.')
+    group.addoption('--bench-max-edges', type=float, default=2e6,
+                    help='Skip networks with more expected edges than this.')
+    group.addoption('--bench-no-limits', action='store_true',
+                    help='Ignore the per-kernel node limits.')
+    group.addoption('--bench-memory-baseline', default=None,
+                    help='pytest-benchmark JSON of a previous run to compare peak memory against.')
+    group.addoption('--bench-threshold', type=float, default=10.,
+                    help='Allowed peak memory regression over the baseline, in percent.')
+    group.addoption('--bench-import-budget-cli', type=float, default=0.3,
+                    help='Seconds allowed to import the command line entry points.')
+    group.addoption('--bench-import-budget-worker', type=float, default=0.6,
+                    help='Seconds allowed to import the modules a feature worker process needs.')
+
+
+def pytest_configure(config):
+    # The benchmarks measure the kernels themselves; the pipeline harness configures its own spans
+    from src.utils.utils_instrumentation import configure
+    configure(enabled=False)
+
+
+def pytest_generate_tests(metafunc):
+    config = metafunc.config
+    if 'size' in metafunc.fixturenames:
+        sizes = [int(s) for s in config.getoption('--bench-sizes').split(',')]
+        metafunc.parametrize('size', sizes)
+    if 'density' in metafunc.fixturenames:
+        densities = [float(d) for d in config.getoption('--bench-densities').split(',')]
+        metafunc.parametrize('density', densities)
+
+
+@pytest.fixture(params=['io', 'migration'])
+def kind(request):
+    return request.param
+
+
+@pytest.fixture
+def network(request, size, density, kind):
+    if size * size * density > request.config.getoption('--bench-max-edges'):
+        pytest.skip(f'more than --bench-max-edges expected edges')
+    return synthetic_network(size, density, kind=kind, seed=size)
+
+
+@pytest.fixture
+def check_size(request):
+    '''
+    Skip sizes above the node limit of a kernel unless --bench-no-limits
+    '''
+    def check(size, max_nodes):
+        if size > max_nodes and not request.config.getoption('--bench-no-limits'):
+            pytest.skip(f'above the {max_nodes} nodes limit of this kernel')
+    return check
+
+
+@pytest.fixture(scope='session')
+def memory_baseline(request):
+    path = request.config.getoption('--bench-memory-baseline')
+    if path is None:
+        return {}
+    with open(path) as f:
+        results = json.load(f)
+    return {b['fullname']: b['extra_info'].get('peak_memory_bytes') for b in results['benchmarks']}
+
+
+@pytest.fixture
+def profile_memory(request, benchmark, memory_baseline):
+    '''
+    Run the kernel once under tracemalloc, store its peak memory in the
+    benchmark results and fail if it regressed over the baseline
+    '''
+    threshold = request.config.getoption('--bench-threshold')
+
+    def profile(fn, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            fn(*args, **kwargs)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        benchmark.extra_info['peak_memory_bytes'] = peak
+
+        baseline = memory_baseline.get(request.node.nodeid)
+        if baseline and peak > baseline * (1 + threshold / 100):
+            pytest.fail(f'peak memory {peak} bytes regressed more than {threshold}% over {baseline} bytes')
+
+    return profile
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""End-to-end build of the dataset on synthetic raw data against a local S3
+stand-in, reporting the instrumentation spans (wall and CPU time, peak RSS,
+bytes read/written) of every stage.
+
+    python benchmarks/offline_pipeline.py --countries 40 --industries 20 --years 2005 2006
+
+Without --endpoint-url a moto server is started in-process (requires
+`moto[server]`); pass the URL of a running MinIO to use it instead.
+"""
+import os
+import sys
+import json
+import click
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from src.utils.utils_s3 import configure_s3_endpoint, s3_resource
+from src.utils import utils_instrumentation as instrumentation
+from src.data.synthetic_data import SyntheticRawData
+from src.data import make_dataset
+
+
+@contextmanager
+def s3_stand_in(endpoint_url=None):
+    '''
+    Yields the endpoint of the S3 stand-in, starting a moto server when no
+    endpoint is given
+    '''
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+    if endpoint_url is not None:
+        yield endpoint_url
+        return
+
+    from moto.server import ThreadedMotoServer
+
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+    server.start()
+    try:
+        host, port = server.get_host_and_port()
+        yield f'http://{host}:{port}'
+    finally:
+        server.stop()
+
+
+def run_pipeline(bucket, countries, industries, years, seed=0, resolution='country', backbones=None,
+                 upload_queue=8, windows=(), embeddings=()):
+    '''
+    Spans of every stage of make_dataset.build_dataset on synthetic raw
+    data, one row per (year, layer, stage)
+    '''
+    instrumentation.configure(enabled=True, path='')
+    instrumentation.reset()
+    span = instrumentation.span
+
+    input_filepath = f's3://{bucket}/raw'
+    icio_filepath = f's3://{bucket}/icio'
+    output_filepath = f's3://{bucket}/processed'
+
+    with span('synthetic_data'):
+        SyntheticRawData(input_filepath, icio_filepath=icio_filepath,
+                         n_countries=countries, n_industries=industries,
+                         years=years, seed=seed).run()
+
+    # The build itself, as make_dataset runs it, spans kept in memory
+    make_dataset.build_dataset(input_filepath, output_filepath, years=years, icio_filepath=icio_filepath,
+                               resolution=resolution, backbones=backbones, upload_queue=upload_queue,
+                               windows=windows, embeddings=embeddings)
+
+    df_report = pd.DataFrame(instrumentation.recorded_spans())
+    for column in ['peak_rss_bytes', 'peak_rss_delta_bytes']:
+        df_report[column.replace('bytes', 'mb')] = df_report.pop(column) / 2**20
+
+    return df_report
+
+
+@click.command()
+@click.option("--countries", type=int, default=30, show_default=True)
+@click.option("--industries", type=int, default=10, show_default=True)
+@click.option("--years", type=int, multiple=True, default=(2005, 2006), show_default=True)
+@click.option("--endpoint-url", default=None, help="Running S3 stand-in (e.g. MinIO); moto if omitted.")
+@click.option("--bucket", default="social-capital-benchmark", show_default=True)
+@click.option("--resolution", type=click.Choice(['country', 'industry']), default="country", show_default=True)
+@click.option("--backbone", "backbones", multiple=True, callback=make_dataset.parse_backbones,
+              metavar="LAYER=METHOD[:VALUE]", help="Backbone filter of a layer, as in make_dataset.")
+@click.option("--upload-queue", type=int, default=8, show_default=True,
+              help="Pending background uploads before blocking; 0 uploads synchronously.")
+@click.option("--window", "windows", type=click.IntRange(min=1), multiple=True,
+              help="Rolling-window lengths of the multi-year networks, as in make_dataset.")
+@click.option("--embedding", "embeddings", type=click.Choice(make_dataset.EMBEDDING_METHODS), multiple=True,
+              help="Node embedding methods, as in make_dataset.")
+@click.option("--report", "report_path", default="reports/benchmarks/offline_pipeline.json", show_default=True)
+def main(countries, industries, years, endpoint_url, bucket, resolution, backbones, upload_queue, windows, embeddings, report_path):
+    """Builds the whole dataset from synthetic raw data on a local S3
+    stand-in and reports the spans of every stage.
+    """
+    with s3_stand_in(endpoint_url) as url:
+        configure_s3_endpoint(url)
+        s3_resource().create_bucket(Bucket=bucket)
+
+        df_report = run_pipeline(bucket, countries, industries, sorted(years), resolution=resolution,
+                                 backbones=backbones, upload_queue=upload_queue, windows=windows,
+                                 embeddings=embeddings)
+
+    columns = ['year', 'layer', 'stage', 'wall_seconds', 'cpu_seconds', 'process_cpu_seconds', 'peak_rss_mb',
+               'peak_rss_delta_mb', 'read_bytes', 'write_bytes']
+    print(df_report[columns].to_string(index=False))
+    print(df_report.groupby('stage').agg({'wall_seconds': 'sum', 'cpu_seconds': 'sum', 'process_cpu_seconds': 'sum',
+                                          'peak_rss_mb': 'max'}))
+
+    os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+    with open(report_path, 'w') as f:
+        json.dump(dict(countries=countries, industries=industries, years=list(years), resolution=resolution,
+                       stages=df_report.to_dict(orient='records')), f, indent=2)
+
+
+if __name__ == "__main__":
+    log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    main()
@@ -0,0 +1,38 @@
+import numpy as np
+import networkx as nx
+
+
+def synthetic_adjacency(n, density, kind='io', seed=0):
+    '''
+    Seeded weighted adjacency matrix that mimics either the IO networks
+    (allocation shares with a heavy domestic diagonal and rows summing below
+    one) or the migration network (sparse, heavy-tailed inflows divided by
+    the working population of the origin country)
+    '''
+    rng = np.random.default_rng(seed)
+    mask = rng.random((n, n)) < density
+
+    if kind == 'io':
+        g = rng.lognormal(mean=0., sigma=2., size=(n, n)) * mask
+        np.fill_diagonal(g, g.sum(axis=1) + 1.)
+        g = g / g.sum(axis=1, keepdims=True) * rng.uniform(0.3, 0.9, size=(n, 1))
+
+    elif kind == 'migration':
+        g = rng.pareto(1.5, size=(n, n)) * mask
+        np.fill_diagonal(g, 0.)
+        g = g / rng.lognormal(mean=15., sigma=1.5, size=(n, 1))
+
+    else:
+        raise ValueError(f'Unknown network kind {kind}')
+
+    return g
+
+
+def synthetic_network(n, density, kind='io', seed=0):
+    '''
+    networkx DiGraph of synthetic_adjacency with country-like string labels
+    '''
+    g = synthetic_adjacency(n, density, kind=kind, seed=seed)
+    G = nx.from_numpy_array(g, create_using=nx.DiGraph)
+
+    return nx.relabel_nodes(G, {i: f'N{i:04d}' for i in range(n)})
@@ -0,0 +1,192 @@
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from utils import CACHE_PATH
+
+CORRELATION_CACHE_PATH = os.path.join(CACHE_PATH, 'correlations')
+
+CENTRALITIES = ['hubs', 'authorities', 'pagerank', 'gfi', 'bridging', 'in_favor', 'out_favor']
+LAYERS = ['financial', 'goods', 'human']
+METHODS = ('pearson', 'spearman')
+
+_stack_cache = {}
+
+
+def panel_cube(df, metrics, index='year', columns='country'):
+    '''
+    The panel pivoted once into a (metric x year x country) array, with the
+    mean of duplicated (year, country) rows as pivot_table takes it.
+    Returns (cube, years, countries).
+    '''
+    df_grid = df.groupby([index, columns])[metrics].mean().unstack(columns)
+    years = df_grid.index.to_numpy()
+    countries = df_grid.columns.get_level_values(1).unique().sort_values()
+    df_grid = df_grid.reindex(columns=pd.MultiIndex.from_product([metrics, countries]))
+
+    cube = df_grid.to_numpy(dtype=float).reshape(len(years), len(metrics), len(countries)).transpose(1, 0, 2)
+    return cube, years, countries.to_numpy()
+
+
+def nan_pearson(cube, min_periods=1):
+    '''
+    Pairwise-complete Pearson correlations between the columns of every
+    (year x country) slice of cube, as DataFrame.corr computes them, for all
+    the slices at once: with M the observed mask and X the centered values
+    (0 where missing), the pair counts, sums and cross-products over the
+    years both columns are observed are the batched products M'M, X'M, X'X
+    and (X^2)'M. Returns (correlations, pair counts), both (metric x
+    country x country).
+    '''
+    mask = ~np.isnan(cube)
+    M = mask.astype(float)
+
+    # Centering on the column means keeps the one-pass sums accurate
+    means = np.nanmean(np.where(mask.any(axis=1, keepdims=True), cube, 0.), axis=1, keepdims=True)
+    X = np.where(mask, cube - means, 0.)
+
+    Xt, Mt = X.transpose(0, 2, 1), M.transpose(0, 2, 1)
+    n = Mt @ M
+    sx = Xt @ M
+    sxx = (X * X).transpose(0, 2, 1) @ M
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = Xt @ X - sx * sx.transpose(0, 2, 1) / n
+        var_x = sxx - sx ** 2 / n
+        var_y = var_x.transpose(0, 2, 1)
+        corr = np.clip(cov / np.sqrt(var_x * var_y), -1., 1.)
+
+    corr[(n < max(min_periods, 2)) | ~(var_x > 0) | ~(var_y > 0)] = np.nan
+    return corr, n.astype(np.int64)
+
+
+def nan_spearman(cube, min_periods=1):
+    '''
+    Pairwise-complete Spearman correlations, as DataFrame.corr computes them:
+    every pair of countries is ranked over the years both are observed
+    (ties averaged). With M the observed mask, the rank of country i in
+    year t among the years country j is observed is
+        R[i, t, j] = 1 + sum_s M[s, j] ([x_i(s) < x_i(t)] + [x_i(s) = x_i(t), s != t] / 2)
+    a batched product over the years, so that the ranks and Pearson sums
+    of all the pairs of a metric are computed at once. Returns
+    (correlations, pair counts), both (metric x country x country).
+    '''
+    mask = ~np.isnan(cube)
+    others = ~np.eye(cube.shape[1], dtype=bool)[:, :, None]
+
+    corr = np.empty((cube.shape[0], cube.shape[2], cube.shape[2]))
+    n = np.empty(corr.shape, dtype=np.int64)
+    for k, (x, M) in enumerate(zip(cube, mask.astype(float))):
+        # (year s x year t x country) comparisons within every country
+        below = (x[:, None, :] < x[None, :, :]) + 0.5 * ((x[:, None, :] == x[None, :, :]) & others)
+        R = 1. + below.transpose(2, 1, 0) @ M
+
+        # (country i x country j x year) ranks of i, over the common years only
+        common = M.T[:, None, :] * M.T[None, :, :]
+        X = np.where(common > 0, R.transpose(0, 2, 1), 0.)
+        Y = X.transpose(1, 0, 2)
+
+        pairs = common.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sx, sy = X.sum(axis=2), Y.sum(axis=2)
+            cov = (X * Y).sum(axis=2) - sx * sy / pairs
+            var_x = (X * X).sum(axis=2) - sx ** 2 / pairs
+            var_y = var_x.T
+            corr[k] = np.clip(cov / np.sqrt(var_x * var_y), -1., 1.)
+
+        # Ranks are multiples of 1/2, so constant ones have a zero variance up to rounding
+        corr[k][(pairs < max(min_periods, 2)) | ~(var_x > 1e-9) | ~(var_y > 1e-9)] = np.nan
+        n[k] = pairs
+    return corr, n
+
+
+class CorrelationStack:
+    '''
+    Country x country correlation matrices of every metric of a panel, by
+    method, as (metric x country x country) arrays, with the number of years
+    each pair is observed together
+    '''
+    def __init__(self, metrics, countries, correlations, observations):
+        self.metrics = list(metrics)
+        self.countries = np.asarray(countries)
+        self.correlations = correlations
+        self.observations = observations
+
+    @classmethod
+    def from_cube(cls, cube, countries, metrics, methods=METHODS, min_periods=1):
+        functions = {'pearson': nan_pearson, 'spearman': nan_spearman}
+        correlations = {}
+        for method in methods:
+            correlations[method], observations = functions[method](cube, min_periods=min_periods)
+        return cls(metrics, countries, correlations, observations)
+
+    def frame(self, metric, method='pearson'):
+        '''
+        Correlation DataFrame of one metric over the countries observed at
+        least once, as df.pivot_table(...).corr() gives it
+        '''
+        k = self.metrics.index(metric)
+        observed = np.diag(self.observations[k]) > 0
+        return pd.DataFrame(self.correlations[method][k][np.ix_(observed, observed)],
+                            index=pd.Index(self.countries[observed], name='country'),
+                            columns=pd.Index(self.countries[observed], name='country'))
+
+    def save(self, path):
+        # Uncompressed: compressing the float matrices costs more than reading them
+        np.savez(path, metrics=np.array(self.metrics), countries=self.countries.astype(str),
+                 observations=self.observations.astype(np.int32),
+                 **{f'correlations_{m}': c for m, c in self.correlations.items()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            correlations = {name[len('correlations_'):]: f[name] for name in f.files
+                            if name.startswith('correlations_')}
+            return cls(f['metrics'].tolist(), f['countries'], correlations, f['observations'])
+
+
+def _stack_key(cube, years, countries, metrics, methods, min_periods):
+    h = hashlib.sha256()
+    h.update(np.ascontiguousarray(cube).tobytes())
+    h.update(repr([list(map(str, years)), list(map(str, countries)), list(metrics), list(methods),
+                   min_periods]).encode())
+    return h.hexdigest()[:24]
+
+
+def correlation_stack(df, metrics=None, methods=METHODS, min_periods=1, cache=True):
+    '''
+    CorrelationStack of the (year x country) correlations of every metric of
+    the panel df, by default every centrality of every layer, e.g.
+
+        stack = correlation_stack(df_model)
+        sns.clustermap(stack.frame('financial_gfi', 'spearman').fillna(0))
+
+    The panel is pivoted once (panel_cube) and every metric is correlated
+    in the same batched masked products. The stack is cached in memory and
+    in CORRELATION_CACHE_PATH, keyed by the pivoted values, so that
+    re-plotting reuses it.
+    '''
+    metrics = list(metrics or [f'{layer}_{c}' for layer in LAYERS for c in CENTRALITIES])
+    cube, years, countries = panel_cube(df, metrics)
+
+    if not cache:
+        return CorrelationStack.from_cube(cube, countries, metrics, methods, min_periods)
+
+    key = _stack_key(cube, years, countries, metrics, methods, min_periods)
+    if key in _stack_cache:
+        return _stack_cache[key]
+
+    cache_file = os.path.join(CORRELATION_CACHE_PATH, f'{key}.npz')
+    if os.path.exists(cache_file):
+        stack = CorrelationStack.load(cache_file)
+    else:
+        stack = CorrelationStack.from_cube(cube, countries, metrics, methods, min_periods)
+        os.makedirs(CORRELATION_CACHE_PATH, exist_ok=True)
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp.npz'
+        stack.save(tmp_file)
+        os.replace(tmp_file, cache_file)
+
+    _stack_cache[key] = stack
+    return stack
@@ -0,0 +1,213 @@
+import os
+import sys
+import gzip
+import json
+import pickle
+import hashlib
+import inspect
+import importlib
+
+import numpy as np
+import pandas as pd
+
+from utils import CACHE_PATH
+
+FIT_CACHE_PATH = os.path.join(CACHE_PATH, 'fits')
+
+# Results attributes kept in the compact record of a fit, when the results have them
+DIAGNOSTICS = ['nobs', 'rsquared', 'rsquared_adj', 'f_statistic', 'j_stat', 'sargan', 'basmann',
+               'wooldridge_overid', 'iterations', 's2']
+
+_fit_cache = {}
+
+
+def _update_data_hash(h, value):
+    '''
+    Hash of the values, index, names and dtypes of a pandas object or of the
+    values of an array
+    '''
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        h.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+        names = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+        dtypes = list(value.dtypes) if isinstance(value, pd.DataFrame) else [value.dtype]
+        h.update(json.dumps([names, list(value.index.names), dtypes], default=str).encode())
+    else:
+        value = np.ascontiguousarray(value)
+        h.update(json.dumps([value.shape, str(value.dtype)]).encode())
+        h.update(value.tobytes())
+
+
+def _is_data(value):
+    return isinstance(value, (pd.DataFrame, pd.Series, np.ndarray))
+
+
+def _source(obj):
+    '''
+    Source of a class or function or, for a class whose module has no file
+    (a notebook cell), of its methods, which keep their cell's source; None
+    when not available
+    '''
+    try:
+        return inspect.getsource(obj)
+    except (TypeError, OSError):
+        pass
+    if not inspect.isclass(obj):
+        return None
+
+    methods = [m for m in vars(obj).values() if inspect.isfunction(m)]
+    try:
+        return ''.join(inspect.getsource(m) for m in methods) or None
+    except (TypeError, OSError):
+        return None
+
+
+def _estimator_fingerprint(estimator):
+    '''
+    Name of the estimator with, for it and every class it derives from, the
+    version of their package or, for those defined in a local file (e.g.
+    PanelLaggedDep in arellano_bond.py, a linearmodels IVGMM), the hash of
+    that file, so that changing the estimator or what it builds on
+    invalidates its fits. Classes without a source file (defined in a
+    notebook cell or in __main__) are hashed by their source, and None is
+    returned when it is not available either.
+    '''
+    versions, sources = {}, {}
+    for cls in inspect.getmro(estimator) if inspect.isclass(estimator) else [estimator]:
+        package = cls.__module__.split('.')[0]
+        if package == 'builtins':
+            continue
+        versions[package] = getattr(importlib.import_module(package), '__version__', None)
+
+        try:
+            path = inspect.getsourcefile(cls)
+        except (TypeError, OSError):  # built-in, or without a source file
+            path = None
+        if path and 'site-packages' in path:
+            continue
+
+        if path and os.path.isfile(path):
+            if path not in sources:
+                with open(path, 'rb') as f:
+                    sources[path] = hashlib.sha256(f.read()).hexdigest()
+        elif versions[package] is None:
+            source = _source(cls)
+            if source is None:
+                return None
+            sources[f'{cls.__module__}.{cls.__qualname__}'] = hashlib.sha256(source.encode()).hexdigest()
+
+    return [estimator.__module__, estimator.__qualname__, sorted(versions.items()), sorted(sources.values())]
+
+
+def fit_key(estimator, args, kwargs, fit_kwargs):
+    '''
+    Fingerprint of a fit: the estimator, the design data passed to it
+    (hashed with pd.util.hash_pandas_object), its options and the fit
+    options; None when the estimator cannot be fingerprinted
+    '''
+    fingerprint = _estimator_fingerprint(estimator)
+    if fingerprint is None:
+        return None
+
+    h = hashlib.sha256()
+    for value in list(args) + [kwargs[k] for k in sorted(kwargs)]:
+        if _is_data(value):
+            _update_data_hash(h, value)
+
+    spec = dict(estimator=fingerprint,
+                args=[None if _is_data(v) else v for v in args],
+                kwargs={k: None if _is_data(v) else v for k, v in kwargs.items()},
+                data_kwargs=sorted(k for k, v in kwargs.items() if _is_data(v)),
+                fit_kwargs=fit_kwargs, python=sys.version_info[:2])
+    h.update(json.dumps(spec, sort_keys=True, default=repr).encode())
+    return h.hexdigest()[:24]
+
+
+def fit_record(results):
+    '''
+    Compact record of a fitted model: parameters, covariance and the
+    diagnostics in DIAGNOSTICS the results provide
+    '''
+    diagnostics = {}
+    for name in DIAGNOSTICS:
+        try:
+            value = getattr(results, name)
+        except Exception:
+            continue
+        # linearmodels test statistics (WaldTestStatistic) carry stat and pval
+        if hasattr(value, 'stat') and hasattr(value, 'pval'):
+            value = {'stat': float(value.stat), 'pval': float(value.pval)}
+        elif np.ndim(value) == 0 and value is not None:
+            value = float(value)
+        else:
+            continue
+        diagnostics[name] = value
+
+    return {'params': pd.Series(results.params), 'cov': pd.DataFrame(results.cov), 'diagnostics': diagnostics}
+
+
+def _cache_file(key):
+    return os.path.join(FIT_CACHE_PATH, f'{key}.pkl.gz')
+
+
+def load_fit_record(key):
+    '''
+    The fit_record of a cached fit, without unpickling its results
+    '''
+    with gzip.open(_cache_file(key), 'rb') as f:
+        return pickle.load(f)
+
+
+def cached_fit(estimator, *args, fit_kwargs=None, cache=True, **kwargs):
+    '''
+    estimator(*args, **kwargs).fit(**fit_kwargs), e.g.
+
+        results = cached_fit(IVGMM, y, exog, endog, instruments, fit_kwargs=dict(cov_type='robust'))
+        results = cached_fit(PanelLaggedDep, endog=df['log_gdp'], exogs=df[terms], weight_type='clustered')
+
+    The fit is keyed by fit_key and stored gzipped in FIT_CACHE_PATH (the
+    results object and its compact fit_record), so that re-running a
+    notebook returns the cached results, without building the estimator,
+    as long as the data, the specification and the estimator are the same.
+    Estimators whose source cannot be read are fitted without the cache.
+    '''
+    fit_kwargs = fit_kwargs or {}
+    if not cache:
+        return estimator(*args, **kwargs).fit(**fit_kwargs)
+
+    key = fit_key(estimator, args, kwargs, fit_kwargs)
+    if key is None:
+        return estimator(*args, **kwargs).fit(**fit_kwargs)
+    if key in _fit_cache:
+        return _fit_cache[key]
+
+    cache_file = _cache_file(key)
+    if os.path.exists(cache_file):
+        with gzip.open(cache_file, 'rb') as f:
+            pickle.load(f)
+            results = pickle.load(f)
+        _fit_cache[key] = results
+        return results
+
+    results = estimator(*args, **kwargs).fit(**fit_kwargs)
+
+    os.makedirs(FIT_CACHE_PATH, exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    with gzip.open(tmp_file, 'wb', compresslevel=6) as f:
+        # The record first, so that load_fit_record reads it alone
+        pickle.dump(fit_record(results), f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)
+
+    _fit_cache[key] = results
+    return results
+
+
+def clear_fit_cache(disk=False):
+    '''
+    Forget the fits kept in memory and, with disk, the cached files
+    '''
+    _fit_cache.clear()
+    if disk and os.path.isdir(FIT_CACHE_PATH):
+        for name in os.listdir(FIT_CACHE_PATH):
+            if name.endswith('.pkl.gz'):
+                os.remove(os.path.join(FIT_CACHE_PATH, name))
@@ -1,13 +1,112 @@
 import pandas as pd
 import os
+import json
+import hashlib
+import operator
 import numpy as np
 
-def data_loader(output_filepath):
-    
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache')
+
+_FILTER_OPERATORS = {
+    '==': operator.eq, '=': operator.eq, '!=': operator.ne,
+    '<': operator.lt, '<=': operator.le, '>': operator.gt, '>=': operator.ge,
+    'in': lambda s, v: s.isin(v), 'not in': lambda s, v: ~s.isin(v),
+}
+
+_panel_cache = {}
+
+
+def _panel_cache_key(data_path, **params):
+    '''
+    Key of a transformed panel: its parameters plus, for local files, the
+    size and modification time of the source parquet
+    '''
+    source = None
+    if os.path.exists(data_path):
+        stat = os.stat(data_path)
+        source = [stat.st_size, stat.st_mtime_ns]
+
+    key = json.dumps(dict(params, data_path=data_path, source=source), sort_keys=True, default=str)
+    return hashlib.sha256(key.encode()).hexdigest()[:16], source is not None
+
+
+def _apply_filters(df, filters):
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        mask &= _FILTER_OPERATORS[op](df[column], value).values
+    return df[mask]
+
+
+def load_analysis_panel(output_filepath,
+                        years=(1990, 2016),
+                        columns=None,
+                        filters=(),
+                        dropna=(),
+                        expressions=None,
+                        log_columns=(),
+                        cache=True):
+    '''
+    Load panel_data.parquet reading only `columns` (all if None), with the
+    log, filter and dropna columns, and the rows in the `years` window that
+    satisfy `filters`, a list of (column, op, value) tuples pushed down into
+    the Parquet read. `expressions` maps new columns to `DataFrame.eval`
+    expressions over the read columns, and `log_columns` are transformed
+    with log1p(x*1e8).
+
+    Transformed panels are cached in memory and, for local files, on disk,
+    keyed by the parameters and the source file.
+    '''
     data_path = os.path.join(output_filepath, 'panel_data.parquet')
-    df_model = pd.read_parquet(data_path)
 
-    df_model = df_model[df_model.year.between(1990, 2016)]
+    filters = [tuple(f) for f in filters]
+    if years is not None:
+        filters = [('year', '>=', years[0]), ('year', '<=', years[1])] + filters
+
+    key, local = _panel_cache_key(data_path, years=years, columns=columns, filters=filters,
+                                  dropna=list(dropna), expressions=expressions,
+                                  log_columns=list(log_columns))
+    cache_file = os.path.join(CACHE_PATH, f'panel_{key}.parquet')
+
+    if cache and key in _panel_cache:
+        return _panel_cache[key].copy()
+
+    if cache and local and os.path.exists(cache_file):
+        df_model = pd.read_parquet(cache_file)
+        _panel_cache[key] = df_model
+        return df_model.copy()
+
+    read_columns = None
+    if columns is not None:
+        # The log columns are read too, unless an expression computes them
+        read_columns = list(dict.fromkeys(['country', 'year'] + list(columns) +
+                                          [c for c in log_columns if c not in (expressions or {})] +
+                                          [c for c, _, _ in filters] + list(dropna)))
+
+    df_model = pd.read_parquet(data_path, columns=read_columns, filters=filters or None)
+
+    # Row-group statistics only prune coarsely on some pyarrow versions
+    df_model = _apply_filters(df_model, filters)
+    df_model = df_model.dropna(subset=list(dropna)) if dropna else df_model
+
+    for column, expression in (expressions or {}).items():
+        df_model[column] = df_model.eval(expression)
+
+    log_columns = list(log_columns)
+    if log_columns:
+        df_model[log_columns] = np.log1p(df_model[log_columns].astype(float) * 1.e8)
+
+    df_model = df_model.sort_values(by=['country', 'year'])
+
+    if cache:
+        _panel_cache[key] = df_model
+        if local:
+            os.makedirs(CACHE_PATH, exist_ok=True)
+            df_model.to_parquet(cache_file)
+
+    return df_model.copy()
+
+
+def data_loader(output_filepath):
 
     centralities = ['hubs', 'authorities','pagerank', 'gfi', 'bridging', 'favor']
     centralities = ['hubs', 'authorities', 'in_favor', 'out_favor']
@@ -15,12 +114,17 @@ def data_loader(output_filepath):
 
     #df_model = df_model[~df_model.country.isin(['ETH', 'BLR', 'ZWE', 'MDA', 'GUY', 'VNM', 'MAC', 'PSE', 'AGO', 'COD', 'TZA'])]
 
-    df_model.dropna(subset=['log_GFCF'], inplace=True)
-    df_model = df_model[(df_model.log_GFCF>0)&(df_model.log_gdp>0)&(~df_model.financial_hubs.isnull())]
+    # Outcomes, controls and the inputs of the productivity, the centralities are read as log_columns
+    columns = ['log_gdp', 'log_output', 'gini', 'log_GFCF', 'log_wkn_population', 'constant',
+               'gdp', 'wkn_population', 'GFCF']
 
-    df_model.eval('productivity = gdp*10**6/(wkn_population**0.3*GFCF**0.7)', inplace=True)
-    for c in [f'{n}_{c}' for c in centralities for n in networks] + ['productivity']:
-        df_model[c] = df_model[c].map(lambda x: np.log1p(x*1.e8))
+    df_model = load_analysis_panel(output_filepath,
+                                   years=(1990, 2016),
+                                   columns=columns,
+                                   filters=[('log_GFCF', '>', 0), ('log_gdp', '>', 0)],
+                                   dropna=['log_GFCF', 'financial_hubs'],
+                                   expressions={'productivity': 'gdp*10**6/(wkn_population**0.3*GFCF**0.7)'},
+                                   log_columns=[f'{n}_{c}' for c in centralities for n in networks] + ['productivity'])
 
     #df_model = df_model[df_model.wkn_population>5*1.e6]
 
@@ -29,10 +133,8 @@ def data_loader(output_filepath):
     for direction in ['in', 'out']:
         for network in ['goods', 'financial']:
             reduced_terms_list.remove(f'{network}_{direction}_favor')
-    
-    reduced_terms_list.remove('human_out_favor')    
-    reduced_terms_list.remove('human_authorities')
 
-    df_model.sort_values(by = ['country', 'year'], inplace=True)    
+    reduced_terms_list.remove('human_out_favor')
+    reduced_terms_list.remove('human_authorities')
 
-    return reduced_terms_list, df_model
\ No newline at end of file
+    return reduced_terms_list, df_model
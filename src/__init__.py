@@ -1 +0,0 @@
-from yellowbrick.regressor import ResidualsPlot
\ No newline at end of file
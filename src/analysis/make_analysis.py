@@ -1,40 +1,211 @@
 # -*- coding: utf-8 -*-
 import os
+import json
+import glob
+import time
 import click
+import hashlib
 import logging
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import find_dotenv, load_dotenv
 
-import papermill as pm
+PANEL = ["panel_data.parquet"]
+GRAPHS = ["*/A_country.graphml", "*/migration_network.graphml"]
+EDGE_WEIGHTS = ["*/A_country_weights.npz", "*/migration_network_weights.npz"]
+EMBEDDINGS = ["*/A_country_embedding_*.parquet", "*/migration_network_embedding_*.parquet"]
+
+# Declared dependencies of every analysis notebook:
+#   inputs     -> artifacts (glob patterns) relative to the data filepath
+#   code       -> source files, relative to the notebooks filepath, the
+#                 notebook imports from
+#   depends_on -> notebooks that must have finished before this one starts
+NOTEBOOKS = {
+    "01_01_linear_models_social_capital.ipynb": dict(
+        inputs=PANEL, code=["utils.py", "arellano_bond.py", "estimation_cache.py"], depends_on=[]),
+    "01_02_non_linear_regression_models.ipynb": dict(
+        inputs=PANEL, code=["utils.py"], depends_on=[]),
+    "02_PowerlawDistribution.ipynb": dict(
+        inputs=EDGE_WEIGHTS, code=["../src/utils/utils_weights.py"], depends_on=[]),
+    "03_tSNE_representations.ipynb": dict(
+        inputs=GRAPHS + EMBEDDINGS, code=["../src/utils/utils_s3.py"], depends_on=[]),
+    "04_NetworkDescripiton.ipynb": dict(
+        inputs=GRAPHS, code=["../src/utils/utils_descriptors.py", "../src/utils/utils_networks.py",
+                             "../src/utils/utils_graphml.py"], depends_on=[]),
+    "05_NetworkEfficiency.ipynb": dict(
+        inputs=GRAPHS, code=["../src/utils/utils_networks.py"], depends_on=[]),
+    "06_ECI_correlation.ipynb": dict(
+        inputs=PANEL, code=["utils.py"], depends_on=[]),
+    "07_diversity_orthogonality.ipynb": dict(
+        inputs=PANEL, code=["utils.py"], depends_on=[]),
+    "08_dynamic_range_centralities.ipynb": dict(
+        inputs=PANEL + GRAPHS, code=["../src/utils/utils_networks.py"], depends_on=[]),
+    "09_correlation_structure.ipynb": dict(
+        inputs=PANEL, code=["utils.py", "correlation_structure.py"], depends_on=[]),
+}
+
+CACHE_FILE = ".analysis_cache.json"
+SUMMARY_FILE = "summary.json"
+
+
+def _update_file_hash(h, path, chunk_size=1 << 20):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+
+
+def notebook_fingerprint(notebooks_filepath, data_filepath, notebook, spec,
+                         parameters, upstream_fingerprints):
+    '''
+    Hash of the notebook source, its code dependencies, its parameters, its
+    input artifacts and the fingerprints of the notebooks it depends on
+    '''
+    h = hashlib.sha256()
+    _update_file_hash(h, os.path.join(notebooks_filepath, notebook))
+
+    for code_path in spec["code"]:
+        path = os.path.join(notebooks_filepath, code_path)
+        h.update(code_path.encode())
+        if os.path.exists(path):
+            _update_file_hash(h, path)
+
+    h.update(json.dumps(parameters, sort_keys=True).encode())
+
+    for pattern in spec["inputs"]:
+        h.update(pattern.encode())
+        for path in sorted(glob.glob(os.path.join(data_filepath, pattern))):
+            h.update(os.path.relpath(path, data_filepath).encode())
+            _update_file_hash(h, path)
+
+    for upstream in spec["depends_on"]:
+        h.update(upstream_fingerprints[upstream].encode())
+
+    return h.hexdigest()
+
+
+def _read_json(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_json(obj, path):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2, sort_keys=True)
+
+
+def _execute(notebooks_filepath, notebook, parameters):
+    import papermill as pm
+
+    start = time.time()
+    pm.execute_notebook(os.path.join(notebooks_filepath, notebook),
+                        os.path.join(notebooks_filepath, 'runs', notebook),
+                        parameters=parameters,
+                        kernel_name='social_capital_in_trade_networks')
+    return time.time() - start
+
+
+def run_notebooks(notebooks_filepath, data_filepath, notebooks=NOTEBOOKS,
+                  max_workers=None, force=False):
+    '''
+    Execute the notebooks concurrently, each one in its own kernel, as soon
+    as the notebooks they depend on have finished. Notebooks whose
+    fingerprint matches the previous run are skipped.
+    '''
+    logger = logging.getLogger(__name__)
+
+    runs_path = os.path.join(notebooks_filepath, 'runs')
+    os.makedirs(runs_path, exist_ok=True)
+
+    cache_path = os.path.join(runs_path, CACHE_FILE)
+    cache = _read_json(cache_path)
+
+    parameters = dict(output_filepath=data_filepath)
+
+    unknown = {d for spec in notebooks.values() for d in spec["depends_on"]} - set(notebooks)
+    if unknown:
+        raise ValueError(f"Undeclared notebook dependencies: {sorted(unknown)}")
+
+    pending = dict(notebooks)
+    fingerprints, summary, running = {}, {}, {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+
+            for notebook, spec in list(pending.items()):
+                upstream = [summary.get(d, {}).get("status") for d in spec["depends_on"]]
+                if any(s is None or s == "running" for s in upstream):
+                    continue
+                del pending[notebook]
+
+                if any(s in ("failed", "skipped") for s in upstream):
+                    logger.warning("Skipping %s: a dependency did not run", notebook)
+                    summary[notebook] = dict(status="skipped", seconds=0.)
+                    continue
+
+                fingerprint = notebook_fingerprint(
+                    notebooks_filepath, data_filepath, notebook, spec,
+                    parameters, fingerprints)
+                fingerprints[notebook] = fingerprint
+
+                output_exists = os.path.exists(os.path.join(runs_path, notebook))
+                if not force and output_exists and cache.get(notebook) == fingerprint:
+                    logger.info("Up to date, not executing %s", notebook)
+                    summary[notebook] = dict(status="cached", seconds=0.,
+                                             fingerprint=fingerprint)
+                    continue
+
+                logger.info("Executing %s", notebook)
+                summary[notebook] = dict(status="running", fingerprint=fingerprint)
+                future = executor.submit(_execute, notebooks_filepath, notebook, parameters)
+                running[future] = notebook
+
+            if not running:
+                if pending:
+                    raise ValueError(f"Circular notebook dependencies: {sorted(pending)}")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                notebook = running.pop(future)
+                try:
+                    seconds = future.result()
+                except Exception:
+                    logger.exception("Notebook %s failed", notebook)
+                    summary[notebook].update(status="failed")
+                    cache.pop(notebook, None)
+                else:
+                    logger.info("Executed %s in %.1fs", notebook, seconds)
+                    summary[notebook].update(status="executed", seconds=seconds)
+                    cache[notebook] = summary[notebook]["fingerprint"]
+                _write_json(cache, cache_path)
+
+    _write_json(summary, os.path.join(runs_path, SUMMARY_FILE))
+
+    return summary
+
 
 @click.command()
 @click.argument("notebooks_filepath", type=click.Path(exists=True))
 @click.argument("data_filepath", type=click.Path())
-def main(notebooks_filepath, data_filepath):
-    """Runs data processing scripts to turn raw data from (../raw) into
-    cleaned data ready to be analyzed (saved in ../processed).
+@click.option("--max-workers", type=int, default=None,
+              help="Number of notebooks executed concurrently.")
+@click.option("--force", is_flag=True,
+              help="Execute every notebook even if its inputs did not change.")
+def main(notebooks_filepath, data_filepath, max_workers, force):
+    """Executes the analysis notebooks on the processed data, running
+    independent notebooks concurrently and skipping those that are up to date.
     """
     logger = logging.getLogger(__name__)
     logger.info("Executing all analysis notebooks")
 
-    notebook_list = [
-        "01_01_linear_models_social_capital.ipynb", 
-        "01_02_non_linear_regression_models.ipynb",
-        "02_PowerlawDistribution.ipynb",
-        "03_tSNE_representations.ipynb",
-        "04_NetworkDescripiton.ipynb",
-        "05_NetworkEfficiency.ipynb",
-        "06_ECI_correlation.ipynb",
-        "07_diversity_orthogonality.ipynb",
-        "08_dynamic_range_centralities.ipynb",
-        "09_correlation_structure.ipynb"                        
-    ]
-    for n in notebook_list:
-
-        pm.execute_notebook(os.path.join(notebooks_filepath, n), 
-                            os.path.join(notebooks_filepath, 'runs', n), 
-                            parameters=dict(output_filepath=data_filepath),
-                            kernel_name='social_capital_in_trade_networks')
+    summary = run_notebooks(notebooks_filepath, data_filepath,
+                            max_workers=max_workers, force=force)
+
+    failed = [n for n, s in summary.items() if s["status"] in ("failed", "skipped")]
+    if failed:
+        raise click.ClickException(f"Notebooks not executed: {', '.join(failed)}")
 
 if __name__ == "__main__":
     log_fmt = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
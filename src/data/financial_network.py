@@ -7,17 +7,25 @@ import numpy as np
 
 import datetime
 
+from src.utils.utils_complexity import export_matrix
+from src.utils.utils_constants import EORA_FILEPATH, ICIO_FILEPATH, RESOLUTIONS
+
 
 class IndustryNetworkCreationEORA:
 
-    def __init__(self, year: str, input_filepath: str, output_filepath: str):
+    def __init__(self, year: str, input_filepath: str, output_filepath: str, eora_filepath: str = None,
+                 resolution: str = 'country'):
+
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, expected one of {RESOLUTIONS}")
+        self.resolution = resolution
 
         if year == '2016':
             self.year='2015'
         else:
             self.year=year
             
-        self.input_filepath='s3://workspaces-clarity-mgmt-pro/jaime.oliver/misc/EORA/'
+        self.input_filepath=eora_filepath or EORA_FILEPATH
         self.output_filepath=output_filepath
 
     def eora_matrix_ingestion(self):
@@ -26,6 +34,8 @@ class IndustryNetworkCreationEORA:
 
         self.df_labels = pd.read_table(os.path.join(self.data_path, 'labels_T.txt') , header=None)
         self.df_labels.columns = ['country_name', 'country', 'type', 'industry', 'drop']
+        if self.resolution == 'industry':
+            self.df_labels['country'] = self.df_labels.country + '_' + self.df_labels.industry
 
         self.df_T = pd.read_table(os.path.join(self.data_path, f'Eora26_{self.year}_bp_T.txt'), header=None)
         self.df_T.index = self.df_labels.country
@@ -45,6 +55,10 @@ class IndustryNetworkCreationEORA:
 
     def aggregate_by_country(self):
 
+        if self.resolution == 'industry':
+            self.node_index = self.df_T.index
+            return
+
         self.df_T = self.df_T.groupby(axis=1, level=0).sum()
         self.df_T = self.df_T.groupby(level=0).sum()
 
@@ -90,9 +104,14 @@ class IndustryNetworkCreationEORA:
 
 class IndustryNetworkCreation:
 
-    def __init__(self, year: str, input_filepath: str, output_filepath: str):
+    def __init__(self, year: str, input_filepath: str, output_filepath: str, icio_filepath: str = None,
+                 resolution: str = 'country'):
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution}, expected one of {RESOLUTIONS}")
+
         self.year=year
-        self.input_filepath='s3://workspaces-clarity-mgmt-pro/jaime.oliver/jobs/value_chain/oecd/input_output/'
+        self.resolution=resolution
+        self.input_filepath=icio_filepath or ICIO_FILEPATH
         self.output_filepath=output_filepath
 
     def oecd_matrix_ingestion(self):
@@ -111,15 +130,24 @@ class IndustryNetworkCreation:
             new_columns = [c.replace(k, v) for c in new_columns]
             new_index = [c.replace(k, v) for c in new_index]
 
-        new_columns = [c[:3] if c.split('_')[-1] not in demand_vars + supply_vars else c for c in new_columns]
-        new_index = [c[:3] if c.split('_')[-1] not in demand_vars + supply_vars else c for c in new_index]
-
         df.columns = new_columns
         df.index = new_index
 
         df = df.groupby(axis=1, level=0).sum()
         df = df.groupby(level=0).sum()
 
+        # Exports by country and industry, before sectors are collapsed
+        sectors = [c for c in df.index if c in df.columns and c.split('_')[-1] not in demand_vars + supply_vars]
+        self.df_exports = export_matrix(df.loc[sectors, sectors].values, sectors)
+
+        # Collapse sectors to countries
+        if self.resolution == 'country':
+            df.columns = [c[:3] if c.split('_')[-1] not in demand_vars + supply_vars else c for c in df.columns]
+            df.index = [c[:3] if c.split('_')[-1] not in demand_vars + supply_vars else c for c in df.index]
+
+            df = df.groupby(axis=1, level=0).sum()
+            df = df.groupby(level=0).sum()
+
         # Keep final demand appart
         final_demand = [c for c in df.columns if c[4:] in demand_vars]
         df_final_demand = df[final_demand]
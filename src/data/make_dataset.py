@@ -2,113 +2,563 @@
 import os
 import click
 import logging
+from functools import lru_cache
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import find_dotenv, load_dotenv
 
-import pandas as pd
-import networkx as nx
-
-from src.utils.utils_features import NetworkFeatureComputation
-from src.data.financial_network import (
-    IndustryNetworkCreation,
-    IndustryNetworkCreationEORA,
+# Only the light modules are imported here: pandas, networkx, boto3, sklearn
+# and the pipeline classes are imported inside the stages that use them, so
+# that --help, single stages and worker processes start fast
+from src.utils.utils_constants import (
+    BACKBONE_FILTERS,
+    COMPLEXITY_METHODS,
+    EMBEDDING_METHODS,
+    ICIO_FILEPATH,
+    RESOLUTIONS,
 )
-from src.data.migration_network import MigrationNetworkCreation, EstimatedMigrationNetwork
-from src.data.panel_data_etl import PanelDataETL
+from src.utils.utils_instrumentation import configure, span
+
+# Tolerances of the --tolerance-sweep tables, spanning the per-layer values
+# used below
+TOLERANCE_GRID = tuple(10. ** e for e in range(-15, 0))
+
+# Layers whose backbone can be extracted before the features
+BACKBONE_LAYERS = ('financial', 'goods', 'human', 'estimated_human')
+
+# Layer -> (network of every year folder, tol_gfi, tol_favor) of the
+# rolling-window networks
+ROLLING_LAYERS = {
+    'financial': ('A_country', 0.01, 0.0001),
+    'goods': ('B_country', 0.01, 0.0001),
+    'human': ('migration_network', 0.00001, 1e-15),
+}
+
+# Layer -> network of every year folder embedded by node_embeddings
+EMBEDDING_LAYERS = {'financial': 'A_country', 'goods': 'B_country', 'human': 'migration_network'}
+
+@lru_cache(maxsize=None)
+def multiplier_engine():
+    '''
+    LU factorisations of the input-output tables, reused across measures
+    '''
+    from src.utils.utils_multipliers import MultiplierEngine
+    return MultiplierEngine()
 
-from src.utils.utils_s3 import read_s3_graphml, write_s3_graphml
+def write_tolerance_sweep(NFC, network_path, tolerances, uploader=None):
+    '''
+    Save the gfi and favor tolerance sweep next to the network, as
+    <network>_tolerance_sweep.parquet
+    '''
+    from src.utils.utils_s3 import write_parquet
 
+    df_sweep = NFC.tolerance_sweep(tolerances)
+    with span('write_parquet'):
+        write_parquet(df_sweep, network_path.replace('.graphml', '_tolerance_sweep.parquet'), uploader)
+
+def extract_backbone(network, backbone_filter, path, uploader=None):
+    '''
+    Backbone of the adjacency matrix or graph `network` by the (method,
+    value, keyword arguments) filter, the edges and weight it keeps saved as
+    <path>_backbone.parquet
+    '''
+    import networkx as nx
+    import pandas as pd
+    from src.utils.utils_backbone import backbone, backbone_graph
+    from src.utils.utils_s3 import write_parquet
+
+    method, value, kwargs = backbone_filter
+    with span('backbone') as s:
+        if isinstance(network, nx.Graph):
+            network, stats = backbone_graph(network, method, value, **kwargs)
+        else:
+            network, stats = backbone(network, method, value, **kwargs)
+        s.extra = stats
+
+    write_parquet(pd.DataFrame([stats]), f'{path}_backbone.parquet', uploader)
+    return network
+
+def write_edge_weights(network, path, uploader=None):
+    '''
+    Distribution of the positive edge weights of the adjacency matrix or
+    graph `network`, a log-binned histogram, a quantile sketch and the
+    sorted weights, saved as <path>_weights.npz
+    '''
+    import networkx as nx
+    from src.utils.utils_weights import EdgeWeightSummary
+    from src.utils.utils_s3 import write_npz
+
+    with span('edge_weights'):
+        if isinstance(network, nx.Graph):
+            weights = [w for _, _, w in network.edges(data='weight', default=1)]
+        else:
+            weights = network
+        write_npz(EdgeWeightSummary.from_weights(weights).to_arrays(), f'{path}_weights.npz', uploader)
 
 def network_from_adjacency(adjacency_matrix, 
                            node_index, 
                            path, 
                            tol_gfi=0.01, 
-                           tol_favor=0.0001):
+                           tol_favor=0.0001,
+                           tolerances=None,
+                           backbone_filter=None,
+                           uploader=None):
+        import networkx as nx
+        import pandas as pd
+        from src.utils.utils_features import NetworkFeatureComputation
+        from src.utils.utils_graphml import GraphArrays
+        from src.utils.utils_s3 import write_graphml
+
+        if backbone_filter is not None:
+            adjacency_matrix = extract_backbone(adjacency_matrix, backbone_filter, path.replace('.graphml', ''),
+                                                uploader=uploader)
+
+        write_edge_weights(adjacency_matrix, path.replace('.graphml', ''), uploader=uploader)
+
         df_adj = pd.DataFrame(adjacency_matrix, index=node_index, columns=node_index)
         G = nx.convert_matrix.from_pandas_adjacency(df_adj, create_using=nx.DiGraph)
  
         # Compute network features ------------------
         NFC = NetworkFeatureComputation(G)
-        NFC.compute_features(tol_gfi=tol_gfi, tol_favor=tol_favor)
+        with span('features'):
+            NFC.compute_features(tol_gfi=tol_gfi, tol_favor=tol_favor)
         G = NFC.G
 
-        # Save
-        write_s3_graphml(G, path)
+        if tolerances is not None:
+            write_tolerance_sweep(NFC, path, tolerances, uploader=uploader)
 
-@click.command()
-@click.argument("input_filepath")
-@click.argument("output_filepath")
-def main(input_filepath, output_filepath):
-    """Runs data processing scripts to turn raw data from (../raw) into
-    cleaned data ready to be analyzed (saved in ../processed).
-    """
-    logger = logging.getLogger(__name__)
-    logger.info("making final data set from raw data")
-    
-    
-    for year in range(2005, 2016):
-        
-        year = str(year)
-        print("Processing year ", year)
-        
-        # Capital Networks -------------------------
-        INC = IndustryNetworkCreation(
-            year=year, input_filepath=input_filepath, output_filepath=output_filepath
-        )
+        # Save, streamed from the arrays of G
+        write_graphml(GraphArrays.from_networkx(G), path, uploader)
+
+def network_parquet(adjacency_matrix, node_index, path, tol_gfi=0.01, tol_favor=0.0001, backbone_filter=None,
+                    uploader=None):
+    '''
+    Matrix-native counterpart of network_from_adjacency for the industry
+    networks: the features are computed on the matrix, with no graph object,
+    and saved as <path>_nodes.parquet next to the links as
+    <path>_edges.parquet (source, target, weight)
+    '''
+    import numpy as np
+    import pandas as pd
+    from src.utils.utils_matrix_features import matrix_features
+    from src.utils.utils_s3 import write_parquet
+
+    g = np.nan_to_num(np.asarray(adjacency_matrix, dtype=float))
+    if backbone_filter is not None:
+        g = extract_backbone(g, backbone_filter, path, uploader=uploader)
+
+    write_edge_weights(g, path, uploader=uploader)
+
+    with span('features'), ThreadPoolExecutor() as executor:
+        df_nodes = matrix_features(g, node_index, tol_gfi=tol_gfi, tol_favor=tol_favor, executor=executor)
+
+    with span('write_parquet'):
+        rows, cols = np.nonzero(g)
+        categories = pd.Index(node_index)
+        df_edges = pd.DataFrame({
+            'source': pd.Categorical.from_codes(rows, categories=categories),
+            'target': pd.Categorical.from_codes(cols, categories=categories),
+            'weight': g[rows, cols],
+        })
+        write_parquet(df_nodes, f'{path}_nodes.parquet', uploader)
+        write_parquet(df_edges, f'{path}_edges.parquet', uploader)
+
+def capital_networks(year, input_filepath, output_filepath, icio_filepath=None, tolerances=None,
+                     resolution='country', backbones=None, uploader=None):
+    '''
+    Financial (A) and goods and services (B) networks of one year, between
+    countries (GraphML) or country_industry sectors (parquet). `backbones`
+    maps a layer to the (method, value, kwargs) filter of its backbone. Outputs are
+    written behind `uploader` (an AsyncUploader) when given.
+    '''
+    from src.data.financial_network import IndustryNetworkCreation
+    from src.utils.utils_s3 import write_parquet
+
+    backbones = backbones or {}
+    INC = IndustryNetworkCreation(
+        year=year, input_filepath=input_filepath, output_filepath=output_filepath,
+        icio_filepath=icio_filepath, resolution=resolution
+    )
+    with span('ingestion', year=year, layer='capital'):
         INC.run()
 
+    with span('write_parquet', year=year, layer='capital'):
         # Output
         data_path = os.path.join(output_filepath, year, "industry_output.parquet")
-        INC.df_output.to_parquet(data_path)
+        write_parquet(INC.df_output, data_path, uploader)
 
         # GDP
         data_path = os.path.join(output_filepath, year, "gdp.parquet")
-        INC.df_gdp.to_parquet(data_path)
+        write_parquet(INC.df_gdp, data_path, uploader)
+
+        # Exports by country and industry, for the complexity indices
+        data_path = os.path.join(output_filepath, year, "exports.parquet")
+        write_parquet(INC.df_exports, data_path, uploader)
 
-        # Graph representation financial flows
+    # Leontief/Ghosh total requirements
+    with span('multipliers', year=year, layer='capital'):
+        key = (INC.input_filepath, year, resolution)
+        df_multipliers = multiplier_engine().multipliers(key, INC.A, INC.x, INC.node_index)
+        write_parquet(df_multipliers, os.path.join(output_filepath, year, "io_multipliers.parquet"), uploader)
+
+    if resolution == 'industry':
+        for layer, name, adjacency_matrix in [('financial', 'A_industry', INC.A.T), ('goods', 'B_industry', INC.B)]:
+            with span('network', year=year, layer=layer):
+                network_parquet(adjacency_matrix=adjacency_matrix,
+                                node_index=INC.node_index,
+                                path=os.path.join(output_filepath, year, name),
+                                tol_gfi=0.01, tol_favor=0.0001,
+                                backbone_filter=backbones.get(layer),
+                                uploader=uploader)
+        return
+
+    # Graph representation financial flows
+    with span('network', year=year, layer='financial'):
         network_from_adjacency(adjacency_matrix=INC.A.T, # REMEMBER: io tables are transposed adj matrix
                                node_index=INC.node_index,                               
                                path = os.path.join(output_filepath, year, "A_country.graphml"),
-                               tol_gfi=0.01,tol_favor=0.0001)
-        
-        # Graph representation goods and services flows
+                               tol_gfi=0.01,tol_favor=0.0001,
+                               tolerances=tolerances,
+                               backbone_filter=backbones.get('financial'),
+                               uploader=uploader)
+    
+    # Graph representation goods and services flows
+    with span('network', year=year, layer='goods'):
         network_from_adjacency(adjacency_matrix=INC.B, 
                                node_index=INC.node_index,
                                path = os.path.join(output_filepath, year, "B_country.graphml"),
-                               tol_gfi=0.01,tol_favor=0.0001)
-        
-        # Migration Network --------------------------------------
-        MNC = MigrationNetworkCreation(
-            year=year, input_filepath=input_filepath, output_filepath=output_filepath
-        )
+                               tol_gfi=0.01,tol_favor=0.0001,
+                               tolerances=tolerances,
+                               backbone_filter=backbones.get('goods'),
+                               uploader=uploader)
+
+def migration_network(year, input_filepath, output_filepath, reference_year="2005", tolerances=None,
+                      backbone_filter=None, uploader=None):
+    '''
+    OECD migration network of one year
+    '''
+    from src.data.migration_network import MigrationNetworkCreation
+    from src.utils.utils_features import NetworkFeatureComputation
+    from src.utils.utils_s3 import write_graphml
+
+    MNC = MigrationNetworkCreation(
+        year=year, input_filepath=input_filepath, output_filepath=output_filepath,
+        reference_year=reference_year
+    )
+    with span('ingestion', year=year, layer='human'):
+        # The countries of the networks are read back from the reference year
+        if uploader is not None:
+            uploader.wait(os.path.join(output_filepath, reference_year, "gdp.parquet"))
+
         #MNC.run(source='un')
         MNC.run(source='oecd')
 
+    with span('network', year=year, layer='human'):
+        network_path = os.path.join(output_filepath, year, "migration_network.graphml")
+
+        G = MNC.G
+        if backbone_filter is not None:
+            G = extract_backbone(G, backbone_filter, network_path.replace('.graphml', ''), uploader=uploader)
+
+        write_edge_weights(G, network_path.replace('.graphml', ''), uploader=uploader)
+
         # Compute network features
-        NFC = NetworkFeatureComputation(MNC.G)
-        NFC.compute_features(tol_gfi=0.00001, tol_favor=1e-15)
+        NFC = NetworkFeatureComputation(G)
+        with span('features'):
+            NFC.compute_features(tol_gfi=0.00001, tol_favor=1e-15)
 
         # Save
-        network_path = os.path.join(output_filepath, year, "migration_network.graphml")
-        write_s3_graphml(NFC.G, network_path)
-        
-        # Estimated migration network ----------------------
-        B = read_s3_graphml(os.path.join(output_filepath, year, "B_country.graphml"))
+        write_graphml(NFC.G, network_path, uploader)
+
+        if tolerances is not None:
+            write_tolerance_sweep(NFC, network_path, tolerances, uploader=uploader)
+
+def estimated_migration_network(year, input_filepath, output_filepath, tolerances=None, backbone_filter=None,
+                                uploader=None):
+    '''
+    Migration network of one year estimated from the goods and services
+    network and the emigration rates
+    '''
+    from src.data.migration_network import EstimatedMigrationNetwork
+    from src.utils.utils_features import NetworkFeatureComputation
+    from src.utils.utils_s3 import read_s3_graphml, write_graphml
+
+    with span('ingestion', year=year, layer='estimated_human'):
+        B_path = os.path.join(output_filepath, year, "B_country.graphml")
+        if uploader is not None:
+            uploader.wait(B_path)
+
+        B = read_s3_graphml(B_path)
         emn = EstimatedMigrationNetwork(B, input_filepath, output_filepath)
         estimated_M = emn.estimate_emigration_rate()
-        
+    
+    with span('network', year=year, layer='estimated_human'):
+        network_path = os.path.join(output_filepath, year, "estimated_migration_network.graphml")
+
+        if backbone_filter is not None:
+            estimated_M = extract_backbone(estimated_M, backbone_filter, network_path.replace('.graphml', ''),
+                                           uploader=uploader)
+
+        write_edge_weights(estimated_M, network_path.replace('.graphml', ''), uploader=uploader)
+
         # Compute network features
         NFC = NetworkFeatureComputation(estimated_M)
-        NFC.compute_features(tol_gfi=0.00001, tol_favor=0.001)
+        with span('features'):
+            NFC.compute_features(tol_gfi=0.00001, tol_favor=0.001)
 
         # Save
-        network_path = os.path.join(output_filepath, year, "estimated_migration_network.graphml")
-        write_s3_graphml(NFC.G, network_path)
-    
-    etl = PanelDataETL(input_filepath=input_filepath, output_filepath=output_filepath)
-    df_model = etl.run()
+        write_graphml(NFC.G, network_path, uploader)
+
+        if tolerances is not None:
+            write_tolerance_sweep(NFC, network_path, tolerances, uploader=uploader)
+
+def complexity(output_filepath, years, method='eigenvector'):
+    '''
+    Economic complexity of the countries (eci.parquet) and industries
+    (pci.parquet) from the exports of every year, computed in one batch
+    '''
+    import pandas as pd
+    from src.utils.utils_complexity import economic_complexity
+
+    with span('complexity', layer='goods'):
+        exports = {str(year): pd.read_parquet(os.path.join(output_filepath, str(year), "exports.parquet"))
+                   for year in years}
+        df_eci, df_pci = economic_complexity(exports, method=method)
+
+        df_eci.to_parquet(os.path.join(output_filepath, "eci.parquet"))
+        df_pci.to_parquet(os.path.join(output_filepath, "pci.parquet"))
+
+def rolling_networks(output_filepath, years, windows=(3, 5), layers=ROLLING_LAYERS, uploader=None):
+    '''
+    Networks averaged over rolling windows of every length in `windows`,
+    from running sums over the yearly networks (each read once, as arrays),
+    with the features of network_from_adjacency. Saved as
+    window_<length>/<first year>_<last year>/<network>.graphml.
+    '''
+    from src.utils.utils_rolling import RollingWindowSums, window_key
+    from src.utils.utils_s3 import read_s3_graphml
+
+    for layer, (network, tol_gfi, tol_favor) in layers.items():
+        rolling = RollingWindowSums(windows)
+
+        for year in years:
+            year = str(year)
+            network_path = os.path.join(output_filepath, year, f"{network}.graphml")
+
+            with span('ingestion', year=year, layer=f'rolling_{layer}'):
+                if uploader is not None:
+                    uploader.wait(network_path)
+                graph = read_s3_graphml(network_path, arrays=True)
+                completed = rolling.push(year, graph.nodes, graph.rows, graph.cols, graph.weights)
+
+            for window, window_years, g, nodes in completed:
+                with span('network', year=year, layer=f'rolling_{layer}', window=window,
+                          first_year=window_years[0]):
+                    path = os.path.join(output_filepath, f"window_{window}", window_key(window_years),
+                                        f"{network}.graphml")
+                    network_from_adjacency(g, nodes, path, tol_gfi=tol_gfi, tol_favor=tol_favor,
+                                           uploader=uploader)
+
+def node_embeddings(output_filepath, years, methods=('spectral',), n_components=2, seed=0,
+                    layers=EMBEDDING_LAYERS, uploader=None):
+    '''
+    Node embeddings of the networks of every layer, year after year so that
+    each starts from and is aligned to the previous one (AlignedEmbedding),
+    saved as <network>_embedding_<method>.parquet in the year folders
+    '''
+    from src.utils.utils_embeddings import AlignedEmbedding
+    from src.utils.utils_s3 import read_s3_graphml, write_parquet
+
+    for layer, network in layers.items():
+        embeddings = [AlignedEmbedding(method, n_components=n_components, seed=seed) for method in methods]
+
+        for year in years:
+            year = str(year)
+            network_path = os.path.join(output_filepath, year, f"{network}.graphml")
+
+            with span('ingestion', year=year, layer=f'embedding_{layer}'):
+                if uploader is not None:
+                    uploader.wait(network_path)
+                graph = read_s3_graphml(network_path, arrays=True)
+                g = graph.csr().toarray()
+
+            for embedding in embeddings:
+                with span('embedding', year=year, layer=f'embedding_{layer}', method=embedding.method):
+                    df_embedding = embedding.push(graph.nodes, g)
+                    embedding_path = network_path.replace('.graphml', f'_embedding_{embedding.method}.parquet')
+                    write_parquet(df_embedding, embedding_path, uploader)
+
+def panel_data(input_filepath, output_filepath, years, resolution='country', complexity_method='eigenvector'):
+    '''
+    Panel of network features and macro variables over the years, by
+    country (panel_data.parquet) or by country_industry
+    (panel_data_industry.parquet)
+    '''
+    from src.data.panel_data_etl import PanelDataETL
+
+    complexity(output_filepath, years, method=complexity_method)
 
-    df_model.to_parquet(os.path.join(output_filepath, "panel_data.parquet"))
+    etl = PanelDataETL(input_filepath=input_filepath, output_filepath=output_filepath, years=years,
+                       resolution=resolution)
+    with span('panel_data', layer='panel'):
+        df_model = etl.run()
+
+        file_name = "panel_data_industry.parquet" if resolution == 'industry' else "panel_data.parquet"
+        df_model.to_parquet(os.path.join(output_filepath, file_name))
+
+def build_dataset(input_filepath, output_filepath, years=range(2005, 2016), icio_filepath=None,
+                  tolerances=None, resolution='country', complexity_method='eigenvector', backbones=None,
+                  upload_queue=8, upload_workers=2, windows=(), embeddings=()):
+    '''
+    Networks of every year, the rolling-window networks of every length in
+    `windows` and the node embeddings of every method in `embeddings`
+    (country resolution) and the panel. The networks are uploaded
+    behind an AsyncUploader of `upload_queue` pending uploads (synchronously
+    if 0), flushed before the panel reads them back.
+    '''
+    from src.utils.utils_s3 import AsyncUploader
+
+    logger = logging.getLogger(__name__)
+    reference_year = str(years[0])
+    backbones = backbones or {}
+
+    uploader = AsyncUploader(max_pending=upload_queue, workers=upload_workers) if upload_queue > 0 else None
+    try:
+        for year in years:
+            
+            year = str(year)
+            logger.info("Processing year %s", year)
+            
+            with span('year', year=year):
+                # Capital Networks -------------------------
+                capital_networks(year, input_filepath, output_filepath, icio_filepath=icio_filepath,
+                                 tolerances=tolerances, resolution=resolution, backbones=backbones,
+                                 uploader=uploader)
+
+                # Migration Network --------------------------------------
+                migration_network(year, input_filepath, output_filepath, reference_year=reference_year,
+                                  tolerances=tolerances, backbone_filter=backbones.get('human'),
+                                  uploader=uploader)
+                
+                # Estimated migration network (estimated from B_country) ----------------------
+                if resolution == 'country':
+                    estimated_migration_network(year, input_filepath, output_filepath, tolerances=tolerances,
+                                                backbone_filter=backbones.get('estimated_human'),
+                                                uploader=uploader)
+
+        # Rolling-window networks ----------------------
+        if windows and resolution == 'country':
+            rolling_networks(output_filepath, [str(year) for year in years], windows=windows,
+                             uploader=uploader)
+
+        # Node embeddings ----------------------
+        if embeddings and resolution == 'country':
+            node_embeddings(output_filepath, [str(year) for year in years], methods=embeddings,
+                            uploader=uploader)
+    finally:
+        # Barrier: every network is on S3 before PanelDataETL reads them back
+        if uploader is not None:
+            uploader.close()
+
+    panel_data(input_filepath, output_filepath, years, resolution=resolution,
+               complexity_method=complexity_method)
+
+def parse_backbones(ctx, param, value):
+    '''
+    {layer: (method, value, kwargs)} of the --backbone LAYER=METHOD[:VALUE]
+    options, LAYER=polya:[ALPHA]:A also setting the urn parameter a
+    '''
+    backbones = {}
+    for option in value:
+        try:
+            layer, method = option.split('=')
+            method, _, threshold = method.partition(':')
+            threshold, _, a = threshold.partition(':') if method == 'polya' else (threshold, '', '')
+            threshold = float(threshold) if threshold else None
+            kwargs = {'a': float(a)} if a else {}
+        except ValueError:
+            raise click.BadParameter(f"{option} is not LAYER=METHOD[:VALUE] or LAYER=polya:[ALPHA]:A")
+
+        if layer not in BACKBONE_LAYERS:
+            raise click.BadParameter(f"Unknown layer {layer}, expected one of {BACKBONE_LAYERS}")
+        if method not in BACKBONE_FILTERS:
+            raise click.BadParameter(f"Unknown filter {method}, expected one of {tuple(BACKBONE_FILTERS)}")
+        if method == 'polya' and 'a' not in kwargs:
+            raise click.BadParameter(f"{option} needs the urn parameter, as LAYER=polya:ALPHA:A")
+        if method == 'polya' and kwargs['a'] <= 0:
+            raise click.BadParameter(f"The urn parameter of {option} must be positive")
+        backbones[layer] = (method, threshold, kwargs)
+    return backbones
+
+@click.command()
+@click.argument("input_filepath")
+@click.argument("output_filepath")
+@click.option("--icio-filepath", default=ICIO_FILEPATH, show_default=True,
+              help="Root of the OECD ICIO2018_<year>.zip tables.")
+@click.option("--start-year", type=int, default=2005, show_default=True)
+@click.option("--end-year", type=int, default=2015, show_default=True)
+@click.option("--spans", default=None,
+              help="JSON lines file the per-stage spans are appended to "
+                   "[default: $SOCIAL_CAPITAL_SPANS or reports/spans.jsonl].")
+@click.option("--no-instrumentation", is_flag=True,
+              help="Do not record per-stage spans.")
+@click.option("--profile-stage", default=None,
+              help="Stage (e.g. bridging, write_graphml) to run under cProfile.")
+@click.option("--tolerance-sweep", is_flag=True,
+              help="Also save gfi and favor for every tolerance of the grid "
+                   "as <network>_tolerance_sweep.parquet.")
+@click.option("--tolerance", "tolerances", type=float, multiple=True,
+              help="Tolerance of the sweep (repeatable), instead of the default grid.")
+@click.option("--resolution", type=click.Choice(RESOLUTIONS), default="country", show_default=True,
+              help="Nodes of the financial and goods networks: countries (GraphML) "
+                   "or country_industry sectors (parquet, matrix kernels).")
+@click.option("--complexity-method", type=click.Choice(COMPLEXITY_METHODS), default="eigenvector",
+              show_default=True, help="Solver of the economic complexity indices.")
+@click.option("--backbone", "backbones", multiple=True, callback=parse_backbones,
+              metavar="LAYER=METHOD[:VALUE]",
+              help="Extract the backbone of a layer (financial, goods, human, estimated_human) "
+                   "before its features, with the disparity, polya, global (weight quantile) or "
+                   "node_share filter; polya:[ALPHA]:A takes the required urn parameter a (a=1 is "
+                   "the disparity filter). Repeatable, one per layer.")
+@click.option("--upload-queue", type=int, default=8, show_default=True,
+              help="Uploads waiting behind the computation before it blocks; 0 uploads synchronously.")
+@click.option("--upload-workers", type=int, default=2, show_default=True,
+              help="Threads uploading the outputs in the background.")
+@click.option("--window", "windows", type=click.IntRange(min=1), multiple=True,
+              help="Also build the financial, goods and migration networks averaged over rolling "
+                   "windows of this many years, as window_<N>/<first>_<last>/ (repeatable).")
+@click.option("--embedding", "embeddings", type=click.Choice(EMBEDDING_METHODS), multiple=True,
+              help="Also save the node embeddings of the financial, goods and migration networks, aligned "
+                   "across years, as <network>_embedding_<method>.parquet (repeatable; umap needs umap-learn).")
+def main(input_filepath, output_filepath, icio_filepath, start_year, end_year,
+         spans, no_instrumentation, profile_stage, tolerance_sweep, tolerances, resolution,
+         complexity_method, backbones, upload_queue, upload_workers, windows, embeddings):
+    """Runs data processing scripts to turn raw data from (../raw) into
+    cleaned data ready to be analyzed (saved in ../processed).
+    """
+    logger = logging.getLogger(__name__)
+    logger.info("making final data set from raw data")
+
+    configure(enabled=False if no_instrumentation else None, path=spans, profile=profile_stage)
+
+    if tolerance_sweep and resolution == 'industry':
+        raise click.UsageError("--tolerance-sweep is only available at country resolution")
+    if windows and resolution == 'industry':
+        raise click.UsageError("--window is only available at country resolution")
+    if embeddings and resolution == 'industry':
+        raise click.UsageError("--embedding is only available at country resolution")
+    
+    build_dataset(input_filepath, output_filepath, 
+                  years=range(start_year, end_year + 1), 
+                  icio_filepath=icio_filepath,
+                  tolerances=(tolerances or TOLERANCE_GRID) if tolerance_sweep else None,
+                  resolution=resolution,
+                  complexity_method=complexity_method,
+                  backbones=backbones,
+                  upload_queue=upload_queue,
+                  upload_workers=upload_workers,
+                  windows=windows,
+                  embeddings=embeddings)
 
 
 if __name__ == "__main__":
@@ -7,10 +7,11 @@ import country_converter as coco
 class MigrationNetworkCreation:
         
 
-    def __init__(self, year: str, input_filepath: str, output_filepath: str):
+    def __init__(self, year: str, input_filepath: str, output_filepath: str, reference_year: str = '2005'):
         self.year=year
         self.input_filepath=input_filepath
         self.output_filepath=output_filepath
+        self.reference_year=reference_year
 
     def un_matrix_ingestion(self):
 
@@ -89,11 +90,12 @@ class MigrationNetworkCreation:
         
     def map_row_countries(self):
         
-        data_path = os.path.join(self.output_filepath, '2005', 'gdp.parquet')
+        data_path = os.path.join(self.output_filepath, self.reference_year, 'gdp.parquet')
 
         df_countries = pd.read_parquet(data_path)
 
-        missing_countries = (set(self.df.country_from) or set(self.df.country_to)) - set(df_countries.index)
+        # Country codes of both the country and the country_industry outputs
+        missing_countries = (set(self.df.country_from) or set(self.df.country_to)) - set(df_countries.index.str[:3])
 
         self.df.loc[self.df.country_from.isin(missing_countries) , 'country_from'] = 'ROW'
         self.df.loc[self.df.country_to.isin(missing_countries) , 'country_to'] = 'ROW'
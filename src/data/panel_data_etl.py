@@ -8,59 +8,113 @@ from src.utils.utils_s3 import read_s3_graphml, write_s3_graphml
 
 class PanelDataETL:
     
-    def __init__(self,input_filepath, output_filepath):
+    def __init__(self,input_filepath, output_filepath, years=range(2005, 2016), resolution='country', streaming=False):
         
         self.input_filepath = input_filepath
         self.output_filepath = output_filepath
+        self.years = years
+        self.resolution = resolution
 
-        self.centralities = ['hubs', 'authorities', 'pagerank', 'gfi', 'bridging', 'in_favor', 'out_favor']
+        # Read the node features of the graphml networks without building graphs
+        self.streaming = streaming
 
-    def networks_etl(self):
+        # Unit of observation of the panel
+        self.entity = 'country_industry' if resolution == 'industry' else 'country'
 
-        all_years = []
+        self.centralities = ['hubs', 'authorities', 'pagerank', 'gfi', 'bridging', 'in_favor', 'out_favor']
 
-        for year in range(2005, 2016):
-            
-            year = str(year)
-            # Capital network --------------------------------------------
-            network_path = os.path.join(self.output_filepath, year, 'A_country.graphml')
+    def node_features(self, network_path):
+        '''
+        Node x feature DataFrame of the centralities and hhi_index of the
+        graphml network, NaN where a node lacks a feature
+        '''
+        if self.streaming:
+            df = read_s3_graphml(network_path, arrays=True).node_attributes
+        else:
             G = read_s3_graphml(network_path)
+            df = pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient='index').reindex(list(G.nodes))
 
-            df = pd.DataFrame(index=G.nodes)
+        return df.reindex(columns=self.centralities + ['hhi_index'])
 
-            for c in self.centralities:
-                df['financial_'+c] = df.index.map(nx.get_node_attributes(G,c))
-                
-            df['financial_hhi'] = df.index.map(nx.get_node_attributes(G,'hhi_index'))
+    def country_networks_etl(self, year):
+        # Capital network --------------------------------------------
+        network_path = os.path.join(self.output_filepath, year, 'A_country.graphml')
+        df_nodes = self.node_features(network_path)
 
-            # Goods network --------------------------------------------
-            network_path = os.path.join(self.output_filepath, year, 'B_country.graphml')
-            G = read_s3_graphml(network_path)
+        df = pd.DataFrame(index=df_nodes.index)
 
-            for c in self.centralities:
-                df['goods_'+c] = df.index.map(nx.get_node_attributes(G,c))
-                
-            df['goods_hhi'] = df.index.map(nx.get_node_attributes(G,'hhi_index'))
+        for c in self.centralities:
+            df['financial_'+c] = df.index.map(df_nodes[c])
 
-            # Migration network ---------------------------------------------
-            network_path = os.path.join(self.output_filepath, year, 'migration_network.graphml')
-            G = read_s3_graphml(network_path)
+        df['financial_hhi'] = df.index.map(df_nodes['hhi_index'])
 
-            for c in self.centralities:
-                df['human_'+c] = df.index.map(nx.get_node_attributes(G,c))
+        # Goods network --------------------------------------------
+        network_path = os.path.join(self.output_filepath, year, 'B_country.graphml')
+        df_nodes = self.node_features(network_path)
 
-            df['human_hhi'] = df.index.map(nx.get_node_attributes(G,'hhi_index'))
+        for c in self.centralities:
+            df['goods_'+c] = df.index.map(df_nodes[c])
 
-            '''
-            # Estimated Migration network ---------------------------------------------
-            network_path = os.path.join(self.output_filepath, year, 'estimated_migration_network.graphml')
-            G = read_s3_graphml(network_path)
+        df['goods_hhi'] = df.index.map(df_nodes['hhi_index'])
+
+        # Migration network ---------------------------------------------
+        network_path = os.path.join(self.output_filepath, year, 'migration_network.graphml')
+        df_nodes = self.node_features(network_path)
+
+        for c in self.centralities:
+            df['human_'+c] = df.index.map(df_nodes[c])
+
+        df['human_hhi'] = df.index.map(df_nodes['hhi_index'])
+
+        '''
+        # Estimated Migration network ---------------------------------------------
+        network_path = os.path.join(self.output_filepath, year, 'estimated_migration_network.graphml')
+        G = read_s3_graphml(network_path)
+
+        for c in self.centralities:
+            df['estimated_human_'+c] = df.index.map(nx.get_node_attributes(G,c))
+
+        df['estimated_human_hhi'] = df.index.map(nx.get_node_attributes(G,'hhi_index'))
+        '''
+        return df
 
-            for c in self.centralities:
-                df['estimated_human_'+c] = df.index.map(nx.get_node_attributes(G,c))
+    def industry_networks_etl(self, year):
+        '''
+        Node features of the financial and goods industry networks (parquet)
+        and, by country, of the migration network
+        '''
+        df_list = []
+        for network, name in [('financial', 'A_industry'), ('goods', 'B_industry')]:
+            df_nodes = pd.read_parquet(os.path.join(self.output_filepath, year, f'{name}_nodes.parquet'))
+            df_nodes = df_nodes[self.centralities + ['hhi_index']].rename(columns={'hhi_index': 'hhi'})
+            df_list.append(df_nodes.add_prefix(network + '_'))
+
+        df = pd.concat(df_list, axis=1)
+
+        network_path = os.path.join(self.output_filepath, year, 'migration_network.graphml')
+        df_nodes = self.node_features(network_path)
+        country = df.index.str[:3]
+
+        for c in self.centralities:
+            df['human_'+c] = country.map(df_nodes[c])
+
+        df['human_hhi'] = country.map(df_nodes['hhi_index'])
+
+        return df
+
+    def networks_etl(self):
+
+        all_years = []
+
+        for year in self.years:
+            
+            year = str(year)
+
+            if self.resolution == 'industry':
+                df = self.industry_networks_etl(year)
+            else:
+                df = self.country_networks_etl(year)
 
-            df['estimated_human_hhi'] = df.index.map(nx.get_node_attributes(G,'hhi_index'))
-            '''
             # Compile ---------------------------
             out_path = os.path.join(self.output_filepath, year, 'industry_output.parquet')
             df_out=pd.read_parquet(out_path)
@@ -69,6 +123,10 @@ class PanelDataETL:
             gdp_path = os.path.join(self.output_filepath, year, 'gdp.parquet')
             df_gdp=pd.read_parquet(gdp_path)
             df_year = df_year.merge(df_gdp, left_index=True, right_index=True)
+
+            multipliers_path = os.path.join(self.output_filepath, year, 'io_multipliers.parquet')
+            df_multipliers = pd.read_parquet(multipliers_path)
+            df_year = df_year.merge(df_multipliers, how='left', left_index=True, right_index=True)
             
             df_year['year'] = year
             
@@ -76,7 +134,19 @@ class PanelDataETL:
 
         df = pd.concat(all_years)
 
-        self.df = df.reset_index().rename(columns={'index':'country', 'OUTPUT':'output'})
+        self.df = df.reset_index().rename(columns={'index':self.entity, 'OUTPUT':'output'})
+
+        if self.resolution == 'industry':
+            self.df['country'] = self.df.country_industry.str[:3]
+
+        # Economic complexity of the country and, by sector, of the industry
+        df_eci = pd.read_parquet(os.path.join(self.output_filepath, 'eci.parquet'))
+        self.df = self.df.merge(df_eci[['year', 'country', 'eci']], how='left', on=['year', 'country'])
+
+        if self.resolution == 'industry':
+            df_pci = pd.read_parquet(os.path.join(self.output_filepath, 'pci.parquet'))
+            self.df['industry'] = self.df.country_industry.str[4:]
+            self.df = self.df.merge(df_pci[['year', 'industry', 'pci']], how='left', on=['year', 'industry'])
 
 
     @staticmethod
@@ -93,18 +163,18 @@ class PanelDataETL:
         self.df['log_output'] = np.log(self.df['output'] + 1)
         self.df['log_gdp'] = np.log(self.df['gdp'] + 1)
         
-        self.df = self.df.sort_values(by=['country', 'year'])
+        self.df = self.df.sort_values(by=[self.entity, 'year'])
 
         networks = ['financial', 'goods', 'human']
         all_centrality_cols = [f'{n}_{c}' for c in self.centralities for n in networks]
         
         for c in all_centrality_cols + ['log_output', 'log_gdp']:
-            self.df['lag_' + c] = self.df.groupby('country')[c].shift(1)
+            self.df['lag_' + c] = self.df.groupby(self.entity)[c].shift(1)
             self.df['delta_' + c] = self.df[c] - self.df['lag_' + c]
             self.df['per_change_' + c] = self.df['delta_' + c]/self.df['lag_' + c]
 
-        self.df['lag_log2_output'] = self.df.groupby('country').log_output.shift(2)
-        self.df['lag_log2_gdp'] = self.df.groupby('country').log_gdp.shift(2)
+        self.df['lag_log2_output'] = self.df.groupby(self.entity).log_output.shift(2)
+        self.df['lag_log2_gdp'] = self.df.groupby(self.entity).log_gdp.shift(2)
         
         #self.df = self.power_tansformation(df = self.df, columns = all_centrality_cols)
         
@@ -0,0 +1,184 @@
+import os
+import io
+import zipfile
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+DEMAND_VARS = ["HFCE", "NPISH", "GGFC", "GFCF", "INVNT", "P33"]
+
+
+def country_codes(n_countries):
+    '''
+    Synthetic ISO3-like country codes, the last one being the rest of the world
+    '''
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    codes = [''.join(c) for c in product(letters, repeat=3) if ''.join(c) != 'ROW']
+    return codes[:n_countries - 1] + ['ROW']
+
+
+class SyntheticRawData:
+    '''
+    Writes look-alike versions of the raw files read by make_dataset, with
+    `n_countries` countries (plus `n_extra_countries` outside the ICIO
+    tables, mapped to ROW by the migration ETL) and `n_industries` industries
+    per country, so that the whole build can run offline
+    '''
+
+    def __init__(self, input_filepath: str, icio_filepath: str = None,
+                 n_countries=30, n_industries=10, n_extra_countries=3,
+                 years=range(2005, 2016), seed=0):
+
+        self.input_filepath = input_filepath
+        self.icio_filepath = icio_filepath or input_filepath
+        self.years = [str(y) for y in years]
+        self.rng = np.random.default_rng(seed)
+
+        self.countries = country_codes(n_countries)
+        self.all_countries = country_codes(n_countries + n_extra_countries)[:-1] + ['ROW']
+        self.industries = [f'{i:02d}T{i + 1:02d}' for i in range(1, 2 * n_industries, 2)]
+
+    def icio_table(self, year):
+        '''
+        ICIO2018-shaped table: country_industry rows and columns, final demand
+        columns, TAXSUB/VALU/OUTPUT rows and TOTAL column, in millions
+        '''
+        nodes = [f'{c}_{i}' for c in self.countries for i in self.industries]
+        demand = [f'{c}_{d}' for c in self.countries for d in DEMAND_VARS]
+        n = len(nodes)
+
+        # Final demand first, intermediate inputs at most half of it per column
+        F = self.rng.lognormal(mean=2., sigma=1.5, size=(n, len(demand)))
+        y = F.sum(axis=1)
+        A = self.rng.dirichlet(np.full(n, 0.3), size=n).T * self.rng.uniform(0.1, 0.5, size=n)
+        Z = A * y
+        x = Z.sum(axis=1) + y
+
+        taxes = 0.05 * x
+        value_added = x - Z.sum(axis=0) - taxes
+
+        df = pd.DataFrame(np.hstack([Z, F]), index=nodes, columns=nodes + demand)
+
+        tax_rows = pd.DataFrame(0., index=[f'{c}_TAXSUB' for c in self.countries], columns=df.columns)
+        tax_rows[nodes] = np.repeat(taxes[None, :] / len(self.countries), len(self.countries), axis=0)
+
+        valu = pd.DataFrame([np.r_[value_added, np.zeros(len(demand))]], index=['VALU'], columns=df.columns)
+
+        df = pd.concat([df, tax_rows, valu])
+        df['TOTAL'] = df.sum(axis=1)
+
+        output = df.sum(axis=0).to_frame('OUTPUT').T
+        output[nodes] = x
+        df = pd.concat([df, output])
+
+        return df
+
+    def write_icio(self):
+        for year in self.years:
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+                z.writestr(f'ICIO2018_{year}.csv', self.icio_table(year).to_csv())
+            _write_bytes(buffer.getvalue(), os.path.join(self.icio_filepath, f'ICIO2018_{year}.zip'))
+
+    def write_migration(self):
+        '''
+        OECD International Migration Database (MIG) extract
+        '''
+        rows = []
+        for year in self.years:
+            for origin, destination in product(self.all_countries, self.countries):
+                if origin == destination or self.rng.random() > 0.6:
+                    continue
+                value = float(self.rng.pareto(1.5) * 1000)
+                rows.append(('Inflows of foreign population by nationality', year, origin, destination, value))
+                rows.append(('Stock of foreign population by nationality', year, origin, destination, value * 10))
+
+        df = pd.DataFrame(rows, columns=['Variable', 'Year', 'CO2', 'COU', 'Value'])
+        _write_bytes(df.to_csv(index=False).encode(),
+                     os.path.join(self.input_filepath, 'MIG_12082020131505678.csv'))
+
+    def _world_bank_table(self, indicator_name, indicator_code, mean, sigma):
+        years = [str(y) for y in range(1960, 2020)]
+        values = self.rng.lognormal(mean=mean, sigma=sigma, size=(len(self.all_countries), 1))
+        growth = np.cumprod(self.rng.normal(1.02, 0.02, size=(len(self.all_countries), len(years))), axis=1)
+
+        df = pd.DataFrame(values * growth, columns=years)
+        df.insert(0, 'Indicator Code', indicator_code)
+        df.insert(0, 'Indicator Name', indicator_name)
+        df.insert(0, 'Country Code', self.all_countries)
+        df.insert(0, 'Country Name', [f'Country {c}' for c in self.all_countries])
+        return df
+
+    def write_labour_force(self):
+        '''
+        World Bank labour force, total (SL.TLF.TOTL.IN) csv with its 4 line header
+        '''
+        df = self._world_bank_table('Labor force, total', 'SL.TLF.TOTL.IN', mean=15., sigma=1.5)
+        header = '"Data Source","World Development Indicators",\n\n"Last Updated Date","2020-12-16",\n\n'
+        _write_bytes((header + df.to_csv(index=False)).encode(),
+                     os.path.join(self.input_filepath, 'API_SL.TLF.TOTL.IN_DS2_en_csv_v2_1929128.csv'))
+
+    def write_gross_capital_formation(self):
+        '''
+        World Bank gross capital formation (NE.GDI.TOTL.CD) xls with its 3 line header
+        '''
+        df = self._world_bank_table('Gross capital formation (current US$)', 'NE.GDI.TOTL.CD', mean=23., sigma=2.)
+        buffer = io.BytesIO()
+        with pd.ExcelWriter(buffer, engine='xlwt') as writer:
+            df.to_excel(writer, index=False, startrow=3)
+        _write_bytes(buffer.getvalue(),
+                     os.path.join(self.input_filepath, 'API_NE.GDI.TOTL.CD_DS2_en_excel_v2_1742937.xls'))
+
+    def write_emigration_rates(self):
+        '''
+        DIOC-E emigration rates by country of birth, in percent
+        '''
+        rows = []
+        for country in self.all_countries:
+            rate = float(self.rng.uniform(0.5, 20.))
+            for sex in ['Total', 'Men', 'Women']:
+                rows.append((country, sex, rate))
+
+        df = pd.DataFrame(rows, columns=['coub', 'sex', 'ERT1'])
+        _write_bytes(df.to_csv(index=False).encode('latin-1'),
+                     os.path.join(self.input_filepath, 'File4_DIOC-E_3_Emigration Rates.csv'))
+
+    def write_gini(self):
+        '''
+        OECD income inequality (DP_LIVE) extract
+        '''
+        rows = [(c, 'INCOMEINEQ', 'GINI', 'INEQ', 'A', y, float(self.rng.uniform(0.25, 0.5)))
+                for c in self.all_countries for y in self.years]
+        df = pd.DataFrame(rows, columns=['LOCATION', 'INDICATOR', 'SUBJECT', 'MEASURE', 'FREQUENCY', 'TIME', 'Value'])
+        _write_bytes(df.to_csv(index=False).encode(),
+                     os.path.join(self.input_filepath, 'DP_LIVE_13102020161705689.csv'))
+
+    def run(self):
+
+        self.write_icio()
+
+        self.write_migration()
+
+        self.write_labour_force()
+
+        self.write_gross_capital_formation()
+
+        self.write_emigration_rates()
+
+        self.write_gini()
+
+
+def _write_bytes(data, path):
+    '''
+    Write `data` to a local or s3:// path
+    '''
+    if path.startswith('s3://'):
+        import fsspec
+        with fsspec.open(path, 'wb') as f:
+            f.write(data)
+        return
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
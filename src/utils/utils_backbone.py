@@ -0,0 +1,144 @@
+import warnings
+
+import numpy as np
+import networkx as nx
+from scipy.special import betainc
+
+from src.utils.utils_constants import BACKBONE_FILTERS as FILTERS
+
+
+def _shares(g, axis):
+    '''
+    Share of every edge in the out- (axis=1) or in-strength (axis=0) of its
+    node and the out- or in-degree of that node
+    '''
+    strength = g.sum(axis=axis, keepdims=True)
+    degree = (g > 0).sum(axis=axis, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(strength > 0, g / strength, 0.), np.broadcast_to(degree, g.shape)
+
+
+def polya_pvalues(g, a=1., axis=1):
+    '''
+    p-values of the edges of g against the Polya urn null model of their
+    source (axis=1) or target (axis=0) node: with k edges and reinforcement
+    a, the share p of an edge is Beta(1/a, (k-1)/a) distributed in the
+    continuous limit, so P(share >= p) = I_{1-p}((k-1)/a, 1/a). Edges of
+    nodes with a single edge get p-value 0 (always kept).
+    '''
+    p, k = _shares(g, axis)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pvalues = betainc(np.maximum(k - 1, 1) / a, 1. / a, 1. - p)
+    return np.where(k > 1, pvalues, 0.)
+
+
+def disparity_pvalues(g, axis=1):
+    '''
+    p-values of the disparity filter, (1 - p)^(k-1): the Polya filter with a=1
+    '''
+    p, k = _shares(g, axis)
+    return np.where(k > 1, (1. - p) ** (k - 1), 0.)
+
+
+def disparity_filter(g, alpha=0.05):
+    '''
+    Edges significant at level alpha for their source or their target
+    '''
+    return (g > 0) & ((disparity_pvalues(g, axis=1) < alpha) | (disparity_pvalues(g, axis=0) < alpha))
+
+
+def polya_filter(g, alpha=0.05, a=None):
+    '''
+    Edges significant at level alpha, for their source or their target,
+    under the Polya urn null model of reinforcement a, required (a=1 is the
+    disparity filter, warned about)
+    '''
+    if a is None:
+        raise ValueError("The Polya filter needs the urn parameter a")
+    if a <= 0:
+        raise ValueError(f"The Polya urn parameter a must be positive, got {a}")
+    if a == 1:
+        warnings.warn("The Polya filter with a=1 is the disparity filter, set the urn parameter a")
+    return (g > 0) & ((polya_pvalues(g, a, axis=1) < alpha) | (polya_pvalues(g, a, axis=0) < alpha))
+
+
+def global_filter(g, quantile=0.5):
+    '''
+    Edges with a weight at or above the given quantile of the edge weights
+    '''
+    weights = g[g > 0]
+    if len(weights) == 0:
+        return g > 0
+    return g >= np.quantile(weights, quantile)
+
+
+def node_share_filter(g, share=0.01):
+    '''
+    Edges that carry at least `share` of the out-strength of their source
+    or of the in-strength of their target
+    '''
+    return (g > 0) & ((_shares(g, axis=1)[0] >= share) | (_shares(g, axis=0)[0] >= share))
+
+
+def backbone_mask(g, method='disparity', value=None, **kwargs):
+    '''
+    Boolean mask of the edges of the weighted adjacency matrix g kept by the
+    filter `method` with parameter `value` (FILTERS default if None).
+    Self-loops (the domestic flows of the IO tables) are always kept and do
+    not count in the strengths and degrees the filters test against.
+    '''
+    if method not in FILTERS:
+        raise ValueError(f"Unknown backbone filter {method}, expected one of {tuple(FILTERS)}")
+
+    g = np.nan_to_num(np.asarray(g, dtype=float))
+    loops = np.diag(g).copy()
+    np.fill_diagonal(g, 0.)
+
+    value = FILTERS[method] if value is None else value
+    mask = {'disparity': disparity_filter,
+            'polya': polya_filter,
+            'global': global_filter,
+            'node_share': node_share_filter}[method](g, value, **kwargs)
+
+    mask[np.diag_indices_from(mask)] = loops > 0
+    return mask
+
+
+def backbone_stats(g, mask):
+    '''
+    Edges and total weight before and after filtering, self-loops included
+    '''
+    g = np.nan_to_num(np.asarray(g, dtype=float))
+    edges, weight = (g > 0).sum(), g.sum()
+    kept_edges, kept_weight = (mask & (g > 0)).sum(), g[mask].sum()
+    return dict(edges=int(edges), kept_edges=int(kept_edges),
+                kept_edge_share=kept_edges / edges if edges else np.nan,
+                weight=float(weight), kept_weight=float(kept_weight),
+                kept_weight_share=kept_weight / weight if weight else np.nan)
+
+
+def backbone(g, method='disparity', value=None, **kwargs):
+    '''
+    Backbone of the adjacency matrix g (filtered edges set to 0) and its
+    backbone_stats, with the filter's keyword arguments (e.g. the urn a)
+    '''
+    g = np.nan_to_num(np.asarray(g, dtype=float))
+    mask = backbone_mask(g, method, value, **kwargs)
+    return np.where(mask, g, 0.), dict(method=method, value=FILTERS[method] if value is None else value,
+                                       **kwargs, **backbone_stats(g, mask))
+
+
+def backbone_graph(G, method='disparity', value=None, weight='weight', **kwargs):
+    '''
+    Copy of G without the edges outside its backbone (every node kept) and
+    the backbone_stats
+    '''
+    nodes = list(G)
+    g = nx.linalg.graphmatrix.adjacency_matrix(G, nodelist=nodes, weight=weight).toarray()
+    mask = backbone_mask(g, method, value, **kwargs)
+
+    H = G.copy()
+    rows, cols = np.nonzero((g > 0) & ~mask)
+    H.remove_edges_from((nodes[i], nodes[j]) for i, j in zip(rows, cols))
+    return H, dict(method=method, value=FILTERS[method] if value is None else value,
+                   **kwargs, **backbone_stats(g, mask))
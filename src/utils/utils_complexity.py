@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from src.utils.utils_constants import COMPLEXITY_METHODS as METHODS
+
+
+def export_matrix(Z, node_index):
+    '''
+    country x industry DataFrame of exports: the sales of every
+    country_industry sector of the flow matrix Z (= B x) to sectors of
+    other countries
+    '''
+    labels = pd.Index(node_index)
+    country = labels.str[:3].values
+    Z = np.asarray(Z, dtype=float)
+
+    foreign = Z.sum(axis=1) - np.where(country[:, None] == country[None, :], Z, 0.).sum(axis=1)
+    exports = pd.Series(foreign, index=pd.MultiIndex.from_arrays(
+        [country, labels.str[4:].values], names=['country', 'industry']))
+
+    return exports.unstack(fill_value=0.)
+
+
+def rca(X):
+    '''
+    Balassa revealed comparative advantage of a (..., country, product)
+    stack of export matrices, 0 where a country or a product exports nothing
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        country_share = X / X.sum(axis=-1, keepdims=True)
+        world_share = X.sum(axis=-2, keepdims=True) / X.sum(axis=(-2, -1), keepdims=True)
+        return np.nan_to_num(country_share / world_share, nan=0., posinf=0.)
+
+
+def _inverse(k, power=1.):
+    with np.errstate(divide='ignore'):
+        return np.where(k > 0, k ** -power, 0.)
+
+
+def _standardise(values, active, sign_reference=None):
+    '''
+    z-scores over the active entries of every row, NaN elsewhere, oriented
+    to correlate positively with sign_reference when given
+    '''
+    values = np.where(active, values, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (values - np.nanmean(values, axis=-1, keepdims=True)) / np.nanstd(values, axis=-1, keepdims=True)
+
+    if sign_reference is not None:
+        reference = np.where(active, sign_reference, np.nan)
+        reference = reference - np.nanmean(reference, axis=-1, keepdims=True)
+        sign = np.sign(np.nansum(z * reference, axis=-1, keepdims=True))
+        z = z * np.where(sign == 0, 1., sign)
+    return z
+
+
+def _product_complexity(M, eci, ubiquity):
+    '''
+    PCI as the product counterpart of the ECI eigenvector, U^-1 M' ECI
+    '''
+    pci = _inverse(ubiquity) * (M.swapaxes(-1, -2) @ np.nan_to_num(eci)[..., None])[..., 0]
+    return _standardise(pci, ubiquity > 0)
+
+
+def complexity_eigenvector(M):
+    '''
+    ECI and PCI of a (year, country, product) stack of binary specialisation
+    matrices, from the second eigenvector of M~ = D^-1 M U^-1 M'. M~ is
+    similar to the symmetric S = D^-1/2 M U^-1 M' D^-1/2, so the whole stack
+    is solved by one batched eigh. Countries and products absent from a year
+    have zero rows in S and fall out at eigenvalue 0.
+    '''
+    diversity, ubiquity = M.sum(axis=-1), M.sum(axis=-2)
+    d, u = _inverse(diversity, 0.5), _inverse(ubiquity)
+
+    S = d[..., :, None] * ((M * u[..., None, :]) @ M.swapaxes(-1, -2)) * d[..., None, :]
+    _, vectors = np.linalg.eigh(S)
+
+    eci = _standardise(d * vectors[..., -2], diversity > 0, diversity)
+    return eci, _product_complexity(M, eci, ubiquity)
+
+
+def complexity_reflections(M, iterations=20):
+    '''
+    ECI and PCI of a (year, country, product) stack of binary specialisation
+    matrices by the method of reflections: k_c,n = 1/k_c,0 sum_p M k_p,n-1
+    and k_p,n = 1/k_p,0 sum_c M k_c,n-1, standardised after an even number
+    of iterations
+    '''
+    diversity, ubiquity = M.sum(axis=-1), M.sum(axis=-2)
+    d, u = _inverse(diversity), _inverse(ubiquity)
+
+    k_c, k_p = diversity, ubiquity
+    for _ in range(iterations + iterations % 2):
+        k_c, k_p = d * (M @ k_p[..., None])[..., 0], u * (M.swapaxes(-1, -2) @ k_c[..., None])[..., 0]
+
+    eci = _standardise(k_c, diversity > 0, diversity)
+    return eci, _product_complexity(M, eci, ubiquity)
+
+
+def economic_complexity(exports, method='eigenvector', threshold=1., iterations=20):
+    '''
+    ECI of the countries and PCI of the industries of every year of
+    `exports` ({year: country x industry DataFrame}), aligned on the union
+    of countries and industries and computed in one batch. A country is
+    specialised in an industry when its RCA is at least `threshold`.
+
+    Returns (df_eci, df_pci): year, country, eci, diversity and year,
+    industry, pci, ubiquity.
+    '''
+    if method not in METHODS:
+        raise ValueError(f"Unknown method {method}, expected one of {METHODS}")
+
+    years = [str(y) for y in exports]
+    countries = sorted(set().union(*(df.index for df in exports.values())))
+    industries = sorted(set().union(*(df.columns for df in exports.values())))
+
+    X = np.stack([df.reindex(index=countries, columns=industries, fill_value=0.).values
+                  for df in exports.values()]).astype(float)
+    M = (rca(X) >= threshold).astype(float)
+
+    if method == 'eigenvector':
+        eci, pci = complexity_eigenvector(M)
+    else:
+        eci, pci = complexity_reflections(M, iterations=iterations)
+
+    df_eci = pd.DataFrame({
+        'year': np.repeat(years, len(countries)), 'country': np.tile(countries, len(years)),
+        'eci': eci.ravel(), 'diversity': M.sum(axis=-1).ravel(),
+    })
+    df_pci = pd.DataFrame({
+        'year': np.repeat(years, len(industries)), 'industry': np.tile(industries, len(years)),
+        'pci': pci.ravel(), 'ubiquity': M.sum(axis=-2).ravel(),
+    })
+    return df_eci.dropna(subset=['eci']), df_pci.dropna(subset=['pci'])
@@ -0,0 +1,23 @@
+# Constants shared by the pipeline modules and the command line options.
+# This module must stay free of third-party imports, so that the CLI can
+# build its options (and answer --help) without loading the pipeline.
+
+EORA_FILEPATH = 's3://workspaces-clarity-mgmt-pro/jaime.oliver/misc/EORA/'
+ICIO_FILEPATH = 's3://workspaces-clarity-mgmt-pro/jaime.oliver/jobs/value_chain/oecd/input_output/'
+
+# Node granularity of the networks: countries, or country_industry sectors
+RESOLUTIONS = ('country', 'industry')
+
+# Solvers of the economic complexity indices
+COMPLEXITY_METHODS = ('eigenvector', 'reflections')
+
+# Methods of the node embeddings of the networks (umap needs umap-learn)
+EMBEDDING_METHODS = ('spectral', 'umap')
+
+# Backbone filter -> default value of its parameter
+BACKBONE_FILTERS = {
+    'disparity': 0.05,    # significance level
+    'polya': 0.05,        # significance level, with the urn parameter `a`
+    'global': 0.5,        # quantile of the edge weights
+    'node_share': 0.01,   # share of the node's strength
+}
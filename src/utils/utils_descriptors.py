@@ -0,0 +1,94 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from src.utils.utils_networks import efficiency_from_distances, network_years_generator
+
+
+def graph_arrays(G, weight='weight'):
+    '''
+    Node list and COO edge arrays (rows, cols, weights) of G. Missing
+    weights count as 1.
+    '''
+    nodes = list(G)
+    index = {n: i for i, n in enumerate(nodes)}
+
+    edges = list(G.edges(data=weight, default=1))
+    rows = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+    cols = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+    weights = np.fromiter((w for _, _, w in edges), dtype=float, count=len(edges))
+
+    return nodes, rows, cols, weights
+
+
+def weighted_clustering(n, rows, cols, weights):
+    '''
+    Weighted directed clustering of every node (Fagiolo, 2007), the same
+    definition as nx.clustering(G, weight=...) on a DiGraph, computed from
+    the diagonal of (S + S^T)^3 with S the cube root of the max-normalised
+    weights
+    '''
+    max_weight = weights.max() if len(weights) else 1.
+
+    off_diagonal = rows != cols
+    r, c = rows[off_diagonal], cols[off_diagonal]
+
+    s = np.zeros((n, n))
+    s[r, c] = np.cbrt(weights[off_diagonal] / max_weight)
+    t = s + s.T
+    triangles = ((t @ t) * t.T).sum(axis=1)
+
+    pattern = np.zeros((n, n), dtype=bool)
+    pattern[r, c] = True
+    d_total = pattern.sum(axis=0) + pattern.sum(axis=1)
+    d_bidirectional = (pattern & pattern.T).sum(axis=1)
+
+    denom = 2 * (d_total * (d_total - 1) - 2 * d_bidirectional)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(triangles == 0, 0., triangles / denom)
+
+
+def network_descriptors(n, rows, cols, weights):
+    '''
+    Global efficiency, average weighted degree, out-in strength assortativity,
+    average weighted clustering and density of a weighted digraph with n nodes
+    given as COO edge arrays. Each metric matches its networkx counterpart
+    (global_efficiency, average_degree, degree_pearson_correlation_coefficient
+    and average_clustering with weight='weight').
+    '''
+    if (weights < 0).any():
+        raise nx.NetworkXError("edge weights must be positive")
+
+    total_weight = weights.sum()
+    if total_weight <= 0:
+        raise nx.NetworkXError("Size of G must be positive")
+
+    keep = weights > 0
+    distances = sp.csr_matrix((total_weight / weights[keep], (rows[keep], cols[keep])), shape=(n, n))
+
+    out_strength = np.bincount(rows, weights, minlength=n)
+    in_strength = np.bincount(cols, weights, minlength=n)
+
+    return {
+        'efficiency': efficiency_from_distances(distances, len(rows)),
+        'average_degree': float(2 * total_weight / n),
+        'assortativity_coefficient': float(np.corrcoef(out_strength[rows], in_strength[cols])[0, 1]),
+        'average_clustering': float(weighted_clustering(n, rows, cols, weights).mean()),
+        'density': len(rows) / (n * (n - 1)) if n > 1 else 0.,
+    }
+
+
+def describe_networks(output_filepath, networks, years=range(2000, 2019), weight='weight'):
+    '''
+    Tidy year x network x metric table of network_descriptors for every
+    network over the years
+    '''
+    rows = []
+    for network in networks:
+        graphs = network_years_generator(output_filepath, network, years=years, arrays=True, weight=weight)
+        for year, graph in zip(years, graphs):
+            for metric, value in network_descriptors(len(graph), graph.rows, graph.cols, graph.weights).items():
+                rows.append((year, network, metric, value))
+
+    return pd.DataFrame(rows, columns=['year', 'network', 'metric', 'value'])
@@ -0,0 +1,153 @@
+import numpy as np
+import scipy.linalg
+import scipy.sparse as sp
+from scipy.sparse.linalg import lobpcg
+
+from src.utils.utils_constants import EMBEDDING_METHODS as METHODS
+
+# Largest network embedded by a dense eigendecomposition, larger ones are
+# solved iteratively (LOBPCG) from the previous year's coordinates
+DENSE_EIGH_LIMIT = 2000
+
+
+def _normalized_adjacency(g):
+    '''
+    D^-1/2 A D^-1/2 of the symmetrised adjacency A = (g + g')/2 and the
+    degrees D (1 for isolated nodes)
+    '''
+    A = sp.csr_matrix(np.nan_to_num(np.asarray(g, dtype=float)))
+    A = (A + A.T) / 2
+    degrees = np.asarray(A.sum(axis=1)).ravel()
+    degrees[degrees <= 0] = 1.
+    scale = sp.diags(1. / np.sqrt(degrees))
+    return scale @ A @ scale, degrees
+
+
+def spectral_embedding(g, n_components=2, seed=0, init=None):
+    '''
+    Laplacian eigenmap of the symmetrised weighted adjacency matrix g: the
+    leading non-trivial eigenvectors of D^-1/2 A D^-1/2, scaled by D^-1/2.
+    Networks above DENSE_EIGH_LIMIT nodes are solved by LOBPCG started from
+    `init` (the previous coordinates) or from a seeded random block.
+    '''
+    N, degrees = _normalized_adjacency(g)
+    n = N.shape[0]
+    k = min(n_components + 1, n)
+
+    if n <= DENSE_EIGH_LIMIT:
+        values, vectors = scipy.linalg.eigh(N.toarray(), subset_by_index=[n - k, n - 1])
+    else:
+        trivial = np.sqrt(degrees) / np.linalg.norm(np.sqrt(degrees))
+        X = np.random.default_rng(seed).standard_normal((n, k))
+        if init is not None:
+            X[:, 1:] = np.asarray(init)[:, :k - 1] * np.sqrt(degrees)[:, None]
+        # Without the trivial direction, that the alignment translation adds
+        X[:, 1:] -= np.outer(trivial, trivial @ X[:, 1:])
+        X[:, 0] = trivial
+        values, vectors = lobpcg(N, X, largest=True, maxiter=500)
+
+    # Largest eigenvalue first, without the trivial one (1)
+    vectors = vectors[:, np.argsort(values)[::-1]][:, 1:] / np.sqrt(degrees)[:, None]
+    return np.pad(vectors, ((0, 0), (0, n_components - vectors.shape[1])))
+
+
+def umap_embedding(g, n_components=2, seed=0, init=None):
+    '''
+    UMAP of the rows of the adjacency matrix g (umap-learn, optional),
+    started from `init` when given, seeded for reproducibility
+    '''
+    import umap
+
+    reducer = umap.UMAP(n_components=n_components, random_state=seed,
+                        init='spectral' if init is None else np.asarray(init))
+    return reducer.fit_transform(np.nan_to_num(np.asarray(g, dtype=float)))
+
+
+def procrustes_align(X, reference, shared=None):
+    '''
+    X rotated (or reflected) and translated so that its rows `shared` (a
+    mask, all rows by default) best match the rows of `reference`, by
+    orthogonal Procrustes
+    '''
+    X_shared = X if shared is None else X[shared]
+    mu_x, mu_ref = X_shared.mean(axis=0), reference.mean(axis=0)
+    R, _ = scipy.linalg.orthogonal_procrustes(X_shared - mu_x, reference - mu_ref)
+    return mu_ref + (X - mu_x) @ R
+
+
+def initial_coordinates(g, nodes, previous, seed=0):
+    '''
+    Starting coordinates of `nodes`: their previous ones and, for new nodes,
+    the weighted mean of their known neighbours (the centroid if none), with
+    a small seeded jitter. None without previous coordinates.
+    '''
+    if previous is None:
+        return None
+
+    known = np.array([node in previous.index for node in nodes])
+    init = np.zeros((len(nodes), previous.shape[1]))
+    init[known] = previous.loc[[node for node, k in zip(nodes, known) if k]].to_numpy()
+    if known.all():
+        return init
+
+    g = np.nan_to_num(np.asarray(g, dtype=float))
+    links = (g + g.T)[~known][:, known]
+    strength = links.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        neighbours = np.where(strength > 0, links @ init[known] / strength, init[known].mean(axis=0))
+
+    rng = np.random.default_rng(seed)
+    init[~known] = neighbours + 1e-3 * init[known].std(axis=0) * rng.standard_normal(neighbours.shape)
+    return init
+
+
+class AlignedEmbedding:
+    '''
+    Embeddings of yearly networks aligned across years: every pushed network
+    starts from the previous coordinates (initial_coordinates) and is then
+    aligned to them over the nodes they share (procrustes_align), with a
+    fixed seed.
+
+        embedding = AlignedEmbedding('spectral')
+        for year, nodes, g in ...:
+            df = embedding.push(nodes, g)
+    '''
+    def __init__(self, method='spectral', n_components=2, seed=0):
+        if method not in METHODS:
+            raise ValueError(f"Unknown embedding method {method}, expected one of {METHODS}")
+        self.method = method
+        self.n_components = n_components
+        self.seed = seed
+        self.previous = None
+
+        self._embed = {'spectral': spectral_embedding, 'umap': umap_embedding}[method]
+        self.columns = [f'{method}_{i}' for i in range(n_components)]
+
+    def push(self, nodes, g):
+        '''
+        Node x component DataFrame (columns <method>_<i>) of the adjacency
+        matrix g
+        '''
+        import pandas as pd
+
+        init = initial_coordinates(g, nodes, self.previous, seed=self.seed)
+        coordinates = self._embed(g, n_components=self.n_components, seed=self.seed, init=init)
+
+        df = pd.DataFrame(coordinates, index=pd.Index(nodes, name='country'), columns=self.columns)
+        if self.previous is not None:
+            shared = df.index.isin(self.previous.index)
+            if shared.sum() > self.n_components:
+                df[:] = procrustes_align(df.to_numpy(), self.previous.loc[df.index[shared]].to_numpy(), shared)
+
+        self.previous = df
+        return df
+
+
+def embed_years(networks, method='spectral', n_components=2, seed=0):
+    '''
+    AlignedEmbedding of a sequence of (year, nodes, g), yielding (year, node
+    x component DataFrame)
+    '''
+    embedding = AlignedEmbedding(method, n_components, seed)
+    for year, nodes, g in networks:
+        yield year, embedding.push(nodes, g)
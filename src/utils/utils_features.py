@@ -1,66 +1,137 @@
 import pandas as pd
 import numpy as np
 import networkx as nx
-from src.utils.utils_networks import godfhater_index, bridging_centrality, favor_centrality
+from src.utils.utils_networks import (
+    godfhater_index,
+    godfhater_index_sweep,
+    bridging_centrality,
+    favor_centrality,
+    favor_centrality_sweep,
+)
+from src.utils.utils_matrix_features import (
+    feature_tasks,
+    matrix_features,
+    run_feature_tasks,
+    select_features,
+)
+from src.utils.utils_instrumentation import span
 
 import os
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 
+# From this size on compute_features(method='auto') uses the matrix kernels
+MATRIX_MIN_NODES = 300
+
+def _node_values(G, values):
+    return [values[n] for n in G]
+
+
+def _hits(G):
+    h, a = nx.hits(G, max_iter=750)
+    return {'hubs': _node_values(G, h), 'authorities': _node_values(G, a)}, None
+
+
+def _pagerank(G):
+    return {'pagerank': _node_values(G, nx.pagerank(G, max_iter=1000, weight='weight'))}, None
+
+
+def _gfi(G, tol):
+    return {'gfi': _node_values(G, godfhater_index(G, tol=tol))}, None
+
+
+def _bridging(G):
+    return {'bridging': _node_values(G, bridging_centrality(G))}, None
+
+
+def _out_favor(G, tol):
+    return {'out_favor': _node_values(G, favor_centrality(G, tol=tol))}, None
+
+
+def _in_favor(G, tol):
+    return {'in_favor': _node_values(G, favor_centrality(G, tol=tol, transpose=True))}, None
+
+
+def _hhi(G):
+    g = np.nan_to_num(nx.linalg.graphmatrix.adjacency_matrix(G).toarray())
+    return {'hhi_index': np.square(g/g.sum(axis=1)[:,None]).sum(axis=1)}, None
+
+
+# Task -> (features, function of the graph), the networkx counterpart of MATRIX_TASKS
+NETWORKX_TASKS = {
+    'hits': (('hubs', 'authorities'), _hits),
+    'pagerank': (('pagerank',), _pagerank),
+    'gfi': (('gfi',), _gfi),
+    'bridging': (('bridging',), _bridging),
+    'out_favor': (('out_favor',), _out_favor),
+    'in_favor': (('in_favor',), _in_favor),
+    'hhi': (('hhi_index',), _hhi),
+}
+
 class NetworkFeatureComputation:
     def __init__(self, graph):
         self.G = graph
         
-    def compute_features(self, tol_gfi, tol_favor):
+    def compute_features(self, tol_gfi, tol_favor, method='auto', features=None, executor=None):
         '''
-        Compute graph features
+        Compute graph features. method='networkx' runs the reference
+        implementations, 'matrix' the dense matrix kernels of
+        utils_matrix_features (same values, HITS up to its tolerance) and
+        'auto' the latter from MATRIX_MIN_NODES nodes on.
+
+        `features` selects a subset of FEATURES (all by default). The
+        centralities are independent tasks over one read-only graph or
+        adjacency buffer, run on `executor` (a thread pool per call by
+        default, or any concurrent.futures executor, processes included)
+        and set on the graph in FEATURES order.
         '''
-        self.df = pd.DataFrame(list(self.G.nodes), columns=['country_industry'])
-        
-        try:
-            h,a=nx.hits(self.G, max_iter=750)
-            h = {k:{'hubs':v} for k,v in h.items()}
-            a = {k:{'authorities':v} for k,v in a.items()}
+        features = select_features(features)
+        nodes = list(self.G.nodes)
+        self.df = pd.DataFrame(nodes, columns=['country_industry'])
 
-        except nx.PowerIterationFailedConvergence:
-            warnings.warn("nx.PowerIterationFailedConvergence")
-            h = {n:{'hubs':np.nan} for n in self.G.nodes()}
-            a = {n:{'authorities':np.nan} for n in self.G.nodes()}
+        if method == 'auto':
+            method = 'matrix' if len(self.G) >= MATRIX_MIN_NODES else 'networkx'
 
-        nx.set_node_attributes(self.G, h)
-        nx.set_node_attributes(self.G, a)
+        own_executor = executor is None
+        if own_executor:
+            executor = ThreadPoolExecutor(max_workers=len(feature_tasks(features)))
 
         try:
-            pagerank_dict = nx.pagerank(self.G, max_iter=1000, weight='weight')
-            pagerank_dict = {k:{'pagerank':v} for k,v in pagerank_dict.items()}
+            if method == 'matrix':
+                g = nx.to_numpy_array(self.G, weight='weight')
+                df_features = matrix_features(g, nodes, tol_gfi=tol_gfi, tol_favor=tol_favor,
+                                              features=features, executor=executor)
+            else:
+                params = {'gfi': {'tol': tol_gfi}, 'out_favor': {'tol': tol_favor}, 'in_favor': {'tol': tol_favor}}
+                values = run_feature_tasks(NETWORKX_TASKS, self.G, feature_tasks(features), params, executor)
+                df_features = pd.DataFrame({f: values[f] for f in features}, index=nodes)
+        finally:
+            if own_executor:
+                executor.shutdown()
 
-        except nx.PowerIterationFailedConvergence:
-            warnings.warn("nx.PowerIterationFailedConvergence")
-            pagerank_dict = {n:{'pagerank':np.nan} for n in self.G.nodes()}
+        nx.set_node_attributes(self.G, df_features.to_dict(orient='index'))
 
-        nx.set_node_attributes(self.G, pagerank_dict)
-        
-        gfi = godfhater_index(self.G, tol=tol_gfi)
-        gfi = {k:{'gfi':v} for k,v in gfi.items()}
-        nx.set_node_attributes(self.G, gfi)     
-        
-        bridging = bridging_centrality(self.G)
-        bridging = {k:{'bridging':v} for k,v in bridging.items()}
-        nx.set_node_attributes(self.G, bridging)     
-        
-        out_favor = favor_centrality(self.G, tol=tol_favor)
-        out_favor = {k:{'out_favor':v} for k,v in out_favor.items()}
-        nx.set_node_attributes(self.G, out_favor)   
+    def tolerance_sweep(self, tolerances_gfi, tolerances_favor=None):
+        '''
+        Tidy (country_industry, feature, tolerance, value) table of gfi and
+        of the supported friends counts behind out_favor and in_favor
+        (features out_supported_friends and in_supported_friends) for every
+        tolerance, each computed in one pass
+        '''
+        if tolerances_favor is None:
+            tolerances_favor = tolerances_gfi
 
-        in_favor = favor_centrality(self.G, tol=tol_favor, transpose=True)
-        in_favor = {k:{'in_favor':v} for k,v in in_favor.items()}
-        nx.set_node_attributes(self.G, in_favor)   
-        
-        g = nx.linalg.graphmatrix.adjacency_matrix(self.G).toarray()
-        g = np.nan_to_num(g)
-        
-        hhi_index = np.square(g/g.sum(axis=1)[:,None]).sum(axis=1)   
-        hhi_index = dict(zip(self.G.nodes(), hhi_index))
-        hhi_index = {k:{'hhi_index':hhi_index_i} for k, hhi_index_i in hhi_index.items()}
-        nx.set_node_attributes(self.G, hhi_index)
+        with span('gfi_sweep'):
+            sweeps = {'gfi': godfhater_index_sweep(self.G, tolerances_gfi)}
+        with span('favor_sweep'):
+            sweeps['out_supported_friends'] = favor_centrality_sweep(self.G, tolerances_favor)
+            sweeps['in_supported_friends'] = favor_centrality_sweep(self.G, tolerances_favor, transpose=True)
+
+        df_sweep = []
+        for feature, df in sweeps.items():
+            df = df.rename_axis(index='country_industry', columns='tolerance').stack().rename('value')
+            df_sweep.append(df.astype(float).reset_index().assign(feature=feature))
+
+        return pd.concat(df_sweep, ignore_index=True)[['country_industry', 'feature', 'tolerance', 'value']]
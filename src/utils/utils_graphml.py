@@ -0,0 +1,228 @@
+from array import array
+from collections import defaultdict
+from xml.etree.ElementTree import iterparse
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+
+GRAPHML_NAMESPACE = 'http://graphml.graphdrawing.org/xmlns'
+
+GRAPHML_HEADER = (
+    "<?xml version='1.0' encoding='utf-8'?>\n"
+    f'<graphml xmlns="{GRAPHML_NAMESPACE}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+    f'xsi:schemaLocation="{GRAPHML_NAMESPACE} {GRAPHML_NAMESPACE}/1.0/graphml.xsd">\n'
+)
+
+# GraphML attr.type -> parser of the data text
+PARSERS = {
+    'boolean': lambda text: text.strip().lower() in ('true', '1'),
+    'int': int, 'long': int, 'integer': int,
+    'float': float, 'double': float,
+    'string': str,
+}
+
+
+class GraphArrays:
+    '''
+    A graph as arrays: node labels, a node x attribute DataFrame and the COO
+    weights (rows, cols, weights) of its edges, as read by
+    read_graphml_arrays and written by write_graphml_arrays
+    '''
+    def __init__(self, nodes, rows, cols, weights, node_attributes=None, directed=True):
+        self.nodes = list(nodes)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.cols = np.asarray(cols, dtype=np.int64)
+        self.weights = np.asarray(weights, dtype=float)
+        self.node_attributes = (pd.DataFrame(index=self.nodes) if node_attributes is None
+                                else node_attributes)
+        self.directed = directed
+
+    def __len__(self):
+        return len(self.nodes)
+
+    @classmethod
+    def from_adjacency(cls, g, nodes, node_attributes=None):
+        '''
+        Edges of the non-zero entries of the adjacency matrix g, as
+        nx.from_pandas_adjacency builds them
+        '''
+        g = np.asarray(g, dtype=float)
+        rows, cols = np.nonzero(g)
+        return cls(nodes, rows, cols, g[rows, cols], node_attributes)
+
+    @classmethod
+    def from_networkx(cls, G, weight='weight'):
+        nodes = list(G)
+        index = {n: i for i, n in enumerate(nodes)}
+        edges = list(G.edges(data=weight, default=1))
+
+        rows = np.fromiter((index[u] for u, _, _ in edges), dtype=np.int64, count=len(edges))
+        cols = np.fromiter((index[v] for _, v, _ in edges), dtype=np.int64, count=len(edges))
+        weights = np.fromiter((w for _, _, w in edges), dtype=float, count=len(edges))
+        node_attributes = pd.DataFrame.from_dict(dict(G.nodes(data=True)), orient='index').reindex(nodes)
+
+        return cls(nodes, rows, cols, weights, node_attributes, directed=G.is_directed())
+
+    def csr(self):
+        n = len(self.nodes)
+        return sp.csr_matrix((self.weights, (self.rows, self.cols)), shape=(n, n))
+
+    def to_networkx(self, weight='weight'):
+        G = nx.DiGraph() if self.directed else nx.Graph()
+        G.add_nodes_from((n, {k: v for k, v in attributes.items() if not _missing(v)})
+                         for n, attributes in zip(self.nodes, self.node_attributes.to_dict(orient='records')))
+        G.add_weighted_edges_from(zip([self.nodes[i] for i in self.rows], [self.nodes[j] for j in self.cols],
+                                      self.weights.tolist()), weight=weight)
+        return G
+
+
+def _missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def _local_name(tag):
+    return tag.rpartition('}')[2]
+
+
+def read_graphml_arrays(source, weight='weight'):
+    '''
+    GraphArrays of the GraphML file (path or binary file object) `source`,
+    parsed incrementally with iterparse: every node and edge element is
+    turned into columns as soon as it ends and then discarded, so neither a
+    DOM nor a networkx graph is ever built. Edges without a `weight` value
+    take the key default, or 1.
+    '''
+    keys, defaults = {}, {}
+    node_index = {}
+    columns = defaultdict(dict)
+    rows, cols, weights = array('q'), array('q'), array('d')
+    directed, graph = True, None
+
+    default_weight = 1.
+
+    for event, elem in iterparse(source, events=('start', 'end')):
+        tag = _local_name(elem.tag)
+
+        if event == 'start':
+            if tag == 'graph' and graph is None:
+                graph = elem
+                directed = elem.get('edgedefault', 'directed') == 'directed'
+            continue
+
+        if tag == 'key':
+            domain, name = elem.get('for', 'all'), elem.get('attr.name')
+            parse = PARSERS.get(elem.get('attr.type', 'string'), str)
+            keys[elem.get('id')] = (domain, name, parse)
+
+            default = next((child for child in elem if _local_name(child.tag) == 'default'), None)
+            if default is not None:
+                defaults[elem.get('id')] = parse(default.text)
+                if name == weight and domain in ('edge', 'all'):
+                    default_weight = float(defaults[elem.get('id')])
+
+        elif tag == 'node':
+            i = node_index.setdefault(elem.get('id'), len(node_index))
+            for data in elem:
+                _, name, parse = keys[data.get('key')]
+                columns[name][i] = parse(data.text or '')
+            graph.clear()
+
+        elif tag == 'edge':
+            w = default_weight
+            for data in elem:
+                _, name, parse = keys[data.get('key')]
+                if name == weight:
+                    w = float(parse(data.text or ''))
+
+            rows.append(node_index.setdefault(elem.get('source'), len(node_index)))
+            cols.append(node_index.setdefault(elem.get('target'), len(node_index)))
+            weights.append(w)
+            graph.clear()
+
+    nodes = list(node_index)
+    node_attributes = pd.DataFrame(index=nodes)
+    for key, (domain, name, parse) in keys.items():
+        if domain in ('node', 'all') and name not in node_attributes:
+            values = pd.Series(columns.get(name, {}), dtype=object).reindex(range(len(nodes)))
+            if key in defaults:
+                values = values.fillna(defaults[key])
+            # Only the numeric attr.types become numeric columns, strings such as '007' stay strings
+            if parse in (int, float):
+                values = pd.to_numeric(values)
+            elif parse is not str:
+                values = values.infer_objects()
+            node_attributes[name] = values.values
+
+    return GraphArrays(nodes, np.frombuffer(rows, dtype=np.int64), np.frombuffer(cols, dtype=np.int64),
+                       np.frombuffer(weights, dtype=float), node_attributes, directed=directed)
+
+
+def _graphml_type(series):
+    if pd.api.types.is_bool_dtype(series):
+        return 'boolean'
+    if pd.api.types.is_integer_dtype(series):
+        return 'long'
+    if pd.api.types.is_float_dtype(series):
+        return 'double'
+    return 'string'
+
+
+def _text(value, graphml_type):
+    if graphml_type == 'boolean':
+        return 'true' if value else 'false'
+    if graphml_type == 'double':
+        return repr(float(value))
+    return escape(str(value))
+
+
+def write_graphml_arrays(target, graph, weight='weight', chunk_size=10000):
+    '''
+    Write the GraphArrays `graph` as GraphML to `target` (path or text file
+    object), streaming the elements in chunks of chunk_size without building
+    a networkx graph. Missing (NaN/None) node attributes are omitted.
+    '''
+    if isinstance(target, str):
+        with open(target, 'w', encoding='utf-8') as f:
+            return write_graphml_arrays(f, graph, weight=weight, chunk_size=chunk_size)
+
+    attributes = graph.node_attributes
+    types = {name: _graphml_type(attributes[name]) for name in attributes.columns}
+    node_keys = {name: f'd{k}' for k, name in enumerate(attributes.columns)}
+    weight_key = f'd{len(node_keys)}'
+
+    target.write(GRAPHML_HEADER)
+    for name, key in node_keys.items():
+        target.write(f'  <key id="{key}" for="node" attr.name={quoteattr(str(name))} attr.type="{types[name]}" />\n')
+    target.write(f'  <key id="{weight_key}" for="edge" attr.name={quoteattr(weight)} attr.type="double" />\n')
+    target.write(f'  <graph edgedefault="{"directed" if graph.directed else "undirected"}">\n')
+
+    ids = [quoteattr(str(n)) for n in graph.nodes]
+    records = attributes.itertuples(index=False, name=None)
+
+    lines = []
+    for node_id, values in zip(ids, records):
+        lines.append(f'    <node id={node_id}>\n')
+        for (name, key), value in zip(node_keys.items(), values):
+            if _missing(value):
+                continue
+            lines.append(f'      <data key="{key}">{_text(value, types[name])}</data>\n')
+        lines.append('    </node>\n')
+        if len(lines) >= chunk_size:
+            target.writelines(lines)
+            lines = []
+
+    for start in range(0, len(graph.rows), chunk_size):
+        stop = start + chunk_size
+        for i, j, w in zip(graph.rows[start:stop].tolist(), graph.cols[start:stop].tolist(),
+                           graph.weights[start:stop].tolist()):
+            lines.append(f'    <edge source={ids[i]} target={ids[j]}>\n'
+                         f'      <data key="{weight_key}">{w!r}</data>\n'
+                         '    </edge>\n')
+        target.writelines(lines)
+        lines = []
+
+    target.writelines(lines)
+    target.write('  </graph>\n</graphml>\n')
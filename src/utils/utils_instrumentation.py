@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import logging
+import threading
+import cProfile
+from contextlib import contextmanager
+from functools import wraps
+
+import psutil
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+ENV_ENABLED = 'SOCIAL_CAPITAL_INSTRUMENTATION'
+ENV_SPANS = 'SOCIAL_CAPITAL_SPANS'
+ENV_PROFILE = 'SOCIAL_CAPITAL_PROFILE'
+
+DEFAULT_SPANS_PATH = os.path.join('reports', 'spans.jsonl')
+DEFAULT_PROFILE_PATH = os.path.join('reports', 'profiles')
+
+_KEYS = ('year', 'layer')
+
+logger = logging.getLogger(__name__)
+
+
+class _Config:
+    '''
+    Instrumentation settings, read from the environment on import:
+      $SOCIAL_CAPITAL_INSTRUMENTATION=0 disables the spans
+      $SOCIAL_CAPITAL_SPANS is the JSON lines file spans are appended to
+      $SOCIAL_CAPITAL_PROFILE names the stage to run under cProfile
+    '''
+    def __init__(self):
+        self.enabled = os.environ.get(ENV_ENABLED, '1').lower() not in ('0', 'false', 'off', 'no')
+        self.path = os.environ.get(ENV_SPANS, DEFAULT_SPANS_PATH)
+        self.profile = os.environ.get(ENV_PROFILE) or None
+        self.profile_path = DEFAULT_PROFILE_PATH
+        self.records = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+
+_config = _Config()
+
+
+def configure(enabled=None, path=None, profile=None, profile_path=None):
+    '''
+    Override the environment settings. `path=''` keeps the spans in memory
+    (see recorded_spans) instead of appending them to a file.
+    '''
+    if enabled is not None:
+        _config.enabled = enabled
+    if path is not None:
+        _config.path = path
+    if profile is not None:
+        _config.profile = profile or None
+    if profile_path is not None:
+        _config.profile_path = profile_path
+
+
+def recorded_spans():
+    '''
+    Spans closed since the last reset, oldest first, kept only while
+    configured with path=''
+    '''
+    with _config.lock:
+        return list(_config.records)
+
+
+def reset():
+    with _config.lock:
+        _config.records.clear()
+
+
+def _io_bytes(process):
+    '''
+    Bytes read and written by the process. On Linux read_chars/write_chars
+    also count socket traffic (S3 transfers), not only disk IO.
+    '''
+    try:
+        io = process.io_counters()
+    except (AttributeError, psutil.Error):
+        return 0, 0
+    return getattr(io, 'read_chars', io.read_bytes), getattr(io, 'write_chars', io.write_bytes)
+
+
+def _peak_rss():
+    '''
+    High-water mark of the resident set size in bytes
+    '''
+    if resource is None:
+        return psutil.Process().memory_info().rss
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if os.uname().sysname == 'Darwin' else maxrss * 1024
+
+
+class Span:
+    '''
+    Measurements of one stage. cpu_seconds is the CPU time of the thread
+    that opened the span, process_cpu_seconds that of the whole process,
+    which also counts the threads running concurrently (feature tasks,
+    uploads). `iterations` can be set inside the span by iterative solvers,
+    and `extra` holds any other field to emit.
+    '''
+    def __init__(self, stage, keys, extra):
+        self.stage = stage
+        self.keys = keys
+        self.extra = extra
+        self.iterations = None
+
+    def __enter__(self):
+        self.process = psutil.Process()
+        self.read_start, self.write_start = _io_bytes(self.process)
+        self.peak_start = _peak_rss()
+        self.cpu_start = time.thread_time()
+        self.process_cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.thread_time() - self.cpu_start
+        process_cpu = time.process_time() - self.process_cpu_start
+        peak = _peak_rss()
+        read, write = _io_bytes(self.process)
+
+        record = dict(
+            self.keys, stage=self.stage,
+            wall_seconds=wall, cpu_seconds=cpu, process_cpu_seconds=process_cpu,
+            rss_bytes=self.process.memory_info().rss,
+            peak_rss_bytes=peak, peak_rss_delta_bytes=peak - self.peak_start,
+            read_bytes=read - self.read_start, write_bytes=write - self.write_start,
+            iterations=self.iterations, failed=exc_type is not None,
+            **self.extra)
+        _emit(record)
+
+
+class _NullSpan:
+    iterations = None
+    extra = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def _emit(record):
+    with _config.lock:
+        if not _config.path:
+            _config.records.append(record)
+        else:
+            os.makedirs(os.path.dirname(_config.path) or '.', exist_ok=True)
+            with open(_config.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + '\n')
+
+    logger.debug("%s", record)
+
+
+def _stack():
+    stack = getattr(_config.local, 'stack', None)
+    if stack is None:
+        stack = _config.local.stack = []
+    return stack
+
+
+def current_keys():
+    '''
+    (year, layer) keys of the innermost open span of this thread, to carry
+    them into spans opened by worker threads or processes
+    '''
+    stack = _stack()
+    return dict(stack[-1]) if stack else dict.fromkeys(_KEYS)
+
+
+@contextmanager
+def span(stage, year=None, layer=None, **extra):
+    '''
+    Record wall time, thread and process CPU time, peak RSS delta and bytes
+    read/written of the enclosed block, keyed by (year, layer, stage). Keys
+    not given are inherited from the enclosing span. The stage named by
+    $SOCIAL_CAPITAL_PROFILE is also dumped as a cProfile .prof file.
+
+        with span('features', year='2005', layer='financial') as s:
+            ...
+            s.iterations = n_iter
+    '''
+    if not _config.enabled:
+        yield _NULL_SPAN
+        return
+
+    stack = _stack()
+    keys = current_keys()
+    for key, value in zip(_KEYS, (year, layer)):
+        if value is not None:
+            keys[key] = str(value)
+
+    profiler = cProfile.Profile() if stage == _config.profile else None
+
+    stack.append(keys)
+    try:
+        with Span(stage, keys, extra) as s:
+            if profiler is None:
+                yield s
+            else:
+                profiler.enable()
+                try:
+                    yield s
+                finally:
+                    profiler.disable()
+                    _dump_profile(profiler, stage, keys)
+    finally:
+        stack.pop()
+
+
+def _dump_profile(profiler, stage, keys):
+    name = '_'.join(str(v) for v in [stage] + [keys[k] for k in _KEYS] if v is not None)
+    os.makedirs(_config.profile_path, exist_ok=True)
+    path = os.path.join(_config.profile_path, f'{name}.prof')
+    profiler.dump_stats(path)
+    logger.info("Profile of %s written to %s", stage, path)
+
+
+def timed(stage, layer=None):
+    '''
+    Decorator recording every call of the function as a span
+    '''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _config.enabled:
+                return f(*args, **kwargs)
+            with span(stage, layer=layer):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,318 @@
+import os
+import shutil
+import tempfile
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import networkx as nx
+
+from src.utils.utils_instrumentation import current_keys, span
+
+# Default number of rows processed at once by the chunked kernels
+CHUNK_SIZE = 512
+
+FEATURES = ['hubs', 'authorities', 'pagerank', 'gfi', 'bridging', 'out_favor', 'in_favor', 'hhi_index']
+
+# Feature -> task computing it; hubs and authorities come from one HITS run
+FEATURE_TASKS = {
+    'hubs': 'hits', 'authorities': 'hits', 'pagerank': 'pagerank', 'gfi': 'gfi', 'bridging': 'bridging',
+    'out_favor': 'out_favor', 'in_favor': 'in_favor', 'hhi_index': 'hhi',
+}
+
+
+def hits_matrix(g, max_iter=100, tol=1.0e-8):
+    '''
+    Hubs and authorities of the adjacency matrix g by the same power
+    iteration as nx.hits (networkx 2.4): a = g'h, h = g a, both scaled by
+    their maximum, until the L1 change of h is below tol. Returns
+    (hubs, authorities, iterations), each vector summing to one.
+    '''
+    n = len(g)
+    if n == 0:
+        return np.array([]), np.array([]), 0
+
+    h = np.full(n, 1.0 / n)
+    for i in range(max_iter + 2):
+        h_last = h
+        a = g.T @ h_last
+        h = g @ a
+        h = h / h.max()
+        a = a / a.max()
+
+        if np.abs(h - h_last).sum() < tol:
+            break
+    else:
+        raise nx.PowerIterationFailedConvergence(max_iter)
+
+    return h / h.sum(), a / a.sum(), i + 1
+
+
+def pagerank_matrix(g, alpha=0.85, max_iter=100, tol=1.0e-06):
+    '''
+    PageRank of the weighted adjacency matrix g by the same power iteration
+    as nx.pagerank (networkx 2.4): rows normalised to a stochastic matrix,
+    dangling nodes spread uniformly, until the L1 change is below n*tol.
+    Returns (pagerank, iterations).
+    '''
+    n = len(g)
+    if n == 0:
+        return np.array([]), 0
+
+    out_strength = g.sum(axis=1)
+    dangling = out_strength == 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        W = g / np.where(dangling, 1., out_strength)[:, None]
+
+    x = np.full(n, 1.0 / n)
+    for i in range(max_iter):
+        x_last = x
+        x = alpha * (W.T @ x_last) + (alpha * x_last[dangling].sum() + 1. - alpha) / n
+
+        if np.abs(x - x_last).sum() < n * tol:
+            return x, i + 1
+
+    raise nx.PowerIterationFailedConvergence(max_iter)
+
+
+def godfhater_index_matrix(g, tol, chunk_size=CHUNK_SIZE):
+    '''
+    godfhater_index of every node of g, ((M g) * g).sum(0) with M the lower
+    triangular mask of the unconnected pairs, built and multiplied a block of
+    rows at a time so that only chunk_size x n of M is held at once
+    '''
+    n = len(g)
+    gfi = np.zeros(n)
+    for start in range(0, n, chunk_size):
+        rows = slice(start, min(start + chunk_size, n))
+        M = np.maximum(g[rows], g[:, rows].T) < tol
+        M &= np.arange(n)[None, :] < np.arange(start, rows.stop)[:, None]
+        gfi += ((M.astype(g.dtype) @ g) * g[rows]).sum(axis=0)
+    return gfi
+
+
+def favor_matrix(g, transpose=False):
+    '''
+    favor_centrality of every node of g, the row sums of g^2 computed as
+    g (g 1) (of g'^2 when transpose is set)
+    '''
+    if transpose:
+        return g.T @ g.sum(axis=0)
+    return g @ g.sum(axis=1)
+
+
+def bridging_kernel(P, powers_t, l, r_cumulative):
+    '''
+    Bridging of a block of rows of P (leading batch dimensions allowed):
+    P (..., c, n) rows of P, powers_t[b] (..., c, n) the same rows of
+    (P^b)', l[m] (..., c) the same entries of (P')^m 1 and r_cumulative[q]
+    (..., n) the sum of P^b 1 for b <= q. See bridging_matrix.
+    '''
+    T = len(l)
+    w = []
+    bridging = np.zeros(P.shape[:-1])
+    for m in range(T):
+        w_m = np.broadcast_to(l[m][..., None], P.shape).copy()
+        for s in range(1, m + 1):
+            w_m -= P * w[s - 1] * powers_t[m - s]
+        w.append(w_m)
+
+        # w_m enters every walk length t >= m + 1 with r_{t-m-1}
+        bridging += (P * w_m * r_cumulative[T - m - 1][..., None, :]).sum(axis=-1)
+
+    return bridging
+
+
+def bridging_matrix(g, p=1, T=5, chunk_size=CHUNK_SIZE):
+    '''
+    bridging_centrality of every node of g: the total weight of the walks of
+    length 1..T lost when each out-edge (i, j) is removed.
+
+    Splitting the walks that use (i, j) at their first use of it,
+        1'P^t 1 - 1'P_ij^t 1 = P_ij sum_s w_{s-1}(i,j) r_{t-s}(j)
+    with r_b = P^b 1 and w_m(i,j) the weight of the walks of length m
+    ending in i that avoid (i, j), itself given by the recursion
+        w_m = l_m(i) - P_ij sum_{s<=m} w_{s-1} (P^{m-s})_ji
+    with l_m = (P')^m 1. This is exact and costs O(T n^3) for the powers
+    plus O(T^2 n^2) for the recursion, run chunk_size rows at a time.
+    '''
+    P = p * np.asarray(g, dtype=float)
+    n = len(P)
+
+    powers = [np.eye(n)]
+    for _ in range(1, T):
+        powers.append(powers[-1] @ P)
+
+    r_cumulative = np.cumsum([Pb.sum(axis=1) for Pb in powers], axis=0)
+    l = [Pb.sum(axis=0) for Pb in powers]
+
+    bridging = np.empty(n)
+    for start in range(0, n, chunk_size):
+        rows = slice(start, min(start + chunk_size, n))
+        bridging[rows] = bridging_kernel(P[rows], [Pb[:, rows].T for Pb in powers],
+                                         [lm[rows] for lm in l], r_cumulative)
+    return bridging
+
+
+def hhi_matrix(g):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.square(g / g.sum(axis=1)[:, None]).sum(axis=1)
+
+
+def select_features(features=None):
+    '''
+    The requested features in FEATURES order, all of them by default
+    '''
+    if features is None:
+        return list(FEATURES)
+    unknown = set(features) - set(FEATURES)
+    if unknown:
+        raise ValueError(f"Unknown features {sorted(unknown)}, expected some of {FEATURES}")
+    return [f for f in FEATURES if f in features]
+
+
+def feature_tasks(features):
+    '''
+    Tasks computing the features, in FEATURES order
+    '''
+    return list(dict.fromkeys(FEATURE_TASKS[f] for f in features))
+
+
+class AdjacencyBuffer:
+    '''
+    Read-only adjacency matrix shared by the feature tasks: the array itself
+    for threads or, with shared_file, a copy on disk that every process maps
+    read-only on first access (and that pickles by path only)
+    '''
+    def __init__(self, g, shared_file=False):
+        self.directory = self.path = None
+        if shared_file:
+            self.directory = tempfile.mkdtemp(prefix='adjacency_')
+            self.path = os.path.join(self.directory, 'adjacency.npy')
+            np.save(self.path, g)
+            self._array = None
+        else:
+            self._array = g.view()
+            self._array.flags.writeable = False
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.path is not None:
+            state['_array'] = None
+        return state
+
+    @property
+    def array(self):
+        if self._array is None:
+            self._array = np.load(self.path, mmap_mode='r')
+        return self._array
+
+    def close(self):
+        self._array = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _hits(buffer):
+    hubs, authorities, iterations = hits_matrix(buffer.array, max_iter=750)
+    return {'hubs': hubs, 'authorities': authorities}, iterations
+
+
+def _pagerank(buffer):
+    pagerank, iterations = pagerank_matrix(buffer.array, max_iter=1000)
+    return {'pagerank': pagerank}, iterations
+
+
+def _gfi(buffer, tol, chunk_size=CHUNK_SIZE):
+    return {'gfi': godfhater_index_matrix(buffer.array, tol, chunk_size=chunk_size)}, None
+
+
+def _bridging(buffer, chunk_size=CHUNK_SIZE):
+    return {'bridging': bridging_matrix(buffer.array, chunk_size=chunk_size)}, None
+
+
+def _out_favor(buffer):
+    return {'out_favor': favor_matrix(buffer.array)}, None
+
+
+def _in_favor(buffer):
+    return {'in_favor': favor_matrix(buffer.array, transpose=True)}, None
+
+
+def _hhi(buffer):
+    return {'hhi_index': hhi_matrix(buffer.array)}, None
+
+
+# Task -> (features, function of the AdjacencyBuffer)
+MATRIX_TASKS = {
+    'hits': (('hubs', 'authorities'), _hits),
+    'pagerank': (('pagerank',), _pagerank),
+    'gfi': (('gfi',), _gfi),
+    'bridging': (('bridging',), _bridging),
+    'out_favor': (('out_favor',), _out_favor),
+    'in_favor': (('in_favor',), _in_favor),
+    'hhi': (('hhi_index',), _hhi),
+}
+
+
+def _run_task(task, features, function, buffer, params, keys):
+    with span(task, **keys) as s:
+        try:
+            values, s.iterations = function(buffer, **params)
+        except nx.PowerIterationFailedConvergence:
+            warnings.warn("nx.PowerIterationFailedConvergence")
+            values = dict.fromkeys(features, np.nan)
+    return values
+
+
+def run_feature_tasks(task_table, buffer, tasks, params=None, executor=None):
+    '''
+    Run `tasks` of task_table ({task: (features, function)}) over the shared
+    buffer on `executor`, serially when None, each recorded as a span
+    carrying the caller's year and layer. The results are combined in task
+    order, whatever order they complete in. A task failing to converge
+    gives NaN features.
+    '''
+    params = params or {}
+    keys = current_keys()
+    calls = [(task, *task_table[task], buffer, params.get(task, {}), keys) for task in tasks]
+
+    if executor is None:
+        results = [_run_task(*call) for call in calls]
+    else:
+        futures = [executor.submit(_run_task, *call) for call in calls]
+        results = [future.result() for future in futures]
+
+    values = {}
+    for result in results:
+        values.update(result)
+    return values
+
+
+def matrix_features(g, nodes, tol_gfi, tol_favor=None, chunk_size=CHUNK_SIZE, features=None, executor=None):
+    '''
+    Node x feature DataFrame of the NetworkFeatureComputation features of the
+    weighted adjacency matrix g, computed on the matrix without building a
+    graph. `features` selects a subset of FEATURES, computed as independent
+    tasks on `executor` (see run_feature_tasks); a ProcessPoolExecutor
+    shares g through a memory-mapped file. HITS and pagerank spans report
+    their iterations. tol_favor is accepted for symmetry with
+    compute_features, favor_centrality does not depend on it. pandas is only
+    imported here, so that process workers running the tasks do not load it.
+    '''
+    import pandas as pd
+
+    g = np.nan_to_num(np.asarray(g, dtype=float))
+    features = select_features(features)
+    params = {'gfi': dict(tol=tol_gfi, chunk_size=chunk_size), 'bridging': dict(chunk_size=chunk_size)}
+
+    buffer = AdjacencyBuffer(g, shared_file=isinstance(executor, ProcessPoolExecutor))
+    try:
+        values = run_feature_tasks(MATRIX_TASKS, buffer, feature_tasks(features), params, executor)
+    finally:
+        buffer.close()
+
+    df = pd.DataFrame(index=pd.Index(nodes, name='country_industry'))
+    for feature in features:
+        df[feature] = values[feature]
+    return df
@@ -0,0 +1,248 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+from botocore.exceptions import ClientError
+
+from src.utils.utils_descriptors import graph_arrays
+from src.utils.utils_s3 import read_s3_graphml
+
+# Layer name -> GraphML file of every year folder
+LAYERS = {
+    'financial': 'A_country',
+    'goods': 'B_country',
+    'human': 'migration_network',
+    'estimated_human': 'estimated_migration_network',
+}
+
+NODE_FEATURES = ['hubs', 'authorities', 'pagerank', 'gfi', 'bridging', 'in_favor', 'out_favor', 'hhi_index']
+
+META_FILE = 'meta.json'
+
+
+class NodeRegistry:
+    '''
+    Canonical integer ids of the node labels, shared by every year and
+    layer. Ids are assigned in order of first registration and never change,
+    so a registry can grow without invalidating arrays indexed by it.
+    '''
+    def __init__(self, labels=()):
+        self.labels = []
+        self._ids = {}
+        self.add(labels)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self._ids
+
+    def add(self, labels):
+        for label in labels:
+            if label not in self._ids:
+                self._ids[label] = len(self.labels)
+                self.labels.append(label)
+        return self
+
+    def ids(self, labels):
+        '''
+        Integer ids of `labels`, -1 for unregistered ones
+        '''
+        return np.fromiter((self._ids.get(label, -1) for label in labels), dtype=np.int64)
+
+    @classmethod
+    def from_graphs(cls, graphs):
+        '''
+        Registry of the sorted union of the nodes of `graphs`
+        '''
+        nodes = set()
+        for G in graphs:
+            nodes.update(G.nodes)
+        return cls(sorted(nodes))
+
+
+class MultiplexStore:
+    '''
+    Memory-mapped (year x layer x node x node) tensor of link weights aligned
+    on a NodeRegistry, with a (year x layer x node) mask of the nodes present
+    in each network and a (year x layer x node x feature) array of node
+    attributes. Absent links are NaN, so slicing the tensor never needs a
+    merge to tell a missing link from a zero one.
+
+        store = MultiplexStore.open('data/interim/multiplex')
+        W = store.weights('2005', 'goods')            # view, N x N
+        dW = store.tensor[1:, 1] - store.tensor[:-1, 1]  # year over year
+    '''
+    def __init__(self, path, years, layers, registry, features, mode='r'):
+        self.path = path
+        self.years = [str(y) for y in years]
+        self.layers = list(layers)
+        self.registry = registry
+        self.features = list(features)
+
+        self._year_index = {y: i for i, y in enumerate(self.years)}
+        self._layer_index = {l: i for i, l in enumerate(self.layers)}
+
+        self.tensor = np.load(os.path.join(path, 'weights.npy'), mmap_mode=mode)
+        self.node_mask = np.load(os.path.join(path, 'node_mask.npy'), mmap_mode=mode)
+        self.node_features = np.load(os.path.join(path, 'node_features.npy'), mmap_mode=mode)
+
+    @classmethod
+    def create(cls, path, years, layers, registry, features=NODE_FEATURES, dtype='float64'):
+        '''
+        Empty store (no links, no nodes) on disk at `path`
+        '''
+        os.makedirs(path, exist_ok=True)
+        Y, L, N, F = len(years), len(layers), len(registry), len(features)
+
+        tensor = np.lib.format.open_memmap(os.path.join(path, 'weights.npy'), mode='w+',
+                                           dtype=dtype, shape=(Y, L, N, N))
+        tensor[:] = np.nan
+        node_mask = np.lib.format.open_memmap(os.path.join(path, 'node_mask.npy'), mode='w+',
+                                              dtype=bool, shape=(Y, L, N))
+        node_mask[:] = False
+        node_features = np.lib.format.open_memmap(os.path.join(path, 'node_features.npy'), mode='w+',
+                                                  dtype=dtype, shape=(Y, L, N, F))
+        node_features[:] = np.nan
+        del tensor, node_mask, node_features
+
+        with open(os.path.join(path, META_FILE), 'w') as f:
+            json.dump(dict(years=[str(y) for y in years], layers=list(layers),
+                           nodes=registry.labels, features=list(features)), f)
+
+        return cls(path, years, layers, registry, features, mode='r+')
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        return cls(path, meta['years'], meta['layers'], NodeRegistry(meta['nodes']),
+                   meta['features'], mode=mode)
+
+    def index(self, year, layer):
+        return self._year_index[str(year)], self._layer_index[layer]
+
+    def set_network(self, year, layer, G, weight='weight'):
+        '''
+        Write the links, node mask and node attributes of G
+        '''
+        self.set_arrays(year, layer, *network_arrays(G, self.features, weight=weight))
+
+    def set_arrays(self, year, layer, nodes, rows, cols, weights, node_features):
+        y, l = self.index(year, layer)
+        ids = self.registry.ids(nodes)
+        if (ids < 0).any():
+            raise KeyError(f"Nodes missing from the registry: {np.asarray(nodes)[ids < 0][:5].tolist()}")
+
+        self.tensor[y, l] = np.nan
+        self.tensor[y, l, ids[rows], ids[cols]] = weights
+
+        self.node_mask[y, l] = False
+        self.node_mask[y, l, ids] = True
+
+        self.node_features[y, l] = np.nan
+        self.node_features[y, l, ids] = node_features
+
+    def flush(self):
+        for array in (self.tensor, self.node_mask, self.node_features):
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def weights(self, year, layer):
+        '''
+        N x N view of the link weights, NaN where there is no link
+        '''
+        return self.tensor[self.index(year, layer)]
+
+    def adjacency(self, year, layer, nodes_present=True):
+        '''
+        Dense adjacency matrix (a copy, absent links as 0) and its node
+        labels, restricted to the nodes present in the network by default
+        '''
+        y, l = self.index(year, layer)
+        keep = self.node_mask[y, l] if nodes_present else np.ones(len(self.registry), dtype=bool)
+        g = np.nan_to_num(self.tensor[y, l][np.ix_(keep, keep)])
+        return g, [n for n, k in zip(self.registry.labels, keep) if k]
+
+    def to_networkx(self, year, layer):
+        g, nodes = self.adjacency(year, layer)
+        df_adj = pd.DataFrame(g, index=nodes, columns=nodes)
+        return nx.convert_matrix.from_pandas_adjacency(df_adj, create_using=nx.DiGraph)
+
+    def links(self, year, layers=None):
+        '''
+        (country_from, country_to) x layer DataFrame of the links present in
+        any of `layers` (all by default), NaN where a layer lacks the link:
+        the outer join of the layers' edge lists. A (year, layer) pair takes
+        that layer from another year, as the column <layer>_<year>.
+        '''
+        layers = self.layers if layers is None else list(layers)
+        keys = [(year, l) if isinstance(l, str) else tuple(l) for l in layers]
+        W = np.stack([self.tensor[self.index(y, l)] for y, l in keys])
+
+        rows, cols = np.nonzero(~np.isnan(W).all(axis=0))
+        labels = np.asarray(self.registry.labels, dtype=object)
+        index = pd.MultiIndex.from_arrays([labels[rows], labels[cols]], names=['country_from', 'country_to'])
+
+        columns = [l if isinstance(l, str) else f'{l[1]}_{l[0]}' for l in layers]
+        return pd.DataFrame(W[:, rows, cols].T, index=index, columns=columns)
+
+    def nodes(self, year, layer):
+        '''
+        Node x feature DataFrame of the nodes present in the network, for
+        panel joins
+        '''
+        y, l = self.index(year, layer)
+        keep = self.node_mask[y, l]
+        labels = [n for n, k in zip(self.registry.labels, keep) if k]
+        return pd.DataFrame(self.node_features[y, l][keep], index=labels, columns=self.features)
+
+
+def network_arrays(G, features=NODE_FEATURES, weight='weight'):
+    '''
+    graph_arrays of G plus its node x feature array of attributes
+    '''
+    nodes, rows, cols, weights = graph_arrays(G, weight=weight)
+
+    node_features = np.full((len(nodes), len(features)), np.nan)
+    for f, feature in enumerate(features):
+        values = nx.get_node_attributes(G, feature)
+        node_features[:, f] = [float(values.get(n, np.nan)) for n in nodes]
+
+    return nodes, rows, cols, weights, node_features
+
+
+def _read_graph(path):
+    if path.startswith('s3://'):
+        return read_s3_graphml(path)
+    return nx.readwrite.graphml.read_graphml(path)
+
+
+def build_multiplex_store(output_filepath, path, years, layers=LAYERS, features=NODE_FEATURES,
+                          dtype='float64'):
+    '''
+    Read the GraphML networks of every year and layer under output_filepath
+    (local or s3) into a MultiplexStore at the local `path`. Only the edge
+    arrays of the networks are held in memory until the registry is known.
+    Networks that do not exist are left empty.
+    '''
+    arrays = {}
+    for year in years:
+        for layer, network in layers.items():
+            network_path = os.path.join(output_filepath, str(year), f'{network}.graphml')
+            try:
+                G = _read_graph(network_path)
+            except (FileNotFoundError, ClientError):
+                continue
+            arrays[str(year), layer] = network_arrays(G, features)
+
+    registry = NodeRegistry(sorted({n for nodes, *_ in arrays.values() for n in nodes}))
+    store = MultiplexStore.create(path, years, list(layers), registry, features=features, dtype=dtype)
+
+    for (year, layer), network in arrays.items():
+        store.set_arrays(year, layer, *network)
+    store.flush()
+
+    return store
@@ -0,0 +1,95 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.linalg import lu_factor, lu_solve
+
+MULTIPLIERS = ['upstreamness', 'downstreamness', 'backward_linkage', 'forward_linkage']
+
+
+class MultiplierEngine:
+    '''
+    Total-requirement measures of input-output tables from LU factorisations
+    of I - A, cached by key (e.g. (input, year, resolution)) together with a
+    digest of A, so that a different table under the same key is factorised
+    again, and reused for every right-hand side, without forming the
+    Leontief or Ghosh inverses.
+
+    With A = Z x^-1 and B = x^-1 Z the Ghosh inverse is
+    (I - B)^-1 = x^-1 (I - A)^-1 x, so a single factorisation serves both:
+      downstreamness    1'L           solve (I - A)' d = 1
+      upstreamness      G 1 = L x / x solve (I - A) y = x
+      backward_linkage  downstreamness / its mean (Rasmussen)
+      forward_linkage   upstreamness / its mean (Ghosh)
+    At most `maxsize` factorisations are kept, least recently used first out.
+    '''
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._lu = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(A):
+        '''
+        Cheap fingerprint of the values and shape of A
+        '''
+        A = np.ascontiguousarray(A, dtype=float)
+        h = hashlib.blake2b(A.tobytes(), digest_size=16)
+        h.update(repr(A.shape).encode())
+        return h.hexdigest()
+
+    def factorize(self, key, A):
+        key = (key, self.digest(A))
+        with self._lock:
+            if key in self._lu:
+                self._lu.move_to_end(key)
+                return self._lu[key]
+
+        lu = lu_factor(np.eye(len(A)) - A, check_finite=False)
+
+        with self._lock:
+            self._lu[key] = lu
+            if len(self._lu) > self.maxsize:
+                self._lu.popitem(last=False)
+        return lu
+
+    def solve(self, key, A, rhs, trans=0):
+        '''
+        (I - A)^-1 rhs, or (I - A)'^-1 rhs with trans=1, for one or several
+        right-hand sides (columns of rhs)
+        '''
+        return lu_solve(self.factorize(key, A), rhs, trans=trans, check_finite=False)
+
+    def multipliers(self, key, A, x, node_index):
+        '''
+        Node x measure DataFrame of MULTIPLIERS for the technical
+        coefficients A and the output x
+        '''
+        A = np.asarray(A, dtype=float)
+        x = np.asarray(x, dtype=float)
+
+        downstreamness = self.solve(key, A, np.ones(len(A)), trans=1)
+        upstreamness = self.solve(key, A, x) / x
+
+        df = pd.DataFrame({'upstreamness': upstreamness, 'downstreamness': downstreamness},
+                          index=pd.Index(node_index))
+        df['backward_linkage'] = downstreamness / downstreamness.mean()
+        df['forward_linkage'] = upstreamness / upstreamness.mean()
+
+        return df[MULTIPLIERS]
+
+    def multipliers_many(self, tables, max_workers=None):
+        '''
+        multipliers of several {key: (A, x, node_index)} tables, factorised
+        concurrently (LAPACK releases the GIL)
+        '''
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {key: executor.submit(self.multipliers, key, *table) for key, table in tables.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def clear(self):
+        with self._lock:
+            self._lu.clear()
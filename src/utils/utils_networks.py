@@ -1,24 +1,127 @@
 import networkx as nx
 import numpy as np
+import pandas as pd
 import os
+import threading
+import scipy.sparse as sp
+from scipy.sparse.csgraph import shortest_path
+from collections import OrderedDict, deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.utils.utils_graphml import read_graphml_arrays
+
+# Rows of g^2 held at once by edge_two_step_weights
+FAVOR_CHUNK_SIZE = 512
+
+def _sparse_adjacency(G, weight='weight'):
+    g = sp.csr_matrix(nx.linalg.graphmatrix.adjacency_matrix(G, nodelist=list(G), weight=weight), dtype=float)
+    g.eliminate_zeros()
+    g.sort_indices()
+    return g
+
+def edge_two_step_weights(g, chunk_size=FAVOR_CHUNK_SIZE):
+    '''
+    Two-step weights (g^2)_ij on the edges (i, j) of the sparse matrix g
+    only, a sampled product computed chunk_size rows at a time so that a
+    single chunk_size x n block of g^2 is held at once. Returns the edges as
+    COO arrays in row-major order: (rows, cols, weights, two_step).
+    '''
+    g = sp.csr_matrix(g, dtype=float)
+    g.sort_indices()
+    coo = g.tocoo()
+    rows, cols, weights = coo.row, coo.col, coo.data
+
+    two_step = np.empty(g.nnz)
+    for start in range(0, g.shape[0], chunk_size):
+        stop = min(start + chunk_size, g.shape[0])
+        edges = slice(g.indptr[start], g.indptr[stop])
+        block = (g[start:stop] @ g).toarray()
+        two_step[edges] = block[rows[edges] - start, cols[edges]]
+
+    return rows, cols, weights, two_step
+
+def favor_statistics(G, tol=0.0001, transpose=False, weight='weight', chunk_size=FAVOR_CHUNK_SIZE):
+    '''
+    Node x statistic DataFrame of the favor_centrality of G:
+      supported_friends  edges (i, j) with g_ij > tol and (g^2)_ij > tol
+      two_step_weight    row sums of g^2, computed as g (g 1)
+    With transpose the statistics of G reversed, obtained by counting the
+    edges by target and summing g' (g' 1), without reversing G. g^2 is only
+    evaluated on the edges of G, so memory is O(edges).
+    '''
+    if len(G) == 0:
+        raise nx.NetworkXPointlessConcept('cannot compute centrality for the null graph')
+
+    g = _sparse_adjacency(G, weight=weight)
+    rows, cols, weights, two_step = edge_two_step_weights(g, chunk_size=chunk_size)
+
+    node = cols if transpose else rows
+    supported = (weights > tol) & (two_step > tol)
+
+    if transpose:
+        two_step_weight = g.T @ np.asarray(g.sum(axis=0)).ravel()
+    else:
+        two_step_weight = g @ np.asarray(g.sum(axis=1)).ravel()
+
+    return pd.DataFrame({'supported_friends': np.bincount(node[supported], minlength=len(G)),
+                         'two_step_weight': two_step_weight}, index=list(G))
+
+def supported_friends(G, tol=0.0001, transpose=False, weight='weight'):
+    '''
+    {node: supported friends} of favor_statistics
+    '''
+    df = favor_statistics(G, tol=tol, transpose=transpose, weight=weight)
+    return dict(zip(G, df['supported_friends'].tolist()))
 
 def favor_centrality(G, tol=0.0001, transpose=False):
+    '''
+    {node: row sum of g^2} (of g'^2 with transpose), computed as g (g 1) on
+    the sparse adjacency without forming g^2. tol only affects the
+    supported friends of favor_statistics.
+    '''
+    if len(G) == 0:
+        raise nx.NetworkXPointlessConcept('cannot compute centrality for the null graph')
 
-    G_compute = G.reverse() if transpose else G.copy()
-    
-    if len(G_compute) == 0:
+    g = _sparse_adjacency(G)
+    if transpose:
+        favor_centrality_list = g.T @ np.asarray(g.sum(axis=0)).ravel()
+    else:
+        favor_centrality_list = g @ np.asarray(g.sum(axis=1)).ravel()
+
+    return dict(zip(G, favor_centrality_list))
+
+def favor_centrality_sweep(G, tolerances, transpose=False):
+    '''
+    Number of supported friends of every node, (g^2 > tol) & (g > tol) in
+    favor_statistics, for every tolerance in one pass: each edge is bucketed
+    by min(g^2, g) among the sorted tolerances and the per-bucket counts are
+    accumulated by source (by target with transpose). Only the edges are
+    evaluated, so the tolerances are assumed non-negative. Returns a node x
+    tolerance DataFrame.
+    '''
+    if len(G) == 0:
         raise nx.NetworkXPointlessConcept('cannot compute centrality for the null graph')
-        
-    g = nx.linalg.graphmatrix.adjacency_matrix(G_compute).toarray()
-    g2 = g.dot(g)
 
-    supported_friends = (g2 > tol) & (g > tol)
+    tolerances = np.asarray(tolerances, dtype=float)
+    order = np.argsort(tolerances)
+    sorted_tolerances = tolerances[order]
 
-    favor_centrality_list =  supported_friends.sum(axis=1)
+    rows, cols, weights, two_step = edge_two_step_weights(_sparse_adjacency(G))
+    node = cols if transpose else rows
+    support = np.minimum(two_step, weights)
 
-    favor_centrality_list = g2.sum(axis=1)
+    # Edges in bucket b are supported for the b smallest tolerances
+    n, n_tol = len(G), len(tolerances)
+    buckets = np.searchsorted(sorted_tolerances, support, side='left')
+    counts = np.bincount(node * (n_tol + 1) + buckets,
+                         minlength=n * (n_tol + 1)).reshape(n, n_tol + 1)
+    supported = counts[:, :0:-1].cumsum(axis=1)[:, ::-1]
 
-    return dict(zip(G, favor_centrality_list)) 
+    sweep = np.empty((n, n_tol), dtype=np.int64)
+    sweep[:, order] = supported
+
+    return pd.DataFrame(sweep, index=list(G), columns=tolerances)
 
 def bridging_centrality(G, p=1, T=5):
 
@@ -68,10 +171,75 @@ def godfhater_index(G, tol=1.0e-10):
 
     return dict(zip(G, godfhater_index_list))
 
+def godfhater_index_sweep(G, tolerances):
+    '''
+    godfhater_index for every tolerance in one pass. Each unconnected pair
+    j > k contributes g[j,i]*g[k,i] to node i for the tolerances above
+    max(g[j,k], g[k,j]), so the pairs are bucketed once by that value among
+    the sorted tolerances, the contributions summed per bucket and
+    accumulated. Returns a node x tolerance DataFrame.
+    '''
+    if len(G) == 0:
+        raise nx.NetworkXPointlessConcept('cannot compute centrality for the null graph')
+
+    tolerances = np.asarray(tolerances, dtype=float)
+    order = np.argsort(tolerances)
+    sorted_tolerances = tolerances[order]
+
+    g = nx.linalg.graphmatrix.adjacency_matrix(G).toarray()
+    n, n_tol = len(g), len(tolerances)
+
+    j, k = np.tril_indices(n, k=-1)
+    buckets = np.searchsorted(sorted_tolerances, np.maximum(g[j, k], g[k, j]), side='right')
+
+    contributions = np.zeros((n_tol, n))
+    for bucket in range(n_tol):
+        in_bucket = buckets == bucket
+        if not in_bucket.any():
+            continue
+        M = sp.csr_matrix((np.ones(in_bucket.sum()), (j[in_bucket], k[in_bucket])), shape=(n, n))
+        contributions[bucket] = (M.dot(g) * g).sum(axis=0)
+
+    sweep = np.empty((n, n_tol))
+    sweep[:, order] = contributions.cumsum(axis=0).T
+
+    return pd.DataFrame(sweep, index=list(G), columns=tolerances)
+
 
 def average_degree(G, weight='weight'):
     return sum(dict(G.degree(weight='weight')).values())/float(len(G))
 
+def distance_matrix(G, weight='weight'):
+    '''
+    CSR matrix of the edge distances ``total_weight / weight`` used by the
+    efficiency computations. Edges with zero weight are dropped, that is,
+    they are at infinite distance.
+    '''
+    total_weight = G.size(weight=weight)
+
+    g = nx.linalg.graphmatrix.adjacency_matrix(G, weight=weight).tocoo()
+    keep = g.data > 0
+
+    return sp.csr_matrix((total_weight / g.data[keep], (g.row[keep], g.col[keep])),
+                         shape=g.shape)
+
+def efficiency_from_distances(distances, denom):
+    '''
+    Sum of the inverse shortest path lengths over all connected pairs of
+    distinct nodes, divided by `denom`.
+    '''
+    lengths = shortest_path(distances, method='D', directed=True)
+    lengths = lengths[np.isfinite(lengths) & (lengths > 0)]
+
+    return float((1 / lengths).sum() / denom)
+
+def _check_efficiency_graph(G, weight):
+    if nx.is_negatively_weighted(G, weight=weight):
+        raise nx.NetworkXError("edge weights must be positive")
+
+    if G.size(weight=weight) <= 0:
+        raise nx.NetworkXError("Size of G must be positive")
+
 def global_efficiency(G, weight='weight'):
     """Returns the average global efficiency of the graph.
 
@@ -83,7 +251,10 @@ def global_efficiency(G, weight='weight'):
     Parameters
     ----------
     G : :class:`networkx.Graph`
-        An undirected graph for which to compute the average global efficiency.
+        A graph for which to compute the average global efficiency.
+
+    weight : string
+        Edge attribute holding the weights. Missing weights count as 1.
 
     Returns
     -------
@@ -92,11 +263,14 @@ def global_efficiency(G, weight='weight'):
 
     Notes
     -----
-    Edge weights are ignored when computing the shortest path distances.
+    The distance of an edge is ``G.size(weight) / weight``, so heavier
+    edges are shorter, and zero-weight edges are not traversed. The sum of
+    efficiencies is divided by the number of edges of `G`. Shortest paths
+    are computed with the compiled Dijkstra of :mod:`scipy.sparse.csgraph`.
 
     See also
     --------
-    local_efficiency
+    global_efficiency_many
 
     References
     ----------
@@ -105,44 +279,94 @@ def global_efficiency(G, weight='weight'):
            *Physical Review Letters* 87.19 (2001): 198701.
            <https://doi.org/10.1103/PhysRevLett.87.198701>
     """
-    if nx.is_negatively_weighted(G, weight=weight):
-        raise nx.NetworkXError("edge weights must be positive")
-        
-    total_weight = G.size(weight=weight)
-    if total_weight <= 0:
-        raise nx.NetworkXError("Size of G must be positive")
-    
-    denom = len(G.edges)
-    
-    if denom != 0:
+    _check_efficiency_graph(G, weight)
 
-        def as_distance(u, v, d):
-            distance = d.get(weight, 1)
-            return total_weight / distance if distance>0 else np.inf
-        lengths = nx.all_pairs_dijkstra_path_length(G, weight=as_distance)
-        
-        g_eff = 0
-        for source, targets in lengths:
-            for target, distance in targets.items():
-                if distance > 0:
-                    g_eff += 1 / distance
-        g_eff /= denom
-        # g_eff = sum(1 / d for s, tgts in lengths
-        #                   for t, d in tgts.items() if d > 0) / denom
-    else:
-        g_eff = 0
-        
-    return g_eff
+    return efficiency_from_distances(distance_matrix(G, weight=weight), len(G.edges))
 
-def network_years_generator(output_filepath, network):
+def global_efficiency_many(graphs, weight='weight', max_workers=None):
     '''
-    Generator of the sequence of networks over the years
+    Global efficiency of every graph in `graphs`. The distance matrices are
+    built in this process and the shortest paths are solved across a pool
+    of `max_workers` processes (serially if max_workers == 1).
+    '''
+    distances, denoms = [], []
+    for G in graphs:
+        _check_efficiency_graph(G, weight)
+        distances.append(distance_matrix(G, weight=weight))
+        denoms.append(len(G.edges))
+
+    if max_workers == 1:
+        return list(map(efficiency_from_distances, distances, denoms))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(efficiency_from_distances, distances, denoms))
+
+# (output filepath, network, arrays, weight) -> LRU of the parsed graphs of its years,
+# bounded by the largest cache size requested for it
+_network_cache = {}
+_network_cache_sizes = {}
+_network_cache_lock = threading.Lock()
+
+def _read_network(network_path, cache=0, arrays=False, weight='weight'):
     '''
-    all_years = []
-    for y in range(2000, 2019):
-        network_path = os.path.join(output_filepath, str(y), f'{network}.graphml')
+    Graph of network_path, memoized when cache > 0 in an LRU of at least
+    `cache` graphs per network (the same file name under the same output
+    filepath)
+    '''
+    year_path, name = os.path.split(network_path)
+    group = (os.path.dirname(year_path), name, arrays, weight)
+    if cache:
+        with _network_cache_lock:
+            graphs = _network_cache.setdefault(group, OrderedDict())
+            if network_path in graphs:
+                graphs.move_to_end(network_path)
+                return graphs[network_path]
+
+    if arrays:
+        G = read_graphml_arrays(network_path, weight=weight)
+    else:
         G = nx.readwrite.graphml.read_graphml(network_path)
-        
-        all_years.append(G)
-        
-    return all_years
\ No newline at end of file
+
+    if cache:
+        with _network_cache_lock:
+            graphs = _network_cache.setdefault(group, OrderedDict())
+            graphs[network_path] = G
+            size = _network_cache_sizes[group] = max(_network_cache_sizes.get(group, 0), cache)
+            while len(graphs) > size:
+                graphs.popitem(last=False)
+
+    return G
+
+def clear_network_cache():
+    with _network_cache_lock:
+        _network_cache.clear()
+        _network_cache_sizes.clear()
+
+def network_years_generator(output_filepath, network, years=range(2000, 2019), prefetch=2, cache=False,
+                            arrays=False, weight='weight'):
+    '''
+    Generator of the sequence of networks over the years. Up to `prefetch`
+    graphs are read ahead in a background thread, so at most prefetch + 1
+    graphs are alive at once. With `cache` the parsed graphs of this network
+    are memoized, those of a whole pass with cache=True or the last `cache`
+    of them with an int, and later passes over the same years in this
+    process reuse them (the same graph objects are returned, do not modify
+    them). With `arrays` the files are streamed into GraphArrays (edge
+    weights from `weight`) instead of networkx graphs.
+    '''
+    paths = [os.path.join(output_filepath, str(y), f'{network}.graphml') for y in years]
+    cache = len(paths) if cache is True else int(cache)
+    paths = iter(paths)
+
+    if prefetch < 1:
+        for network_path in paths:
+            yield _read_network(network_path, cache, arrays, weight)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = deque(executor.submit(_read_network, p, cache, arrays, weight) for p in islice(paths, prefetch))
+
+        while pending:
+            G = pending.popleft().result()
+            pending.extend(executor.submit(_read_network, p, cache, arrays, weight) for p in islice(paths, 1))
+            yield G
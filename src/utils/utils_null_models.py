@@ -0,0 +1,273 @@
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+from src.utils.utils_matrix_features import bridging_kernel
+
+NULL_MODELS = ('weight_shuffle', 'strength_preserving', 'configuration')
+
+FEATURES = ('gfi', 'bridging', 'out_favor', 'in_favor')
+
+
+def _off_diagonal_edges(g):
+    rows, cols = np.nonzero(g)
+    keep = rows != cols
+    return rows[keep], cols[keep]
+
+
+def _weight_shuffle(g, rng):
+    '''
+    Same topology, weights permuted among the edges
+    '''
+    rows, cols = _off_diagonal_edges(g)
+    null = np.diag(np.diag(g)).astype(float)
+    null[rows, cols] = rng.permutation(g[rows, cols])
+    return null
+
+
+def _rewire(n, rows, cols, rng, swaps_per_edge=10):
+    '''
+    Degree-preserving rewiring of a directed graph: rounds of disjoint edge
+    pair swaps (a->b, c->d) -> (a->d, c->b), rejecting those that would
+    create self-loops, existing edges or the same new edge twice
+    '''
+    rows, cols = rows.copy(), cols.copy()
+    n_edges = len(rows)
+    if n_edges < 2:
+        return rows, cols
+
+    adjacency = np.zeros((n, n), dtype=bool)
+    adjacency[rows, cols] = True
+
+    half = n_edges // 2
+    for _ in range(2 * swaps_per_edge):
+        order = rng.permutation(n_edges)
+        first, second = order[:half], order[half:2 * half]
+        a, b, c, d = rows[first], cols[first], rows[second], cols[second]
+
+        ok = (a != d) & (c != b) & ~adjacency[a, d] & ~adjacency[c, b]
+
+        new_keys = np.concatenate([(a * n + d)[ok], (c * n + b)[ok]])
+        _, inverse, counts = np.unique(new_keys, return_inverse=True, return_counts=True)
+        n_ok = ok.sum()
+        unique = (counts[inverse[:n_ok]] == 1) & (counts[inverse[n_ok:]] == 1)
+        ok[ok] = unique
+
+        first, second = first[ok], second[ok]
+        adjacency[rows[first], cols[first]] = False
+        adjacency[rows[second], cols[second]] = False
+        cols[first], cols[second] = cols[second], cols[first].copy()
+        adjacency[rows[first], cols[first]] = True
+        adjacency[rows[second], cols[second]] = True
+
+    return rows, cols
+
+
+def _strength_preserving(g, rng):
+    '''
+    Degree-preserving rewiring carrying the weights along, followed by
+    iterative proportional fitting of the weights to the observed out- and
+    in-strengths (see _fit_strengths)
+    '''
+    rows, cols = _off_diagonal_edges(g)
+    weights = g[rows, cols]
+    rows, cols = _rewire(len(g), rows, cols, rng)
+
+    null = np.diag(np.diag(g)).astype(float)
+    null[rows, cols] = weights
+    return null
+
+
+def _fit_strengths(stack, g, tol=1e-10, max_iter=1000):
+    '''
+    Iterative proportional fitting, in place, of the off-diagonal entries of
+    every matrix of the stack to the row and column sums of g without its
+    self-loops, which are left as they are
+    '''
+    diagonal = np.arange(len(g))
+    loops = stack[:, diagonal, diagonal].copy()
+    stack[:, diagonal, diagonal] = 0.
+
+    off_diagonal = g.copy()
+    np.fill_diagonal(off_diagonal, 0.)
+    out_strength, in_strength = off_diagonal.sum(axis=1), off_diagonal.sum(axis=0)
+
+    for _ in range(max_iter):
+        row_sums = stack.sum(axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stack *= np.where(row_sums > 0, out_strength / row_sums, 0.)[:, :, None]
+            col_sums = stack.sum(axis=1)
+            stack *= np.where(col_sums > 0, in_strength / col_sums, 0.)[:, None, :]
+
+        error = np.abs(stack.sum(axis=2) - out_strength).max()
+        if error <= tol * max(out_strength.max(), 1e-300):
+            break
+
+    stack[:, diagonal, diagonal] = loops
+    return stack
+
+
+def _configuration(g, rng):
+    '''
+    Soft configuration model: edge i->j drawn with probability
+    min(1, k_out_i k_in_j / m) and, when present, an exponential weight of
+    mean s_out_i s_in_j / (W p_ij), so that degrees and strengths are kept
+    in expectation
+    '''
+    n = len(g)
+    rows, cols = _off_diagonal_edges(g)
+
+    pattern = np.zeros((n, n), dtype=bool)
+    pattern[rows, cols] = True
+    k_out, k_in = pattern.sum(axis=1), pattern.sum(axis=0)
+
+    off_diagonal = g.copy()
+    np.fill_diagonal(off_diagonal, 0.)
+    s_out, s_in = off_diagonal.sum(axis=1), off_diagonal.sum(axis=0)
+
+    m, W = max(len(rows), 1), off_diagonal.sum() or 1.
+
+    p = np.minimum(1., np.outer(k_out, k_in) / m)
+    np.fill_diagonal(p, 0.)
+
+    present = rng.random((n, n)) < p
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(present, np.outer(s_out, s_in) / (W * p), 0.)
+
+    null = rng.exponential(1., size=(n, n)) * mean
+    null[np.diag_indices(n)] = np.diag(g)
+    return null
+
+
+def null_model_stack(g, n_samples, method='weight_shuffle', seed=0, start=0):
+    '''
+    (n_samples, n, n) stack of randomised versions of the adjacency matrix g.
+    Sample k only depends on (seed, start + k), so a stack generated in
+    chunks equals the stack generated at once. Self-loops are kept as
+    observed.
+
+      weight_shuffle       topology kept, weights permuted among the edges
+      strength_preserving  in/out degrees and strengths kept
+      configuration        degrees and strengths kept in expectation
+    '''
+    if method not in NULL_MODELS:
+        raise ValueError(f"Unknown null model {method}, expected one of {NULL_MODELS}")
+
+    g = np.asarray(g, dtype=float)
+    generate = {'weight_shuffle': _weight_shuffle,
+                'strength_preserving': _strength_preserving,
+                'configuration': _configuration}[method]
+
+    seeds = np.random.SeedSequence(seed).spawn(start + n_samples)[start:]
+    stack = np.stack([generate(g, np.random.default_rng(s)) for s in seeds])
+
+    if method == 'strength_preserving':
+        _fit_strengths(stack, g)
+
+    return stack
+
+
+def gfi_batch(stack, tol):
+    '''
+    godfhater_index of every matrix of a (K, n, n) stack: for each node i
+    the sum over unconnected pairs j > k of g[j,i]*g[k,i]
+    '''
+    unconnected = np.maximum(stack, stack.transpose(0, 2, 1)) < tol
+    M = np.tril(unconnected, k=-1).astype(stack.dtype)
+    return ((M @ stack) * stack).sum(axis=1)
+
+
+def favor_batch(stack, transpose=False):
+    '''
+    favor_centrality of every matrix of a (K, n, n) stack: the row sums of
+    g^2 (the column sums when transpose is set), as g (g 1)
+    '''
+    if transpose:
+        stack = stack.transpose(0, 2, 1)
+    return (stack @ stack.sum(axis=2)[:, :, None])[:, :, 0]
+
+
+def bridging_batch(stack, p=1, T=5):
+    '''
+    bridging_centrality of every matrix of a (K, n, n) stack, by the exact
+    first-use recursion of bridging_matrix applied to the whole stack
+    '''
+    P = p * np.asarray(stack, dtype=float)
+    K, n, _ = P.shape
+
+    # powers[b] = P^b, for b < T
+    powers = [np.broadcast_to(np.eye(n), (K, n, n))]
+    for _ in range(1, T):
+        powers.append(powers[-1] @ P)
+
+    r_cumulative = np.cumsum([Pb.sum(axis=2) for Pb in powers], axis=0)
+    l = [Pb.sum(axis=1) for Pb in powers]
+
+    return bridging_kernel(P, [Pb.transpose(0, 2, 1) for Pb in powers], l, r_cumulative)
+
+
+def _batch_features(stack, features, tol_gfi, p, T):
+    out = {}
+    for feature in features:
+        if feature == 'gfi':
+            out[feature] = gfi_batch(stack, tol_gfi)
+        elif feature == 'bridging':
+            out[feature] = bridging_batch(stack, p=p, T=T)
+        elif feature == 'out_favor':
+            out[feature] = favor_batch(stack)
+        elif feature == 'in_favor':
+            out[feature] = favor_batch(stack, transpose=True)
+        else:
+            raise ValueError(f"Unknown feature {feature}, expected one of {FEATURES}")
+    return out
+
+
+def _bytes_per_sample(n, features, T):
+    # Working arrays of n x n floats held at once per matrix of the stack
+    n_arrays = 4 + (2 * T + 4 if 'bridging' in features else 0)
+    return n_arrays * n * n * 8
+
+
+def null_model_test(G, n_samples=100, method='weight_shuffle', features=FEATURES,
+                    tol_gfi=0.01, p=1, T=5, seed=0, memory_budget=2**30):
+    '''
+    Significance of the centralities of every node of G against n_samples
+    randomised networks of the given null model. The stack is generated and
+    evaluated in chunks sized to `memory_budget` bytes.
+
+    Returns a (country_industry, feature) indexed DataFrame with the
+    observed value, the mean and std of the null distribution, the z-score
+    and the empirical p-value (1 + #{null >= observed}) / (n_samples + 1).
+    '''
+    if len(G) == 0:
+        raise nx.NetworkXPointlessConcept('cannot compute centrality for the null graph')
+
+    g = nx.linalg.graphmatrix.adjacency_matrix(G).toarray().astype(float)
+    n = len(g)
+
+    observed = _batch_features(g[None], features, tol_gfi, p, T)
+
+    chunk = int(max(1, memory_budget // _bytes_per_sample(n, features, T)))
+
+    null = {f: [] for f in features}
+    for start in range(0, n_samples, chunk):
+        stack = null_model_stack(g, min(chunk, n_samples - start), method=method, seed=seed, start=start)
+        for feature, values in _batch_features(stack, features, tol_gfi, p, T).items():
+            null[feature].append(values)
+        del stack
+
+    df = []
+    for feature in features:
+        values = np.concatenate(null[feature])
+        mean, std = values.mean(axis=0), values.std(axis=0, ddof=1) if n_samples > 1 else np.zeros(n)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z_score = np.where(std > 0, (observed[feature][0] - mean) / std, np.nan)
+        exceed = (values >= observed[feature]).sum(axis=0)
+
+        df.append(pd.DataFrame({
+            'country_industry': list(G), 'feature': feature,
+            'observed': observed[feature][0], 'null_mean': mean, 'null_std': std,
+            'z_score': z_score, 'p_value': (1 + exceed) / (n_samples + 1),
+        }))
+
+    return pd.concat(df, ignore_index=True).set_index(['country_industry', 'feature'])
@@ -0,0 +1,90 @@
+from collections import deque
+
+import numpy as np
+
+from src.utils.utils_multiplex import NodeRegistry
+
+
+class RollingWindowSums:
+    '''
+    Averages of a sequence of yearly networks over rolling windows of every
+    length in `windows`, kept as running sums: each pushed year is added to
+    the sums of every window length and the year leaving each window is
+    subtracted, so a full series of windows costs one pass over the years.
+
+    Links are aligned on a NodeRegistry that grows with the new nodes of
+    every year. A count of the years each link is present in the window
+    tells a link that left the window (count 0, weight reset to 0) from the
+    rounding left over by the subtraction.
+
+        rolling = RollingWindowSums(windows=(3, 5))
+        for year, G in ...:
+            for window, years, g, nodes in rolling.push(year, *graph_arrays(G)):
+                ...
+    '''
+    def __init__(self, windows=(3, 5)):
+        self.windows = sorted(set(int(w) for w in windows))
+        if not self.windows or self.windows[0] < 1:
+            raise ValueError(f"Windows must be positive numbers of years, got {windows}")
+
+        self.registry = NodeRegistry()
+        self._history = deque(maxlen=self.windows[-1] + 1)
+        self._sums = {w: np.zeros((0, 0)) for w in self.windows}
+        self._counts = {w: np.zeros((0, 0), dtype=np.int32) for w in self.windows}
+        self._presence = {w: np.zeros(0, dtype=np.int32) for w in self.windows}
+
+    def _grow(self):
+        n = len(self.registry)
+        for w in self.windows:
+            m = len(self._presence[w])
+            if m == n:
+                continue
+            self._sums[w] = np.pad(self._sums[w], ((0, n - m), (0, n - m)))
+            self._counts[w] = np.pad(self._counts[w], ((0, n - m), (0, n - m)))
+            self._presence[w] = np.pad(self._presence[w], (0, n - m))
+
+    def _add(self, w, entry, sign):
+        _, ids, rows, cols, weights = entry
+        np.add.at(self._sums[w], (ids[rows], ids[cols]), sign * weights)
+        np.add.at(self._counts[w], (ids[rows], ids[cols]), sign)
+        self._presence[w][ids] += sign
+
+    def push(self, year, nodes, rows, cols, weights):
+        '''
+        Add the network of `year`, as node labels and COO edge arrays, and
+        return the windows it completes as (window, years, g, nodes): the
+        window length, the years it spans, the average adjacency matrix and
+        the nodes present in any of those years
+        '''
+        ids = self.registry.add(nodes).ids(nodes)
+        self._grow()
+
+        entry = (str(year), ids, np.asarray(rows), np.asarray(cols), np.asarray(weights, dtype=float))
+        self._history.append(entry)
+
+        completed = []
+        for w in self.windows:
+            self._add(w, entry, 1)
+            if len(self._history) > w:
+                self._add(w, self._history[-w - 1], -1)
+            if len(self._history) >= w:
+                completed.append(self.window(w))
+        return completed
+
+    def window(self, w):
+        '''
+        (window, years, g, nodes) of the last w pushed years
+        '''
+        years = [entry[0] for entry in list(self._history)[-w:]]
+        keep = self._presence[w] > 0
+
+        g = np.where(self._counts[w] > 0, self._sums[w], 0.)[np.ix_(keep, keep)] / w
+        nodes = [label for label, k in zip(self.registry.labels, keep) if k]
+        return w, years, g, nodes
+
+
+def window_key(years):
+    '''
+    Folder of a window, e.g. 2005_2007
+    '''
+    return f'{years[0]}_{years[-1]}'
@@ -1,42 +1,310 @@
 import networkx as nx
 from pathlib import Path
 import os
+import re
+import time
+import queue
+import logging
+import tempfile
+import threading
 import boto3
+from concurrent.futures import Future
 from urllib.parse import urlparse
+from boto3.exceptions import S3UploadFailedError
+from botocore.exceptions import ClientError, HTTPClientError, ConnectionError as BotoConnectionError
 
+from src.utils.utils_graphml import GraphArrays, read_graphml_arrays, write_graphml_arrays
+from src.utils.utils_instrumentation import current_keys, span, timed
+
+logger = logging.getLogger(__name__)
+
+# S3 error codes worth retrying
+TRANSIENT_ERROR_CODES = {'InternalError', 'ServiceUnavailable', 'SlowDown', 'Throttling', 'ThrottlingException',
+                         'RequestTimeout', 'RequestTimeTooSkewed', '500', '502', '503', '504'}
+
+# Error code in the message of a ClientError, kept by the exceptions wrapping it
+ERROR_CODE_PATTERN = re.compile(r'An error occurred \(([^)]+)\)')
+
+def s3_resource():
+    '''
+    boto3 S3 resource, pointed at $S3_ENDPOINT_URL when set (e.g. a local
+    moto or MinIO stand-in)
+    '''
+    return boto3.resource('s3', endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None)
+
+def configure_s3_endpoint(endpoint_url):
+    '''
+    Route both the boto3 helpers in this module and the pandas s3:// reads and
+    writes (through fsspec/s3fs) to `endpoint_url`
+    '''
+    import fsspec.config
+
+    os.environ['S3_ENDPOINT_URL'] = endpoint_url
+    fsspec.config.conf.setdefault('s3', {})['client_kwargs'] = {'endpoint_url': endpoint_url}
+
+def _local_graphml():
+    # Unique local copy, so that concurrent reads and uploads do not collide
+    fd, local_network_path = tempfile.mkstemp(suffix='.graphml')
+    os.close(fd)
+    return local_network_path
+
+@timed('read_graphml')
 def read_s3_graphml(path: str,
-                    local_network_path = f'G.graphml'):
- 
+                    local_network_path = None,
+                    arrays = False):
+    '''
+    Graph at the S3 path, or its GraphArrays with `arrays` (streamed, no
+    networkx graph is built)
+    '''
+
+    local_network_path = local_network_path or _local_graphml()
     o = urlparse(path, allow_fragments=False)
     bucket=o.netloc
     s3_path=o.path
     if s3_path[0] == '/': s3_path = s3_path[1:]
 
-    s3 = boto3.resource('s3')
+    s3 = s3_resource()
     s3.meta.client.download_file(bucket, s3_path, local_network_path)
 
-    G = nx.readwrite.graphml.read_graphml(local_network_path)
+    if arrays:
+        G = read_graphml_arrays(local_network_path)
+    else:
+        G = nx.readwrite.graphml.read_graphml(local_network_path)
  
     os.remove(local_network_path)
     
     return G
 
+@timed('write_graphml')
 def write_s3_graphml(G,
                      path: str,
-                     local_network_path = f'G.graphml'):
- 
+                     local_network_path = None):
+    '''
+    Upload G, a graph or GraphArrays (streamed by write_graphml_arrays), to
+    the S3 path
+    '''
+    local_network_path = local_network_path or _local_graphml()
     o = urlparse(path, allow_fragments=False)
     bucket=o.netloc
     s3_path=o.path
     if s3_path[0] == '/': s3_path = s3_path[1:]
 
-    nx.readwrite.graphml.write_graphml(G, local_network_path)
+    if isinstance(G, GraphArrays):
+        write_graphml_arrays(local_network_path, G)
+    else:
+        nx.readwrite.graphml.write_graphml(G, local_network_path)
 
-    s3 = boto3.resource('s3')
+    s3 = s3_resource()
     s3.meta.client.upload_file(local_network_path, bucket, s3_path)
 
-    G = nx.readwrite.graphml.read_graphml(local_network_path)
+    if not isinstance(G, GraphArrays):
+        G = nx.readwrite.graphml.read_graphml(local_network_path)
  
     os.remove(local_network_path)
     
-    return G
\ No newline at end of file
+    return G
+
+@timed('write_npz')
+def write_s3_npz(arrays, path):
+    '''
+    Save the {name: array} dict as an uncompressed .npz at the path (S3 or
+    local, through fsspec)
+    '''
+    import fsspec
+    import numpy as np
+
+    with fsspec.open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+@timed('read_npz')
+def read_npz(path, keys=None):
+    '''
+    {name: array} of the .npz at the path, only the `keys` members if given
+    (the other members are not read)
+    '''
+    import fsspec
+    import numpy as np
+
+    with fsspec.open(path, 'rb') as f, np.load(f) as npz:
+        return {key: npz[key] for key in (npz.files if keys is None else keys) if key in npz.files}
+
+
+def _error_chain(exc):
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        yield exc
+        exc = exc.__cause__ or exc.__context__
+
+
+def is_transient(exc):
+    '''
+    Whether a failed upload is worth retrying: connection problems, timeouts
+    and S3 throttling or server errors. The writers wrap the botocore
+    ClientError (boto3 upload_file in an S3UploadFailedError, s3fs in an
+    OSError), so the chain of causes is searched for it and, when the
+    wrapper dropped it, the error code is read from the message.
+    '''
+    for error in _error_chain(exc):
+        if isinstance(error, ClientError):
+            return str(error.response.get('Error', {}).get('Code')) in TRANSIENT_ERROR_CODES
+        if isinstance(error, (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError)):
+            return True
+        if isinstance(error, (S3UploadFailedError, OSError)):
+            code = ERROR_CODE_PATTERN.search(str(error))
+            if code is not None:
+                return code.group(1) in TRANSIENT_ERROR_CODES
+    return False
+
+
+class AsyncUploader:
+    '''
+    Write-behind queue of uploads run by background threads while the caller
+    keeps computing. At most `max_pending` uploads wait in the queue, submit
+    blocks beyond that (backpressure). Transient failures (is_transient) are
+    retried `retries` times with exponential backoff; other failures, and
+    retries exhausted, are raised by the next flush, wait or close.
+
+    Submitted objects are serialised in the background, so they must not be
+    modified after submission.
+
+        with AsyncUploader() as uploader:
+            uploader.write_graphml(G, 's3://bucket/2005/A_country.graphml')
+            uploader.to_parquet(df, 's3://bucket/2005/gdp.parquet')
+            uploader.write_npz(arrays, 's3://bucket/2005/A_country_weights.npz')
+            ...
+            uploader.flush()   # every upload done before reading them back
+    '''
+    def __init__(self, max_pending=8, workers=2, retries=3, backoff=1.):
+        self.retries = retries
+        self.backoff = backoff
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.pending = {}
+        self.errors = []
+        self.lock = threading.Lock()
+
+        self.threads = [threading.Thread(target=self._worker, name=f'uploader-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, path, write, *args, **kwargs):
+        '''
+        Queue write(*args, **kwargs), the upload of `path`. Returns its Future.
+        '''
+        future = Future()
+        with self.lock:
+            self.pending[path] = future
+        self.queue.put((path, write, args, kwargs, current_keys(), future))
+        return future
+
+    def write_graphml(self, G, path):
+        return self.submit(path, write_s3_graphml, G, path)
+
+    def to_parquet(self, df, path, **kwargs):
+        return self.submit(path, df.to_parquet, path, **kwargs)
+
+    def write_npz(self, arrays, path):
+        return self.submit(path, write_s3_npz, arrays, path)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            path, write, args, kwargs, keys, future = item
+            try:
+                with span('upload', **keys):
+                    self._write(path, write, args, kwargs)
+            except Exception as exc:
+                logger.error("Upload of %s failed: %r", path, exc)
+                with self.lock:
+                    self.errors.append((path, exc))
+                future.set_exception(exc)
+            else:
+                future.set_result(path)
+            finally:
+                with self.lock:
+                    if self.pending.get(path) is future:
+                        del self.pending[path]
+                self.queue.task_done()
+
+    def _write(self, path, write, args, kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return write(*args, **kwargs)
+            except Exception as exc:
+                if attempt == self.retries or not is_transient(exc):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning("Upload of %s failed (%r), retrying in %.1fs", path, exc, delay)
+                time.sleep(delay)
+
+    def _raise_errors(self):
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            path, exc = errors[0]
+            raise RuntimeError(f"{len(errors)} upload(s) failed, first {path}") from exc
+
+    def wait(self, path):
+        '''
+        Block until the upload of `path`, if any is pending, is done
+        '''
+        with self.lock:
+            future = self.pending.get(path)
+        if future is not None:
+            future.exception()
+        self._raise_errors()
+
+    def flush(self):
+        '''
+        Barrier: block until every submitted upload is done
+        '''
+        with span('upload_flush'):
+            self.queue.join()
+        self._raise_errors()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_graphml(G, path, uploader=None):
+    '''
+    write_s3_graphml now, or behind the AsyncUploader when given
+    '''
+    if uploader is None:
+        return write_s3_graphml(G, path)
+    return uploader.write_graphml(G, path)
+
+
+def write_parquet(df, path, uploader=None):
+    '''
+    DataFrame.to_parquet now, or behind the AsyncUploader when given
+    '''
+    if uploader is None:
+        return df.to_parquet(path)
+    return uploader.to_parquet(df, path)
+
+
+def write_npz(arrays, path, uploader=None):
+    '''
+    write_s3_npz now, or behind the AsyncUploader when given
+    '''
+    if uploader is None:
+        return write_s3_npz(arrays, path)
+    return uploader.write_npz(arrays, path)
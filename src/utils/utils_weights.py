@@ -0,0 +1,206 @@
+import numpy as np
+
+# Log-spaced bin edges shared by every histogram, 10 per decade, so that the
+# histograms of any years and layers add up
+HISTOGRAM_EDGES = np.logspace(-15, 15, 301)
+
+# Relative accuracy of the quantiles of the QuantileSketch
+SKETCH_ACCURACY = 0.01
+
+# Most xmin candidates tried by fit_power_law, spread over the unique weights
+MAX_XMIN_CANDIDATES = 1000
+
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch of positive values (DDSketch): every value is
+    counted in the logarithmic bucket ceil(log_gamma(x)), gamma =
+    (1 + accuracy) / (1 - accuracy), so that any quantile is returned within
+    `accuracy` relative error and two sketches merge by adding their counts
+    '''
+    def __init__(self, accuracy=SKETCH_ACCURACY, keys=(), counts=()):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+
+    def __len__(self):
+        return int(self.counts.sum())
+
+    def _merge_counts(self, keys, counts):
+        keys, inverse = np.unique(np.concatenate([self.keys, keys]), return_inverse=True)
+        self.keys = keys
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]),
+                                  minlength=len(keys)).astype(np.int64)
+        return self
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[values > 0]
+        keys, counts = np.unique(np.ceil(np.log(values) / np.log(self.gamma)).astype(np.int64),
+                                 return_counts=True)
+        return self._merge_counts(keys, counts)
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError(f"Cannot merge sketches of accuracy {self.accuracy} and {other.accuracy}")
+        return self._merge_counts(other.keys, other.counts)
+
+    def quantile(self, q):
+        '''
+        Values at the quantiles q (scalar or array), NaN for an empty sketch
+        '''
+        q = np.asarray(q, dtype=float)
+        if len(self) == 0:
+            return np.full(q.shape, np.nan)
+        rank = q * (len(self) - 1)
+        k = self.keys[np.searchsorted(np.cumsum(self.counts), rank, side='right').clip(max=len(self.keys) - 1)]
+        return 2 * self.gamma ** k / (self.gamma + 1)
+
+
+class EdgeWeightSummary:
+    '''
+    Distribution of the positive edge weights of a network: the counts over
+    HISTOGRAM_EDGES, a QuantileSketch and, when kept, the sorted weights.
+    Summaries of several networks merge into the summary of their union.
+    '''
+    def __init__(self, histogram, sketch, weights=None):
+        self.histogram = np.asarray(histogram, dtype=np.int64)
+        self.sketch = sketch
+        self.weights = weights
+
+    def __len__(self):
+        return int(self.histogram.sum())
+
+    @classmethod
+    def from_weights(cls, weights, accuracy=SKETCH_ACCURACY):
+        '''
+        Summary of the positive entries of `weights`, a weight vector or an
+        adjacency matrix (NaN ignored)
+        '''
+        weights = np.asarray(weights, dtype=float).ravel()
+        weights = np.sort(weights[weights > 0])
+        histogram, _ = np.histogram(weights.clip(HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]), bins=HISTOGRAM_EDGES)
+        return cls(histogram, QuantileSketch(accuracy).add(weights), weights)
+
+    def merge(self, other):
+        weights = None
+        if self.weights is not None and other.weights is not None:
+            weights = np.sort(np.concatenate([self.weights, other.weights]))
+        sketch = QuantileSketch(self.sketch.accuracy, self.sketch.keys, self.sketch.counts).merge(other.sketch)
+        return EdgeWeightSummary(self.histogram + other.histogram, sketch, weights)
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+    def pdf(self):
+        '''
+        (bin centers, density) of the non-empty log bins, the probability
+        density powerlaw.plot_pdf draws
+        '''
+        widths = np.diff(HISTOGRAM_EDGES)
+        centers = np.sqrt(HISTOGRAM_EDGES[:-1] * HISTOGRAM_EDGES[1:])
+        density = self.histogram / (max(len(self), 1) * widths)
+        observed = self.histogram > 0
+        return centers[observed], density[observed]
+
+    def to_arrays(self):
+        arrays = dict(histogram=self.histogram, sketch_accuracy=np.array(self.sketch.accuracy),
+                      sketch_keys=self.sketch.keys, sketch_counts=self.sketch.counts)
+        if self.weights is not None:
+            arrays['weights'] = self.weights
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        sketch = QuantileSketch(float(arrays['sketch_accuracy']), arrays['sketch_keys'], arrays['sketch_counts'])
+        return cls(arrays['histogram'], sketch, arrays.get('weights'))
+
+
+def read_edge_weights(output_filepath, network, years, weights=False):
+    '''
+    {year: EdgeWeightSummary} of the network saved in every year folder as
+    <network>_weights.npz, with the raw weights only if `weights` (otherwise
+    only the histogram and sketch are read)
+    '''
+    from src.utils.utils_s3 import read_npz
+
+    keys = ['histogram', 'sketch_accuracy', 'sketch_keys', 'sketch_counts'] + (['weights'] if weights else [])
+    return {year: EdgeWeightSummary.from_arrays(read_npz(f'{output_filepath}/{year}/{network}_weights.npz', keys))
+            for year in years}
+
+
+def _ks_distances(log_x, candidates, alphas, chunk_size):
+    '''
+    KS distance between the tail above every candidate xmin (indices into
+    the sorted log weights log_x) and its fitted power law
+    '''
+    n = len(log_x)
+    i = np.arange(n)
+    distances = np.empty(len(candidates))
+    for start in range(0, len(candidates), chunk_size):
+        k = candidates[start:start + chunk_size, None]
+        alpha = alphas[start:start + chunk_size, None]
+        tail = i[None, :] >= k
+        n_tail = n - k
+
+        model = 1. - np.exp((1. - alpha) * (log_x[None, :] - log_x[k]))
+        upper = (i[None, :] - k + 1) / n_tail - model
+        lower = model - (i[None, :] - k) / n_tail
+        distances[start:start + chunk_size] = np.where(tail, np.maximum(upper, lower), 0.).max(axis=1)
+    return distances
+
+
+def fit_power_law(weights, xmin=None, max_candidates=MAX_XMIN_CANDIDATES, chunk_size=64):
+    '''
+    Continuous power-law fit of the tail of the positive weights, as
+    powerlaw.Fit does it (Clauset, Shalizi and Newman 2009): for every
+    candidate xmin the maximum likelihood exponent
+        alpha = 1 + n / sum(log(x / xmin))
+    over the n weights >= xmin, the xmin retained being the one of smallest
+    Kolmogorov-Smirnov distance D. All the candidates (the unique weights,
+    at most max_candidates of them evenly spread) are fitted at once from
+    suffix sums, and their D in blocks of chunk_size. Returns a dict of
+    alpha, xmin, sigma (standard error of alpha), D, n and n_tail.
+    '''
+    x = np.asarray(weights, dtype=float)
+    x = np.sort(x[x > 0])
+    if len(x) < 2:
+        return dict(alpha=np.nan, xmin=np.nan, sigma=np.nan, D=np.nan, n=len(x), n_tail=len(x))
+
+    log_x = np.log(x)
+    if xmin is None:
+        _, candidates = np.unique(x[:-1], return_index=True)
+        if len(candidates) > max_candidates:
+            candidates = candidates[np.linspace(0, len(candidates) - 1, max_candidates).round().astype(int)]
+    else:
+        candidates = np.array([np.searchsorted(x, xmin)])
+
+    suffix = np.cumsum(log_x[::-1])[::-1]
+    n_tail = len(x) - candidates
+    with np.errstate(divide='ignore'):
+        alphas = 1. + n_tail / (suffix[candidates] - n_tail * log_x[candidates])
+
+    distances = _ks_distances(log_x, candidates, alphas, chunk_size)
+    distances[~np.isfinite(alphas)] = np.inf
+    best = np.argmin(distances)
+
+    alpha, n = alphas[best], n_tail[best]
+    return dict(alpha=alpha, xmin=x[candidates[best]], sigma=(alpha - 1) / np.sqrt(n), D=distances[best],
+                n=len(x), n_tail=int(n))
+
+
+def fit_tails(weights, executor=None, **kwargs):
+    '''
+    fit_power_law of every {key: weights} (e.g. the years of a layer) on
+    `executor`, serially when None, as a DataFrame indexed by key
+    '''
+    import pandas as pd
+
+    keys = list(weights)
+    if executor is None:
+        fits = [fit_power_law(weights[key], **kwargs) for key in keys]
+    else:
+        futures = [executor.submit(fit_power_law, weights[key], **kwargs) for key in keys]
+        fits = [future.result() for future in futures]
+    return pd.DataFrame(fits, index=pd.Index(keys, name='year'))